@@ -0,0 +1,406 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+sys.path.append("..")
+sys.path.append("../reconstruct")
+sys.path.append("../optimal_observables")
+from processing import event_selection, kinematics, reco_store, synthetic, truth  # noqa: E402
+import observables  # noqa: E402
+from ttbar_dilepton import (  # noqa: E402
+    M_T_SEARCH,
+    NU_ETA_GRID,
+    RECO_NAMES,
+    event_objects,
+    event_rng,
+    get_neutrino_momentum,
+    preselect_events,
+    reconstruct_event,
+)
+
+
+# Events of the columnar benchmarks (selection, lepton pairing, observables and dataset)
+N_EVENTS = [1000, 10000, 100000]
+# Events of the per-event benchmarks (reconstruct_event and get_neutrino_momentum)
+N_RECO_EVENTS = [10, 50]
+# Settings of the ConditionedObservablesFC benchmark
+DATASET_SETTINGS = {"n_out_samples": 100, "low_exp": -1.0, "high_exp": 1.0, "n_exp": 10}
+# Relative slowdown reported as a regression when comparing with a baseline
+REGRESSION_THRESHOLD = 0.1
+
+
+def time_call(function: Callable, n_events: int, n_repeats: int) -> Dict:
+    """Time repeated calls of a function. The first call is timed separately since it
+    includes JIT compilations and warms up caches.
+
+    :param function: Function to call without arguments.
+    :type function: Callable
+    :param n_events: Number of events processed by each call.
+    :type n_events: int
+    :param n_repeats: Number of timed calls after the first one.
+    :type n_repeats: int
+    :return: Time of the first call, time of each repeat, best and median time and
+             throughput of the best repeat.
+    :rtype: Dict
+    """
+    start = time.perf_counter()
+    function()
+    first_call = time.perf_counter() - start
+    times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {
+        "n_events": n_events,
+        "first_call": first_call,
+        "times": times,
+        "min": min(times),
+        "median": float(np.median(times)),
+        "events_per_second": n_events / min(times),
+    }
+
+
+def benchmark_selection(tree: synthetic.SyntheticTree, n_repeats: int) -> Dict[str, Dict]:
+    """Time object selection of all events in a tree.
+
+    :param tree: Generated events.
+    :type tree: synthetic.SyntheticTree
+    :param n_repeats: Number of timed calls.
+    :type n_repeats: int
+    :return: Timings by selection function.
+    :rtype: Dict[str, Dict]
+    """
+    return {
+        function.__name__: time_call(lambda: function(tree), len(tree), n_repeats)
+        for function in [
+            event_selection.select_jet,
+            event_selection.select_electron,
+            event_selection.select_muon,
+        ]
+    }
+
+
+def benchmark_reconstruct_event(
+    selected: Dict,
+    leptons: Dict[str, np.ndarray],
+    event_idxs: np.ndarray,
+    random_seed: int,
+    n_repeats: int,
+) -> Dict:
+    """Time reconstruct_event over events that pass the preselection.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict
+    :param leptons: Lepton pairs of the same events (see kinematics.dilepton_kinematics).
+    :type leptons: Dict[str, np.ndarray]
+    :param event_idxs: Events to reconstruct.
+    :type event_idxs: np.ndarray
+    :param random_seed: Seed of the reconstruction.
+    :type random_seed: int
+    :param n_repeats: Number of timed calls.
+    :type n_repeats: int
+    :return: Timings of the loop over the events.
+    :rtype: Dict
+    """
+
+    def reconstruct():
+        for idx in event_idxs:
+            reconstruct_event(
+                **event_objects(selected, leptons, idx),
+                idx=idx,
+                rng=event_rng(random_seed, idx),
+            )
+
+    return time_call(reconstruct, len(event_idxs), n_repeats)
+
+
+def benchmark_neutrino_momentum(
+    momenta: Dict[str, np.ndarray], n_events: int, n_repeats: int
+) -> Dict:
+    """Time get_neutrino_momentum on the (top mass, eta) grid of reconstruct_event,
+    with one b-jet permutation per event built from the truth record.
+
+    :param momenta: Truth four-momenta by name (see truth.TRUTH_PARTICLES).
+    :type momenta: Dict[str, np.ndarray]
+    :param n_events: Number of events.
+    :type n_events: int
+    :param n_repeats: Number of timed calls.
+    :type n_repeats: int
+    :return: Timings of the solver and number of solved rows.
+    :rtype: Dict
+    """
+    n_points = NU_ETA_GRID.shape[0] * M_T_SEARCH.shape[0]
+    n_rows = n_events * n_points
+
+    def rows(p):
+        return jnp.array(np.repeat(p[:n_events], n_points, axis=0))
+
+    nu_eta = np.tile(np.repeat(NU_ETA_GRID, M_T_SEARCH.shape[0], axis=0), (n_events, 1))
+    inputs = {
+        "nu_eta_t": jnp.array(nu_eta[:, 0:1]),
+        "p_l_t": rows(momenta["l_plus"]),
+        "p_b_t": rows(momenta["b"]),
+        "m_b_t": jnp.full((n_rows, 1), synthetic.M_B),
+        "nu_eta_tbar": jnp.array(nu_eta[:, 1:]),
+        "p_l_tbar": rows(momenta["l_minus"]),
+        "p_b_tbar": rows(momenta["bbar"]),
+        "m_b_tbar": jnp.full((n_rows, 1), synthetic.M_B),
+        "m_t_val": jnp.array(np.tile(M_T_SEARCH, n_rows // M_T_SEARCH.shape[0])[:, None]),
+    }
+
+    def solve():
+        jax.block_until_ready(get_neutrino_momentum(**inputs))
+
+    return {**time_call(solve, n_events, n_repeats), "n_rows": n_rows}
+
+
+def truth_reconstructions(tree: synthetic.SyntheticTree) -> Dict[str, np.ndarray]:
+    """Fill the reconstruction outputs with the truth four-momenta, so that the
+    observables can be benchmarked without running the reconstruction.
+
+    :param tree: Generated events.
+    :type tree: synthetic.SyntheticTree
+    :return: Columns of a reconstruction store (see RECO_NAMES).
+    :rtype: Dict[str, np.ndarray]
+    """
+    truth_index = truth.build_truth_index(tree)
+    recos = {
+        reco_name: truth.truth_four_momenta(tree, truth_index, truth_name)
+        for reco_name, truth_name in truth.RECO_TRUTH_PAIRS.items()
+    }
+    recos["idx"] = np.arange(len(tree)).reshape(-1, 1)
+    recos["weight"] = np.ones((len(tree), 1))
+    return {name: recos[name] for name in RECO_NAMES}
+
+
+def benchmark_dataset(recos: Dict[str, np.ndarray], n_repeats: int) -> Dict:
+    """Time ConditionedObservablesFC construction from a reconstruction store.
+
+    :param recos: Columns of a reconstruction store.
+    :type recos: Dict[str, np.ndarray]
+    :param n_repeats: Number of timed calls.
+    :type n_repeats: int
+    :return: Timings, or the reason the benchmark was skipped.
+    :rtype: Dict
+    """
+    n_events = len(recos["idx"])
+    try:
+        from data import ConditionedObservablesFC
+    except ImportError as error:
+        return {"n_events": n_events, "skipped": str(error)}
+
+    with tempfile.TemporaryDirectory() as store_path:
+        reco_store.write_store(store_path, recos, {"synthetic": True})
+        return time_call(
+            lambda: ConditionedObservablesFC([store_path], **DATASET_SETTINGS),
+            n_events,
+            n_repeats,
+        )
+
+
+def run_benchmarks(
+    n_events: List[int], n_reco_events: List[int], n_repeats: int, random_seed: int = 0
+) -> List[Dict]:
+    """Run every benchmark on generated events.
+
+    :param n_events: Event counts of the columnar benchmarks.
+    :type n_events: List[int]
+    :param n_reco_events: Event counts of the per-event benchmarks.
+    :type n_reco_events: List[int]
+    :param n_repeats: Number of timed calls of each benchmark.
+    :type n_repeats: int
+    :param random_seed: Seed of the generator and the reconstruction, defaults to 0.
+    :type random_seed: int, optional
+    :return: Timings of each benchmark and event count.
+    :rtype: List[Dict]
+    """
+    results = []
+
+    def add(name, result):
+        results.append({"name": name, **result})
+        timing = f"{result['min']:.4f} s" if "min" in result else result["skipped"]
+        print(f"{name:<28} {result.get('n_events', ''):>8} {timing}")
+
+    for n in n_events:
+        tree = synthetic.generate_ttbar_dilepton(n, random_seed)
+        for name, result in benchmark_selection(tree, n_repeats).items():
+            add(name, result)
+        selected = event_selection.select_objects(tree)
+        add(
+            "dilepton_kinematics",
+            time_call(lambda: kinematics.dilepton_kinematics(selected), n, n_repeats),
+        )
+        recos = truth_reconstructions(tree)
+        add(
+            "get_matrix",
+            time_call(
+                lambda: observables.get_matrix(
+                    recos["p_l_t"], recos["p_l_tbar"], recos["p_top"], recos["p_tbar"]
+                ),
+                n,
+                n_repeats,
+            ),
+        )
+        add("ConditionedObservablesFC", benchmark_dataset(recos, n_repeats))
+
+    # Enough events that the largest count passes the preselection
+    tree = synthetic.generate_ttbar_dilepton(10 * max(n_reco_events), random_seed)
+    selected = event_selection.select_objects(tree)
+    leptons = kinematics.dilepton_kinematics(selected)
+    passed = np.nonzero(preselect_events(selected, leptons=leptons))[0]
+    truth_index = truth.build_truth_index(tree)
+    momenta = {
+        name: truth.truth_four_momenta(tree, truth_index, name)
+        for name in ["l_plus", "l_minus", "b", "bbar"]
+    }
+    for n in n_reco_events:
+        add(
+            "reconstruct_event",
+            benchmark_reconstruct_event(selected, leptons, passed[:n], random_seed, n_repeats),
+        )
+        add("get_neutrino_momentum", benchmark_neutrino_momentum(momenta, n, n_repeats))
+    return results
+
+
+def git_commit() -> Dict[str, Optional[str]]:
+    """Get the commit of the repository and whether it has uncommitted changes.
+
+    :return: Commit hash (None outside a git repository) and dirty flag.
+    :rtype: Dict[str, Optional[str]]
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+def environment() -> Dict:
+    """Describe the software and machine the benchmarks run on, so that timings of
+    different runs can be compared.
+
+    :return: Python, numpy and JAX versions, JAX backend, platform, processor and
+             number of CPUs.
+    :rtype: Dict
+    """
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "jax": jax.__version__,
+        "jax_backend": jax.default_backend(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare_results(
+    results: List[Dict], baseline: List[Dict], threshold: float = REGRESSION_THRESHOLD
+) -> List[Dict]:
+    """Compare best times with the ones of a baseline run (e.g., of the previous commit).
+
+    :param results: Timings of the current run.
+    :type results: List[Dict]
+    :param baseline: Timings of the baseline run.
+    :type baseline: List[Dict]
+    :param threshold: Relative slowdown reported as a regression, defaults to
+                      REGRESSION_THRESHOLD.
+    :type threshold: float, optional
+    :return: Ratio of current to baseline time of each benchmark run by both.
+    :rtype: List[Dict]
+    """
+    baseline_times = {
+        (result["name"], result["n_events"]): result["min"]
+        for result in baseline
+        if "min" in result
+    }
+    comparison = []
+    for result in results:
+        key = (result["name"], result.get("n_events"))
+        if "min" not in result or key not in baseline_times:
+            continue
+        ratio = result["min"] / baseline_times[key]
+        comparison.append(
+            {
+                "name": result["name"],
+                "n_events": result["n_events"],
+                "baseline": baseline_times[key],
+                "current": result["min"],
+                "ratio": ratio,
+                "regression": ratio > 1 + threshold,
+            }
+        )
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--n_events", type=int, nargs="+", default=N_EVENTS)
+    parser.add_argument("--n_reco_events", type=int, nargs="+", default=N_RECO_EVENTS)
+    parser.add_argument("--n_repeats", type=int, default=3)
+    parser.add_argument("--random_seed", type=int, default=0)
+    parser.add_argument("--output_dir", default="results", help="Directory of the reports")
+    parser.add_argument("--baseline", default=None, help="Report to compare with")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.n_events, args.n_reco_events, args.n_repeats, random_seed=args.random_seed
+    )
+    git = git_commit()
+    timestamp = datetime.now(timezone.utc)
+    report = {
+        **git,
+        "timestamp": timestamp.isoformat(),
+        "environment": environment(),
+        "settings": {
+            "n_events": args.n_events,
+            "n_reco_events": args.n_reco_events,
+            "n_repeats": args.n_repeats,
+            "random_seed": args.random_seed,
+            "dataset": DATASET_SETTINGS,
+        },
+        "results": results,
+    }
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["baseline"] = {"path": args.baseline, "commit": baseline.get("commit")}
+        report["comparison"] = compare_results(results, baseline["results"], args.threshold)
+        for entry in report["comparison"]:
+            flag = "REGRESSION" if entry["regression"] else ""
+            print(
+                f"{entry['name']:<28} {entry['n_events']:>8} "
+                f"{entry['baseline']:.4f} s -> {entry['current']:.4f} s "
+                f"({entry['ratio']:.2f}x) {flag}"
+            )
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    commit = (git["commit"] or "nocommit")[:12]
+    output_path = os.path.join(
+        args.output_dir, f"{timestamp.strftime('%Y%m%dT%H%M%S')}_{commit}.json"
+    )
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {output_path}")
@@ -1,4 +1,5 @@
 import os
+import sys
 import numpy as np
 
 from typing import List
@@ -7,6 +8,9 @@ from torch.utils.data import Dataset
 
 import observables
 
+sys.path.append("..")
+from processing import reco_store  # noqa: E402
+
 
 class ConditionedObservablesFC(Dataset):
     def __init__(
@@ -36,6 +40,12 @@ class ConditionedObservablesFC(Dataset):
 
         batches = {name: [] for name in reco_names}
         for reconstructions_path in reconstructions_paths:
+            # Columns of a store are memory-mapped instead of read
+            if reco_store.is_store(reconstructions_path):
+                columns = reco_store.read_columns(reconstructions_path, reco_names)
+                for name in reco_names:
+                    batches[name].append(columns[name])
+                continue
             for batch_idx in range(10):
                 for name in reco_names:
                     batches[name].append(
@@ -45,8 +55,10 @@ class ConditionedObservablesFC(Dataset):
                             )
                         )
                     )
+        # A single path is used as is, so stores aren't copied into memory
         recos = {
-            name: np.concatenate(batches, axis=0) for name, batches in batches.items()
+            name: batches[0] if len(batches) == 1 else np.concatenate(batches, axis=0)
+            for name, batches in batches.items()
         }
         matrix = observables.get_matrix(
             p_l_t=recos["p_l_t"],
@@ -1,28 +1,39 @@
+import sys
 import numpy as np
 
+sys.path.append("..")
+from processing import lorentz  # noqa: E402
+
 
 def boost_to_frame(p_particle, p_frame):
-    b = -p_frame[:, :3] / p_frame[:, 3:]
-    b2 = np.sum(b ** 2, axis=1, keepdims=True)
+    # Four-momenta can be given as (N, 4) arrays or FourVectorBatch, and the boosted
+    # momenta are a FourVectorBatch
+    p_particle, p_frame = lorentz.as_batch(p_particle), lorentz.as_batch(p_frame)
+    bx, by, bz = (-p / p_frame.E for p in (p_frame.px, p_frame.py, p_frame.pz))
+    b2 = bx ** 2 + by ** 2 + bz ** 2
     gamma = 1 / np.sqrt(1 - b2)
-    bp = np.sum(p_particle[:, :3] * b, axis=1, keepdims=True)
+    bp = p_particle.px * bx + p_particle.py * by + p_particle.pz * bz
     gamma2 = np.clip((gamma - 1) / b2, a_min=0, a_max=None)
 
-    space_coords = (
-        p_particle[:, :3] + (gamma2 * bp * b) + (gamma * b * p_particle[:, 3:])
+    space_scale = (gamma2 * bp) + (gamma * p_particle.E)
+    return lorentz.FourVectorBatch(
+        p_particle.px + space_scale * bx,
+        p_particle.py + space_scale * by,
+        p_particle.pz + space_scale * bz,
+        gamma * (p_particle.E + bp),
     )
-    time_coord = gamma * (p_particle[:, 3:] + bp)
-    p_particle_boosted = np.concatenate([space_coords, time_coord], axis=1)
-    return p_particle_boosted
 
 
 def boost_to_com(p1, p2):
+    p1, p2 = lorentz.as_batch(p1), lorentz.as_batch(p2)
     p_com = p1 + p2
     return boost_to_frame(p1, p_com), boost_to_frame(p2, p_com), p_com
 
 
 def create_basis(top_p_com):
-    k_hat = top_p_com[:, :3] / np.linalg.norm(top_p_com[:, :3], axis=-1, keepdims=True)
+    top_p_com = lorentz.as_batch(top_p_com)
+    k_hat = np.stack([top_p_com.px, top_p_com.py, top_p_com.pz], axis=1)
+    k_hat /= top_p_com.p.reshape(-1, 1)
     p_hat = np.array([0, 0, 1]).reshape(1, -1)
     theta = np.arccos(np.sum(k_hat * p_hat, axis=-1, keepdims=True))
 
@@ -35,18 +46,24 @@ def create_basis(top_p_com):
 
 
 def calculate_cosine_obs(p_particle, k_hat, r_hat, n_hat):
-    basis_change = np.linalg.inv(np.stack([k_hat, r_hat, n_hat], axis=-1))
-    p_new_basis = np.matmul(basis_change, np.expand_dims(p_particle[:, :3], axis=-1))
-    obs = (
-        p_new_basis[:, :3] / np.linalg.norm(p_new_basis, axis=1, keepdims=True)
-    ).squeeze(-1)
-    cos_k = obs[:, 0:1]
-    cos_r = obs[:, 1:2]
-    cos_n = obs[:, 2:3]
+    # The basis is orthonormal, so the cosines are the projections on each axis
+    p_particle = lorentz.as_batch(p_particle)
+    cosines = []
+    for axis in (k_hat, r_hat, n_hat):
+        projection = (
+            p_particle.px * axis[:, 0] + p_particle.py * axis[:, 1] + p_particle.pz * axis[:, 2]
+        )
+        cosines.append((projection / p_particle.p).reshape(-1, 1))
+    cos_k, cos_r, cos_n = cosines
     return cos_k, cos_r, cos_n
 
 
 def get_matrix(p_l_t, p_l_tbar, p_top, p_tbar, only_cosine_terms=False):
+    # Four-momenta can be given as (N, 4) arrays or FourVectorBatch. Arrays are
+    # wrapped without copies, and the coordinates are never stacked back
+    p_l_t, p_l_tbar, p_top, p_tbar = (
+        lorentz.as_batch(p) for p in (p_l_t, p_l_tbar, p_top, p_tbar)
+    )
     p_top_com, p_tbar_com, p_com = boost_to_com(p_top, p_tbar)
     k_hat, r_hat, n_hat = create_basis(p_top_com)
 
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+from processing import profiling
+
+
+class CachedBranch:
+    """Stand-in for a TBranch that reads its array through a BranchCache."""
+
+    def __init__(self, cache: "BranchCache", key: str):
+        self.cache = cache
+        self.key = key
+
+    def array(self):
+        return self.cache.array(self.key)
+
+
+class BranchCache:
+    """Column store around a Delphes TTree. Each branch is read and decompressed
+    lazily the first time it is requested and kept in memory afterwards. It can be
+    passed anywhere a TTree is expected since `cache[key].array()` works the same way.
+    Least recently used branches are evicted when max_bytes is exceeded. With an
+    entry range only the events in [entrystart, entrystop) are read. Reads are timed
+    as the 'read' stage of the active profiler.
+
+    :param tree: Delphes event TTree.
+    :type tree: TTree
+    :param max_bytes: Memory cap for the cached arrays, defaults to None (no cap).
+    :type max_bytes: int, optional
+    :param entrystart: First entry to read, defaults to None (first entry in tree).
+    :type entrystart: int, optional
+    :param entrystop: Entry after the last one to read, defaults to None (end of tree).
+    :type entrystop: int, optional
+    """
+
+    def __init__(
+        self,
+        tree,
+        max_bytes: Optional[int] = None,
+        entrystart: Optional[int] = None,
+        entrystop: Optional[int] = None,
+    ):
+        self.tree = tree
+        self.max_bytes = max_bytes
+        self.entrystart = entrystart
+        self.entrystop = entrystop
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._arrays = OrderedDict()
+
+    def __getitem__(self, key: str) -> CachedBranch:
+        return CachedBranch(self, key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._arrays
+
+    def __len__(self) -> int:
+        entrystart = 0 if self.entrystart is None else self.entrystart
+        entrystop = len(self.tree) if self.entrystop is None else self.entrystop
+        return entrystop - entrystart
+
+    def array(self, key: str):
+        """Get the array stored in a branch, reading it from the TTree only if
+        it isn't cached.
+
+        :param key: Key for TBranchElement (e.g., 'Jet.PT').
+        :type key: str
+        :return: Array stored in the branch.
+        :rtype: JaggedArray
+        """
+        if key in self._arrays:
+            self.hits += 1
+            self._arrays.move_to_end(key)
+            return self._arrays[key]
+
+        self.misses += 1
+        with profiling.stage("read"):
+            if self.entrystart is None and self.entrystop is None:
+                branch_array = self.tree[key].array()
+            else:
+                branch_array = self.tree[key].array(
+                    entrystart=self.entrystart, entrystop=self.entrystop
+                )
+        self._arrays[key] = branch_array
+        self._evict(keep=key)
+        return branch_array
+
+    @property
+    def nbytes(self) -> int:
+        return sum(_nbytes(branch_array) for branch_array in self._arrays.values())
+
+    def _evict(self, keep: str):
+        if self.max_bytes is None:
+            return
+        while self.nbytes > self.max_bytes and len(self._arrays) > 1:
+            key = next(iter(self._arrays))
+            if key == keep:
+                self._arrays.move_to_end(key)
+                continue
+            del self._arrays[key]
+            self.evictions += 1
+
+    def clear(self):
+        self._arrays.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Summarize cache usage.
+
+        :return: Hits, misses, evictions, number of cached branches and bytes held.
+        :rtype: Dict[str, int]
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "n_branches": len(self._arrays),
+            "nbytes": self.nbytes,
+        }
+
+
+def iterate_chunks(
+    tree, chunk_size: int, max_bytes: Optional[int] = None
+) -> Iterator[Tuple[int, BranchCache]]:
+    """Split TTree in consecutive entry ranges so that only one of them is held
+    in memory at a time.
+
+    :param tree: Delphes event TTree.
+    :type tree: TTree
+    :param chunk_size: Number of entries in each chunk.
+    :type chunk_size: int
+    :param max_bytes: Memory cap for each chunk's cache, defaults to None (no cap).
+    :type max_bytes: int, optional
+    :yield: First entry of the chunk and a branch cache restricted to the chunk.
+    :rtype: Iterator[Tuple[int, BranchCache]]
+    """
+    n_entries = len(tree)
+    for entrystart in range(0, n_entries, chunk_size):
+        entrystop = min(entrystart + chunk_size, n_entries)
+        yield entrystart, BranchCache(
+            tree, max_bytes=max_bytes, entrystart=entrystart, entrystop=entrystop
+        )
+
+
+def _nbytes(branch_array) -> int:
+    return int(getattr(branch_array, "nbytes", 0))
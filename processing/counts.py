@@ -1,26 +1,36 @@
+import numpy as np
+from awkward.array.jagged import JaggedArray
 from processing import event_selection
-from typing import List
+from typing import Dict
 
 
-def n_particles_from_tag(events, key: str) -> List[int]:
-    """Calculate number of particles in each event based on boolean tags
-    recorded on a TTree.
+def n_particles_from_tag(
+    events, key: str, mask: JaggedArray = None, btag_bit: int = None
+) -> np.ndarray:
+    """Calculate number of particles in each event based on tags recorded on a
+    TTree. A particle is counted if any bit of its tag is set, or only btag_bit
+    if given (see event_selection.select_bjet).
 
     :param events: Delphes event TTree
     :type events: TTree
     :param key: Key for TBranchElement that contains
-                the boolean tag (e.g., 'Jet.BTag')
+                the tag bitmask (e.g., 'Jet.BTag')
     :type key: str
+    :param mask: Mask applied to the particles before counting tags,
+                 defaults to None (all particles).
+    :type mask: JaggedArray, optional
+    :param btag_bit: Bit of the tag's working point, defaults to None (any bit).
+    :type btag_bit: int, optional
     :return: Number of particles in each event.
-    :rtype: List[int]
+    :rtype: np.ndarray
     """
-    particle_count = []
-    for event in events[key].array():
-        particle_count.append(sum(event))
-    return particle_count
+    tags = events[key].array()
+    if mask is not None:
+        tags = tags[mask]
+    return np.asarray(event_selection.select_bjet(tags, btag_bit).sum(), dtype=np.int64)
 
 
-def n_particles(events, key: str) -> List[int]:
+def n_particles(events, key: str, mask: JaggedArray = None) -> np.ndarray:
     """Calculate number of particles in each event based on the length of
     a recorded quantity on a TTree.
 
@@ -29,13 +39,38 @@ def n_particles(events, key: str) -> List[int]:
     :param key: Key for TBranchElement that records particle quantity
                 to use as proxy for number of particles (e.g., 'Jet.PT')
     :type key: str
+    :param mask: Selection mask for the particles, defaults to None (apply the
+                 selection criteria for the particle).
+    :type mask: JaggedArray, optional
     :return: Number of particles in each event.
-    :rtype: List[int]
+    :rtype: np.ndarray
     """
-    particle = key.split(".")[0].lower()
-    mask = getattr(event_selection, f"select_{particle}")(events)
-    particle_count = []
-    key_events = events[key].array()[mask]
-    for event in key_events:
-        particle_count.append(len(event))
-    return particle_count
+    if mask is None:
+        particle = key.split(".")[0].lower()
+        mask = getattr(event_selection, f"select_{particle}")(events)
+    return np.asarray(mask.sum(), dtype=np.int64)
+
+
+def multiplicities(events, masks: Dict[str, JaggedArray] = None) -> Dict[str, np.ndarray]:
+    """Calculate number of selected jets, b-jets, electrons and muons in each event
+    sharing a single selection.
+
+    :param events: Delphes event TTree
+    :type events: TTree
+    :param masks: Selection masks for 'jet', 'electron' and 'muon', defaults to None
+                  (apply the selection criteria).
+    :type masks: Dict[str, JaggedArray], optional
+    :return: Number of particles in each event by particle type.
+    :rtype: Dict[str, np.ndarray]
+    """
+    masks = dict(masks or {})
+    for particle in ["jet", "electron", "muon"]:
+        if particle not in masks:
+            masks[particle] = getattr(event_selection, f"select_{particle}")(events)
+
+    return {
+        "jet": n_particles(events, "Jet.PT", mask=masks["jet"]),
+        "bjet": n_particles_from_tag(events, "Jet.BTag", mask=masks["jet"]),
+        "electron": n_particles(events, "Electron.PT", mask=masks["electron"]),
+        "muon": n_particles(events, "Muon.PT", mask=masks["muon"]),
+    }
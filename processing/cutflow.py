@@ -0,0 +1,220 @@
+import time
+import numpy as np
+
+from typing import Callable, Dict, List, Optional
+from awkward.array.jagged import JaggedArray
+
+from processing import event_selection
+
+
+COLLECTION_BRANCHES = {"jet": "Jet.PT", "electron": "Electron.PT", "muon": "Muon.PT"}
+
+
+class CutFlow:
+    """Ordered list of named selection cuts evaluated over all events at once.
+
+    Object cuts act on one collection ('jet', 'electron' or 'muon') and return a
+    boolean JaggedArray that is combined with the objects that passed previous
+    cuts. Event cuts return a boolean array with one entry per event. Every cut
+    is called as cut(events, masks), where masks holds the current object masks.
+    """
+
+    def __init__(self):
+        self.cuts = []
+
+    def register(self, name: str, cut: Callable, collection: Optional[str] = None):
+        """Add cut at the end of the cut flow.
+
+        :param name: Name of the cut in the cut flow.
+        :type name: str
+        :param cut: Function that creates the mask for the cut.
+        :type cut: Callable
+        :param collection: Collection for object cuts, defaults to None (event cut).
+        :type collection: str, optional
+        """
+        if collection is not None and collection not in COLLECTION_BRANCHES:
+            raise ValueError(f"Unknown collection: {collection}")
+        self.cuts.append((name, cut, collection))
+
+    def run(self, events) -> List[Dict]:
+        """Apply the cuts in order and count events and objects passing each of them.
+
+        :param events: Delphes event TTree
+        :type events: TTree
+        :return: Name, passing events and objects, events per channel and
+                 wall time in seconds for each cut.
+        :rtype: List[Dict]
+        """
+        masks = {}
+        for collection, branch in COLLECTION_BRANCHES.items():
+            counts = events[branch].array().counts
+            masks[collection] = JaggedArray.fromcounts(
+                counts, np.ones(counts.sum(), dtype=bool)
+            )
+        event_mask = np.ones(len(masks["jet"]), dtype=bool)
+
+        results = []
+        for name, cut, collection in self.cuts:
+            start = time.perf_counter()
+            mask = cut(events, masks)
+            if collection is None:
+                event_mask = event_mask & np.asarray(mask, dtype=bool)
+            else:
+                masks[collection] = masks[collection] * mask
+            elapsed = time.perf_counter() - start
+
+            results.append(
+                {
+                    "name": name,
+                    "n_events": int(event_mask.sum()),
+                    "n_objects": {
+                        obj_name: int(obj_mask.sum().sum())
+                        for obj_name, obj_mask in masks.items()
+                    },
+                    "channels": _channel_counts(masks, event_mask),
+                    "time": elapsed,
+                }
+            )
+        return results
+
+
+def _channel_counts(masks: Dict[str, JaggedArray], event_mask: np.ndarray) -> Dict[str, int]:
+    channel = event_selection.dilepton_channel(
+        n_electrons=masks["electron"].sum(), n_muons=masks["muon"].sum()
+    )[event_mask]
+    return {
+        channel_name: int((channel == code).sum())
+        for code, channel_name in event_selection.CHANNEL_NAMES.items()
+    }
+
+
+def format_cutflow(results: List[Dict]) -> str:
+    """Format cut flow results as a table.
+
+    :param results: Output of CutFlow.run.
+    :type results: List[Dict]
+    :return: Table with one row per cut.
+    :rtype: str
+    """
+    channel_names = list(event_selection.CHANNEL_NAMES.values())
+    header = f"{'cut':<22}{'events':>10}" + "".join(f"{c:>10}" for c in channel_names)
+    lines = [header + f"{'time [ms]':>12}"]
+    for result in results:
+        line = f"{result['name']:<22}{result['n_events']:>10,}"
+        line += "".join(f"{result['channels'][c]:>10,}" for c in channel_names)
+        line += f"{result['time'] * 1e3:>12.1f}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _jet_pt(events, masks):
+    return events["Jet.PT"].array() > event_selection.JET_PT_MIN
+
+
+def _jet_eta(events, masks):
+    return np.abs(events["Jet.Eta"].array()) < event_selection.JET_ETA_MAX
+
+
+def _jet_electron_dR(events, masks):
+    return event_selection.overlap_mask(
+        events["Jet.Phi"].array(),
+        events["Jet.Eta"].array(),
+        events["Electron.Phi"].array(),
+        events["Electron.Eta"].array(),
+        event_selection.JET_ELECTRON_DR_MIN,
+    )
+
+
+def _jet_muon_dR(events, masks):
+    return event_selection.overlap_mask(
+        events["Jet.Phi"].array(),
+        events["Jet.Eta"].array(),
+        events["Muon.Phi"].array(),
+        events["Muon.Eta"].array(),
+        event_selection.JET_MUON_DR_MIN,
+    )
+
+
+def _electron_pt(events, masks):
+    return events["Electron.PT"].array() > event_selection.ELECTRON_PT_MIN
+
+
+def _electron_eta(events, masks):
+    return np.abs(events["Electron.Eta"].array()) < event_selection.ELECTRON_ETA_MAX
+
+
+def _electron_crack_veto(events, masks):
+    crack_low, crack_high = event_selection.ELECTRON_CRACK_ETA
+    abs_eta = np.abs(events["Electron.Eta"].array())
+    return (abs_eta < crack_low) + (abs_eta > crack_high)
+
+
+def _electron_jet_dR(events, masks):
+    jet_eta = events["Jet.Eta"].array()
+    jet_mass = events["Jet.Mass"].array()
+    jet_pt = events["Jet.PT"].array()
+    jet_rapidity = jet_eta - (np.tanh(jet_eta) / 2) * (jet_mass / jet_pt)**2
+    return event_selection.overlap_mask(
+        events["Electron.Phi"].array(),
+        events["Electron.Eta"].array(),
+        events["Jet.Phi"].array(),
+        jet_rapidity,
+        event_selection.ELECTRON_JET_DR_MIN,
+    )
+
+
+def _muon_pt(events, masks):
+    return events["Muon.PT"].array() > event_selection.MUON_PT_MIN
+
+
+def _muon_eta(events, masks):
+    return np.abs(events["Muon.Eta"].array()) < event_selection.MUON_ETA_MAX
+
+
+def _muon_jet_dR(events, masks):
+    return event_selection.overlap_mask(
+        events["Muon.Phi"].array(),
+        events["Muon.Eta"].array(),
+        events["Jet.Phi"].array(),
+        events["Jet.Eta"].array(),
+        event_selection.MUON_JET_DR_MIN,
+    )
+
+
+def _two_leptons(events, masks):
+    return (masks["electron"].sum() + masks["muon"].sum()) == 2
+
+
+def _opposite_charge(events, masks):
+    electron_charge = events["Electron.Charge"].array()[masks["electron"]].sum()
+    muon_charge = events["Muon.Charge"].array()[masks["muon"]].sum()
+    return (electron_charge + muon_charge) == 0
+
+
+def _two_bjets(events, masks):
+    bjets_mask = event_selection.select_bjet(events["Jet.BTag"].array()[masks["jet"]])
+    return bjets_mask.sum() >= 2
+
+
+def atlas_cutflow() -> CutFlow:
+    """Create cut flow with the ATLAS dilepton selection used in the analysis.
+
+    :return: Cut flow with object and event cuts.
+    :rtype: CutFlow
+    """
+    cutflow = CutFlow()
+    cutflow.register("jet_pt", _jet_pt, collection="jet")
+    cutflow.register("jet_eta", _jet_eta, collection="jet")
+    cutflow.register("jet_electron_dR", _jet_electron_dR, collection="jet")
+    cutflow.register("jet_muon_dR", _jet_muon_dR, collection="jet")
+    cutflow.register("electron_pt", _electron_pt, collection="electron")
+    cutflow.register("electron_eta", _electron_eta, collection="electron")
+    cutflow.register("electron_crack_veto", _electron_crack_veto, collection="electron")
+    cutflow.register("electron_jet_dR", _electron_jet_dR, collection="electron")
+    cutflow.register("muon_pt", _muon_pt, collection="muon")
+    cutflow.register("muon_eta", _muon_eta, collection="muon")
+    cutflow.register("muon_jet_dR", _muon_jet_dR, collection="muon")
+    cutflow.register("two_leptons", _two_leptons)
+    cutflow.register("opposite_charge", _opposite_charge)
+    cutflow.register("two_bjets", _two_bjets)
+    return cutflow
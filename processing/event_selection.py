@@ -1,6 +1,76 @@
 import numpy as np
 from awkward.array.jagged import JaggedArray
-import processing.kinematics as kinematics
+from typing import Dict
+from processing.lorentz import normalize_dPhi
+
+
+JET_PT_MIN = 25
+JET_ETA_MAX = 2.5
+JET_ELECTRON_DR_MIN = 0.2
+JET_MUON_DR_MIN = 0.4
+ELECTRON_PT_MIN = 25
+ELECTRON_ETA_MAX = 2.5
+ELECTRON_CRACK_ETA = (1.37, 1.52)
+ELECTRON_JET_DR_MIN = 0.4
+MUON_PT_MIN = 25
+MUON_ETA_MAX = 2.5
+MUON_JET_DR_MIN = 0.4
+
+CHANNEL_NONE = -1
+CHANNEL_EE = 0
+CHANNEL_MUMU = 1
+CHANNEL_EMU = 2
+CHANNEL_NAMES = {CHANNEL_EE: "ee", CHANNEL_MUMU: "mumu", CHANNEL_EMU: "emu"}
+
+
+def overlap_mask(
+    phi: JaggedArray,
+    eta: JaggedArray,
+    other_phi: JaggedArray,
+    other_eta: JaggedArray,
+    min_dR: float,
+) -> JaggedArray:
+    """Create boolean mask that keeps objects separated by more than min_dR from
+    every object of another collection in the same event. All object pairs are
+    built on the flat contents of the jagged arrays, so there is no loop over events.
+
+    :param phi: Phi of objects to be masked.
+    :type phi: JaggedArray
+    :param eta: Eta (or rapidity) of objects to be masked.
+    :type eta: JaggedArray
+    :param other_phi: Phi of objects used for the overlap removal.
+    :type other_phi: JaggedArray
+    :param other_eta: Eta (or rapidity) of objects used for the overlap removal.
+    :type other_eta: JaggedArray
+    :param min_dR: Minimum delta R between objects to keep them.
+    :type min_dR: float
+    :return: boolean mask with the same structure as phi.
+    :rtype: JaggedArray
+    """
+    counts = phi.counts
+    other_counts = other_phi.counts
+    other_starts = np.cumsum(other_counts) - other_counts
+    flat_phi = phi.flatten()
+    flat_eta = eta.flatten()
+    flat_other_phi = other_phi.flatten()
+    flat_other_eta = other_eta.flatten()
+
+    # Pair every object with all the objects of the other collection in its event
+    parents = np.repeat(np.arange(len(counts)), counts)
+    n_pairs = other_counts[parents]
+    pair_starts = np.cumsum(n_pairs) - n_pairs
+    obj_idx = np.repeat(np.arange(len(parents)), n_pairs)
+    other_idx = (
+        np.arange(n_pairs.sum())
+        - np.repeat(pair_starts, n_pairs)
+        + np.repeat(other_starts[parents], n_pairs)
+    )
+
+    dPhi = normalize_dPhi(flat_phi[obj_idx] - flat_other_phi[other_idx])
+    dEta = flat_eta[obj_idx] - flat_other_eta[other_idx]
+    dR = np.sqrt(dPhi**2 + dEta**2)
+    n_overlaps = np.bincount(obj_idx[~(dR > min_dR)], minlength=len(flat_phi))
+    return JaggedArray.fromcounts(counts, n_overlaps == 0)
 
 
 def select_jet(events) -> JaggedArray:
@@ -19,29 +89,12 @@ def select_jet(events) -> JaggedArray:
     muon_phi = events["Muon.Phi"].array()
     muon_eta = events["Muon.Eta"].array()
 
-    pt_mask = jet_pt > 25
-    eta_mask = np.abs(jet_eta) < 2.5
-    electron_dR_mask = []
-    muon_dR_mask = []
-    for event_idx in range(len(events)):
-        jet_phi_idx = jet_phi[event_idx]
-        jet_eta_idx = jet_eta[event_idx]
-        electron_dR_event_mask = np.ones_like(jet_phi_idx, dtype=int)
-        muon_dR_event_mask = np.ones_like(jet_phi_idx, dtype=int)
-        for elec_idx in range(len(electron_phi[event_idx])):
-            dPhi = kinematics.normalize_dPhi(jet_phi_idx - electron_phi[event_idx][elec_idx])
-            dEta = jet_eta_idx - electron_eta[event_idx][elec_idx]
-            dR = np.sqrt(dPhi**2 + dEta**2)
-            electron_dR_event_mask *= (dR > 0.2)
-        for muon_idx in range(len(muon_phi[event_idx])):
-            dPhi = kinematics.normalize_dPhi(jet_phi_idx - muon_phi[event_idx][muon_idx])
-            dEta = jet_eta_idx - muon_eta[event_idx][muon_idx]
-            dR = np.sqrt(dPhi**2 + dEta**2)
-            muon_dR_event_mask *= (dR > 0.4)
-        electron_dR_mask.append(electron_dR_event_mask.astype(bool))
-        muon_dR_mask.append(muon_dR_event_mask.astype(bool))
-    electron_dR_mask = JaggedArray.fromiter(electron_dR_mask)
-    muon_dR_mask = JaggedArray.fromiter(muon_dR_mask)
+    pt_mask = jet_pt > JET_PT_MIN
+    eta_mask = np.abs(jet_eta) < JET_ETA_MAX
+    electron_dR_mask = overlap_mask(
+        jet_phi, jet_eta, electron_phi, electron_eta, JET_ELECTRON_DR_MIN
+    )
+    muon_dR_mask = overlap_mask(jet_phi, jet_eta, muon_phi, muon_eta, JET_MUON_DR_MIN)
     mask = pt_mask * eta_mask * electron_dR_mask * muon_dR_mask
     return mask
 
@@ -62,26 +115,15 @@ def select_electron(events) -> JaggedArray:
     electron_phi = events["Electron.Phi"].array()
     electron_eta = events["Electron.Eta"].array()
 
-    pt_mask = electron_pt > 25
-    eta_mask1 = (np.abs(electron_eta) < 2.5) * (np.abs(electron_eta) > 1.52)
-    eta_mask2 = np.abs(electron_eta) < 1.37
+    crack_low, crack_high = ELECTRON_CRACK_ETA
+    pt_mask = electron_pt > ELECTRON_PT_MIN
+    eta_mask1 = (np.abs(electron_eta) < ELECTRON_ETA_MAX) * (np.abs(electron_eta) > crack_high)
+    eta_mask2 = np.abs(electron_eta) < crack_low
     eta_mask = eta_mask1 + eta_mask2
-    jet_dR_mask = []
-    for event_idx in range(len(events)):
-        electron_phi_idx = electron_phi[event_idx]
-        electron_eta_idx = electron_eta[event_idx]
-        jet_dR_event_mask = np.ones_like(electron_phi_idx, dtype=int)
-        for jet_idx in range(len(jet_phi[event_idx])):
-            jet_eta_idx = jet_eta[event_idx][jet_idx]
-            jet_mass_idx = jet_mass[event_idx][jet_idx]
-            jet_pt_idx = jet_pt[event_idx][jet_idx]
-            jet_rapidity = jet_eta_idx - (np.tanh(jet_eta_idx)/2)*(jet_mass_idx/jet_pt_idx)**2
-            dPhi = kinematics.normalize_dPhi(electron_phi_idx - jet_phi[event_idx][jet_idx])
-            dEta = electron_eta_idx - jet_rapidity
-            dR = np.sqrt(dPhi**2 + dEta**2)
-            jet_dR_event_mask *= (dR > 0.4)
-        jet_dR_mask.append(jet_dR_event_mask.astype(bool))
-    jet_dR_mask = JaggedArray.fromiter(jet_dR_mask)
+    jet_rapidity = jet_eta - (np.tanh(jet_eta) / 2) * (jet_mass / jet_pt)**2
+    jet_dR_mask = overlap_mask(
+        electron_phi, electron_eta, jet_phi, jet_rapidity, ELECTRON_JET_DR_MIN
+    )
     mask = pt_mask * eta_mask * jet_dR_mask
     return mask
 
@@ -100,19 +142,100 @@ def select_muon(events) -> JaggedArray:
     muon_phi = events["Muon.Phi"].array()
     muon_eta = events["Muon.Eta"].array()
 
-    pt_mask = muon_pt > 25
-    eta_mask = np.abs(muon_eta) < 2.5
-    jet_dR_mask = []
-    for event_idx in range(len(events)):
-        muon_phi_idx = muon_phi[event_idx]
-        muon_eta_idx = muon_eta[event_idx]
-        jet_dR_event_mask = np.ones_like(muon_phi_idx, dtype=int)
-        for jet_idx in range(len(jet_phi[event_idx])):
-            dPhi = kinematics.normalize_dPhi(muon_phi_idx - jet_phi[event_idx][jet_idx])
-            dEta = muon_eta_idx - jet_eta[event_idx][jet_idx]
-            dR = np.sqrt(dPhi**2 + dEta**2)
-            jet_dR_event_mask *= (dR > 0.4)
-        jet_dR_mask.append(jet_dR_event_mask.astype(bool))
-    jet_dR_mask = JaggedArray.fromiter(jet_dR_mask)
+    pt_mask = muon_pt > MUON_PT_MIN
+    eta_mask = np.abs(muon_eta) < MUON_ETA_MAX
+    jet_dR_mask = overlap_mask(muon_phi, muon_eta, jet_phi, jet_eta, MUON_JET_DR_MIN)
     mask = pt_mask * eta_mask * jet_dR_mask
     return mask
+
+
+def select_bjet(btag: JaggedArray, btag_bit: int = None) -> JaggedArray:
+    """Create boolean mask of the b-tagged jets. Delphes stores one bit of Jet.BTag
+    per b-tagging working point.
+
+    :param btag: Jet.BTag bitmask of the jets.
+    :type btag: JaggedArray
+    :param btag_bit: Bit of the working point to select, defaults to None (jets with
+                     any bit set).
+    :type btag_bit: int, optional
+    :return: boolean mask to select b-jets
+    :rtype: JaggedArray
+    """
+    if btag_bit is None:
+        return btag.astype(bool)
+    return (btag & (1 << btag_bit)) != 0
+
+
+def selection_cuts() -> Dict[str, float]:
+    """Collect the values of the selection criteria applied to the objects.
+
+    :return: Cut values by name.
+    :rtype: Dict[str, float]
+    """
+    return {
+        "jet_pt_min": JET_PT_MIN,
+        "jet_eta_max": JET_ETA_MAX,
+        "jet_electron_dR_min": JET_ELECTRON_DR_MIN,
+        "jet_muon_dR_min": JET_MUON_DR_MIN,
+        "electron_pt_min": ELECTRON_PT_MIN,
+        "electron_eta_max": ELECTRON_ETA_MAX,
+        "electron_crack_eta": list(ELECTRON_CRACK_ETA),
+        "electron_jet_dR_min": ELECTRON_JET_DR_MIN,
+        "muon_pt_min": MUON_PT_MIN,
+        "muon_eta_max": MUON_ETA_MAX,
+        "muon_jet_dR_min": MUON_JET_DR_MIN,
+    }
+
+
+def select_objects(events) -> Dict[str, JaggedArray]:
+    """Apply ATLAS selection criteria and keep the objects used for the
+    dilepton reconstruction: b-jets, electrons, muons and MET.
+
+    :param events: Delphes event TTree
+    :type events: TTree
+    :return: Selected objects' kinematics by name (e.g., 'bjets_pt').
+    :rtype: Dict[str, JaggedArray]
+    """
+    electron_mask = select_electron(events)
+    muon_mask = select_muon(events)
+    jets_mask = select_jet(events)
+    bjets_mask = select_bjet(events["Jet.BTag"].array()[jets_mask])
+
+    objects = {
+        "bjets_mass": events["Jet.Mass"].array()[jets_mask][bjets_mask],
+        "bjets_pt": events["Jet.PT"].array()[jets_mask][bjets_mask],
+        "bjets_phi": events["Jet.Phi"].array()[jets_mask][bjets_mask],
+        "bjets_eta": events["Jet.Eta"].array()[jets_mask][bjets_mask],
+        "electron_pt": events["Electron.PT"].array()[electron_mask],
+        "electron_phi": events["Electron.Phi"].array()[electron_mask],
+        "electron_eta": events["Electron.Eta"].array()[electron_mask],
+        "electron_charge": events["Electron.Charge"].array()[electron_mask],
+        "muon_pt": events["Muon.PT"].array()[muon_mask],
+        "muon_phi": events["Muon.Phi"].array()[muon_mask],
+        "muon_eta": events["Muon.Eta"].array()[muon_mask],
+        "muon_charge": events["Muon.Charge"].array()[muon_mask],
+        "met": events["MissingET.MET"].array(),
+        "met_phi": events["MissingET.Phi"].array(),
+    }
+    return objects
+
+
+def dilepton_channel(n_electrons: np.ndarray, n_muons: np.ndarray) -> np.ndarray:
+    """Assign dilepton channel to each event from its number of selected leptons.
+    The precedence is the same used in the reconstruction: two electrons, then
+    two muons, then one electron and one muon.
+
+    :param n_electrons: Number of selected electrons in each event.
+    :type n_electrons: np.ndarray
+    :param n_muons: Number of selected muons in each event.
+    :type n_muons: np.ndarray
+    :return: Channel code for each event (CHANNEL_NONE if not dilepton).
+    :rtype: np.ndarray
+    """
+    n_electrons = np.asarray(n_electrons)
+    n_muons = np.asarray(n_muons)
+    channel = np.full(len(n_electrons), CHANNEL_NONE, dtype=np.int8)
+    channel[(n_electrons == 1) & (n_muons == 1)] = CHANNEL_EMU
+    channel[n_muons == 2] = CHANNEL_MUMU
+    channel[n_electrons == 2] = CHANNEL_EE
+    return channel
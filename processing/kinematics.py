@@ -1,6 +1,11 @@
 import numpy as np
-from typing import List
-from processing import event_selection
+from awkward.array.jagged import JaggedArray
+from typing import Dict, Tuple
+from processing import event_selection, lorentz, truth
+from processing.lorentz import normalize_dPhi
+
+M_ELECTRON = 0.000510998902
+M_MUON = 0.105658389
 
 
 def four_momentum(pt: np.ndarray, phi: np.ndarray, eta: np.ndarray,
@@ -44,60 +49,107 @@ def neutrino_four_momentum(px: float, py: float, eta: float) -> np.ndarray:
     return np.array([px, py, pz, E])
 
 
-def normalize_dPhi(dphi: np.ndarray) -> np.ndarray:
-    """Normalize delta phi to values between 0 and pi
-
-    :param dphi: Unnormalized delta phi.
-    :type dphi: float
-    :return: normalized delta phi.
-    :rtype: float
-    """
-    mask1 = dphi < -np.pi
-    mask2 = dphi >= np.pi
-    normed_dphi = dphi
-    normed_dphi[mask1] += (2 * np.pi)
-    normed_dphi[mask2] = (2 * np.pi) - normed_dphi[mask2]
-    return np.abs(normed_dphi)
-
-
 def eta(p: np.ndarray) -> np.ndarray:
-    p_norm = np.linalg.norm(p[:, :3], axis=1)
-    cos_theta = p[:, 2] / p_norm
-    unstable_mask = (cos_theta * cos_theta) >= 1
-    np.putmask(cos_theta, unstable_mask, 0)
-    eta_result = -0.5 * np.log((1 - cos_theta) / (1 + cos_theta))
-    np.putmask(eta_result, unstable_mask, 10e10)
-    return eta_result
+    return lorentz.as_batch(p).eta
 
 
 def phi(p: np.ndarray) -> np.ndarray:
-    p_x = p[:, 0]
-    p_y = p[:, 1]
-    return np.arctan2(p_y, p_x)
+    return lorentz.as_batch(p).phi
 
 
 def mass(p: np.ndarray) -> np.ndarray:
-    x2 = np.sum(p[:, :3] ** 2, axis=1, keepdims=True)
-    m2 = p[:, 3:] - x2
-    m2 *= ((np.sign(m2) < 0) * -1)
-    return np.sqrt(m2)
+    return lorentz.as_batch(p).mass.reshape(-1, 1)
 
 
 def dR(p1: np.ndarray, p2: np.ndarray) -> np.ndarray:
-    dEta = eta(p1) - eta(p2)
-    dPhi = normalize_dPhi(phi(p1) - phi(p2))
-    return np.sqrt((dPhi ** 2) + (dEta ** 2))
+    return lorentz.as_batch(p1).dR(lorentz.as_batch(p2))
 
 
-def dphi_dilepton(events) -> List[float]:
+def nth_object(array: JaggedArray, n: int, fill: float = 0) -> np.ndarray:
+    """Get n-th object's value in each event.
+
+    :param array: Objects' values in each event.
+    :type array: JaggedArray
+    :param n: Position of the object in the event.
+    :type n: int
+    :param fill: Value for events with n or less objects, defaults to 0.
+    :type fill: float, optional
+    :return: Value of the n-th object in each event.
+    :rtype: np.ndarray
+    """
+    counts = array.counts
+    flat_array = array.flatten()
+    starts = np.cumsum(counts) - counts
+    has_object = counts > n
+    values = np.full(len(counts), fill, dtype=flat_array.dtype)
+    values[has_object] = flat_array[starts[has_object] + n]
+    return values
+
+
+def dilepton_kinematics(selected: Dict[str, JaggedArray]) -> Dict[str, np.ndarray]:
+    """Pair the selected leptons of every event and assign them to the top and anti-top
+    quarks. The channel is assigned with event_selection.dilepton_channel, the pair must
+    have opposite charges, and the positive lepton comes from the top quark.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict[str, JaggedArray]
+    :return: Four-momenta ('p_l_t' and 'p_l_tbar', shape (events, 4)) and masses ('m_l_t'
+             and 'm_l_tbar') of the leptons assigned to top and anti-top quarks, channel
+             code ('channel') and whether the event has an opposite-charge lepton pair
+             ('valid'). Leptons of events that aren't valid are set to zero.
+    :rtype: Dict[str, np.ndarray]
+    """
+    channel = event_selection.dilepton_channel(
+        n_electrons=selected["electron_pt"].counts, n_muons=selected["muon_pt"].counts
+    )
+    is_ee = channel == event_selection.CHANNEL_EE
+    is_mumu = channel == event_selection.CHANNEL_MUMU
+
+    # Electrons come first in the e + mu channel
+    def leptons(name):
+        electrons = [nth_object(selected[f"electron_{name}"], n) for n in (0, 1)]
+        muons = [nth_object(selected[f"muon_{name}"], n) for n in (0, 1)]
+        first = np.where(is_mumu, muons[0], electrons[0])
+        second = np.select([is_ee, is_mumu], [electrons[1], muons[1]], default=muons[0])
+        return first, second
+
+    charges = leptons("charge")
+    valid = (channel != event_selection.CHANNEL_NONE) & (charges[0] + charges[1] == 0)
+    masses = [np.where(is_mumu, M_MUON, M_ELECTRON), np.where(is_ee, M_ELECTRON, M_MUON)]
+    momenta = [
+        four_momentum(
+            *[np.asarray(array, dtype=np.float64).reshape(-1, 1) for array in (pt, phi, eta)],
+            mass=mass.reshape(-1, 1),
+        )
+        for pt, phi, eta, mass in zip(leptons("pt"), leptons("phi"), leptons("eta"), masses)
+    ]
+
+    # The positive lepton comes from the top quark
+    first_is_t = charges[0] == 1
+    p_l_t = np.where(first_is_t[:, None], momenta[0], momenta[1])
+    p_l_tbar = np.where(first_is_t[:, None], momenta[1], momenta[0])
+    m_l_t = np.where(first_is_t, masses[0], masses[1])
+    m_l_tbar = np.where(first_is_t, masses[1], masses[0])
+    return {
+        "p_l_t": np.where(valid[:, None], p_l_t, 0),
+        "p_l_tbar": np.where(valid[:, None], p_l_tbar, 0),
+        "m_l_t": np.where(valid, m_l_t, 0),
+        "m_l_tbar": np.where(valid, m_l_tbar, 0),
+        "channel": channel,
+        "valid": valid,
+    }
+
+
+def dphi_dilepton(events) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """Calculate delta phi between two leptons in the event. We require
-    that the two leptons have opposite charge. The function assumes that
-    there is maximum one muon per event.
+    that the two leptons have opposite charge. The dilepton channel of the event
+    is assigned with event_selection.dilepton_channel.
 
     :param events: Delphes TTree
     :type events: TTree
-    :return: Delta phi between the two leptons in the event.
-    :rtype: List[float]
+    :return: Delta phi between the two leptons, index and channel code of the
+             events that passed.
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
     """
     muon_mask = event_selection.select_muon(events)
     elec_mask = event_selection.select_electron(events)
@@ -106,53 +158,67 @@ def dphi_dilepton(events) -> List[float]:
     muon_charge = events["Muon.Charge"].array()[muon_mask]
     elec_charge = events["Electron.Charge"].array()[elec_mask]
 
-    dphi_vals = []
-    for idx, (phi, charge) in enumerate(zip(elec_phi, elec_charge)):
-        if len(phi) == 0:
-            if len(muon_charge[idx]) == 2:
-                dphi_vals.append(normalize_dPhi(np.array(muon_phi[idx][0] - muon_phi[idx][1])))
-            else:
-                continue
-        elif len(phi) == 1:
-            if len(muon_phi[idx]) == 0:
-                continue
-            if (charge[0] + muon_charge[idx][0]) != 0:
-                continue
-            dphi_vals.append(normalize_dPhi(np.array(phi[0] - muon_phi[idx][0])))
-        elif len(phi) == 2:
-            if (charge[0] + charge[1]) != 0:
-                continue
-            dphi_vals.append(normalize_dPhi(np.array(phi[0] - phi[1])))
-    return dphi_vals
-
-
-def invariant_mass_ttbar(events) -> np.array:
+    channel = event_selection.dilepton_channel(
+        n_electrons=elec_phi.counts, n_muons=muon_phi.counts
+    )
+    channel_masks = [
+        channel == event_selection.CHANNEL_EE,
+        channel == event_selection.CHANNEL_MUMU,
+        channel == event_selection.CHANNEL_EMU,
+    ]
+    phi1 = np.select(
+        channel_masks, [nth_object(elec_phi, 0), nth_object(muon_phi, 0), nth_object(elec_phi, 0)]
+    )
+    phi2 = np.select(
+        channel_masks, [nth_object(elec_phi, 1), nth_object(muon_phi, 1), nth_object(muon_phi, 0)]
+    )
+    charge = np.select(
+        channel_masks,
+        [
+            nth_object(elec_charge, 0) + nth_object(elec_charge, 1),
+            nth_object(muon_charge, 0) + nth_object(muon_charge, 1),
+            nth_object(elec_charge, 0) + nth_object(muon_charge, 0),
+        ],
+    )
+
+    passed = (channel != event_selection.CHANNEL_NONE) & (charge == 0)
+    dphi_vals = normalize_dPhi(phi1[passed] - phi2[passed])
+    return dphi_vals, np.nonzero(passed)[0], channel[passed]
+
+
+def invariant_mass_ttbar(events, truth_index: Dict[str, np.ndarray] = None) -> np.array:
     """Calculate invariant mass for ttbar system
 
     :param events: Delphes TTree
     :type events: TTree
+    :param truth_index: Index of hard-process particles, defaults to None (build it
+                        from the events).
+    :type truth_index: Dict[str, np.ndarray], optional
     :return: Mass values for ttbar system
     :rtype: np.array
     """
-    status_mask = events["Particle.Status"].array() == 22
-    t_mask = (events["Particle.PID"].array() == 6) * status_mask
-    tbar_mask = (events["Particle.PID"].array() == -6) * status_mask
-    mass = events["Particle.Mass"].array()[t_mask] + events["Particle.Mass"].array()[tbar_mask]
-    mass_vals = mass.flatten()
+    if truth_index is None:
+        truth_index = truth.build_truth_index(events)
+    mass = truth.truth_values(events, truth_index, "top", "Particle.Mass")
+    mass += truth.truth_values(events, truth_index, "tbar", "Particle.Mass")
+    mass_vals = mass[~np.isnan(mass)]
     return mass_vals
 
 
-def pt_ttbar(events) -> np.array:
+def pt_ttbar(events, truth_index: Dict[str, np.ndarray] = None) -> np.array:
     """Calculate total pT for ttbar system
 
     :param events: Delphes TTree
     :type events: TTree
+    :param truth_index: Index of hard-process particles, defaults to None (build it
+                        from the events).
+    :type truth_index: Dict[str, np.ndarray], optional
     :return: pT values for ttbar system
     :rtype: np.array
     """
-    status_mask = events["Particle.Status"].array() == 22
-    t_mask = (events["Particle.PID"].array() == 6) * status_mask
-    tbar_mask = (events["Particle.PID"].array() == -6) * status_mask
-    pT = events["Particle.PT"].array()[t_mask] + events["Particle.PT"].array()[tbar_mask]
-    pT_vals = pT.flatten()
+    if truth_index is None:
+        truth_index = truth.build_truth_index(events)
+    pT = truth.truth_values(events, truth_index, "top", "Particle.PT")
+    pT += truth.truth_values(events, truth_index, "tbar", "Particle.PT")
+    pT_vals = pT[~np.isnan(pT)]
     return pT_vals
@@ -0,0 +1,150 @@
+import numpy as np
+
+from functools import cached_property
+from typing import Union
+
+
+def normalize_dPhi(dphi: np.ndarray) -> np.ndarray:
+    """Normalize delta phi to values between 0 and pi. The input isn't modified.
+
+    :param dphi: Unnormalized delta phi.
+    :type dphi: float
+    :return: normalized delta phi.
+    :rtype: float
+    """
+    normed_dphi = np.where(dphi < -np.pi, dphi + (2 * np.pi), dphi)
+    normed_dphi = np.where(dphi >= np.pi, (2 * np.pi) - dphi, normed_dphi)
+    return np.abs(normed_dphi)
+
+
+class FourVectorBatch:
+    """Batch of four-vectors in (x, y, z, E) coordinates stored as one array per
+    coordinate. Derived quantities (pt, eta, phi, mass, ...) are computed the first
+    time they are requested and cached. Slicing and masking also slice the cached
+    quantities, and basic slices are views of the original coordinates.
+
+    :param px: Momentum's x component.
+    :type px: np.ndarray
+    :param py: Momentum's y component.
+    :type py: np.ndarray
+    :param pz: Momentum's z component.
+    :type pz: np.ndarray
+    :param E: Energy.
+    :type E: np.ndarray
+    """
+
+    def __init__(self, px: np.ndarray, py: np.ndarray, pz: np.ndarray, E: np.ndarray):
+        self.px = px
+        self.py = py
+        self.pz = pz
+        self.E = E
+
+    @classmethod
+    def from_array(cls, p: np.ndarray) -> "FourVectorBatch":
+        """Create batch from an (N, 4) array without copying it.
+
+        :param p: Four-momenta in (x, y, z, E) coordinates.
+        :type p: np.ndarray
+        :return: Batch of four-vectors.
+        :rtype: FourVectorBatch
+        """
+        return cls(p[:, 0], p[:, 1], p[:, 2], p[:, 3])
+
+    @classmethod
+    def from_pt_eta_phi_mass(
+        cls, pt: np.ndarray, eta: np.ndarray, phi: np.ndarray, mass: np.ndarray
+    ) -> "FourVectorBatch":
+        """Create batch from pt, eta, phi and mass.
+
+        :param pt: Transverse momentum.
+        :type pt: np.ndarray
+        :param eta: Pseudorapidity.
+        :type eta: np.ndarray
+        :param phi: Azimuth angle.
+        :type phi: np.ndarray
+        :param mass: Particle's mass.
+        :type mass: np.ndarray
+        :return: Batch of four-vectors.
+        :rtype: FourVectorBatch
+        """
+        pt = np.abs(pt)
+        px = pt * np.cos(phi)
+        py = pt * np.sin(phi)
+        pz = pt * np.sinh(eta)
+        E = np.sqrt(px**2 + py**2 + pz**2 + mass**2)
+        return cls(px, py, pz, E)
+
+    def __len__(self) -> int:
+        return len(self.px)
+
+    def __getitem__(self, idx) -> "FourVectorBatch":
+        sliced = FourVectorBatch(self.px[idx], self.py[idx], self.pz[idx], self.E[idx])
+        for name, value in self.__dict__.items():
+            if name not in ("px", "py", "pz", "E"):
+                sliced.__dict__[name] = value[idx]
+        return sliced
+
+    def __add__(self, other: "FourVectorBatch") -> "FourVectorBatch":
+        return FourVectorBatch(
+            self.px + other.px, self.py + other.py, self.pz + other.pz, self.E + other.E
+        )
+
+    def to_array(self) -> np.ndarray:
+        """Stack coordinates in an (N, 4) array.
+
+        :return: Four-momenta in (x, y, z, E) coordinates.
+        :rtype: np.ndarray
+        """
+        return np.stack([self.px, self.py, self.pz, self.E], axis=1)
+
+    @cached_property
+    def pt(self) -> np.ndarray:
+        return np.sqrt(self.px**2 + self.py**2)
+
+    @cached_property
+    def p(self) -> np.ndarray:
+        return np.sqrt(self.px**2 + self.py**2 + self.pz**2)
+
+    @cached_property
+    def eta(self) -> np.ndarray:
+        cos_theta = self.pz / self.p
+        unstable_mask = (cos_theta * cos_theta) >= 1
+        cos_theta = np.where(unstable_mask, 0, cos_theta)
+        eta = -0.5 * np.log((1 - cos_theta) / (1 + cos_theta))
+        return np.where(unstable_mask, 10e10, eta)
+
+    @cached_property
+    def phi(self) -> np.ndarray:
+        return np.arctan2(self.py, self.px)
+
+    @cached_property
+    def mass(self) -> np.ndarray:
+        return np.sqrt(np.clip(self.E**2 - self.p**2, a_min=0, a_max=None))
+
+    @cached_property
+    def rapidity(self) -> np.ndarray:
+        return 0.5 * np.log((self.E + self.pz) / (self.E - self.pz))
+
+    @cached_property
+    def beta(self) -> np.ndarray:
+        return np.stack([self.px, self.py, self.pz], axis=1) / self.E.reshape(-1, 1)
+
+    def delta_phi(self, other: "FourVectorBatch") -> np.ndarray:
+        return normalize_dPhi(self.phi - other.phi)
+
+    def dR(self, other: "FourVectorBatch") -> np.ndarray:
+        dEta = self.eta - other.eta
+        return np.sqrt(self.delta_phi(other) ** 2 + dEta**2)
+
+
+def as_batch(p: Union[np.ndarray, FourVectorBatch]) -> FourVectorBatch:
+    """Wrap (N, 4) array in a FourVectorBatch, leaving batches untouched.
+
+    :param p: Four-momenta.
+    :type p: Union[np.ndarray, FourVectorBatch]
+    :return: Batch of four-vectors.
+    :rtype: FourVectorBatch
+    """
+    if isinstance(p, FourVectorBatch):
+        return p
+    return FourVectorBatch.from_array(np.asarray(p))
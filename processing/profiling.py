@@ -0,0 +1,339 @@
+import json
+import time
+import numpy as np
+
+from contextlib import nullcontext
+from typing import Callable, Dict, Optional, Tuple
+
+
+# Profiler collecting measurements of this process, None when profiling is off
+_active = None
+_listening = False
+# Returned by stage, clock and event when profiling is off, so instrumented code only pays
+# for a function call
+_NULL_CONTEXT = nullcontext()
+JAX_COMPILE_EVENT = "/jax/core/compile/backend_compile_duration"
+
+
+class Profiler:
+    """Wall time of named stages, per-event latencies, processed events and JIT
+    compilations of a run. Measurements of several profilers (e.g., one per worker)
+    can be merged. Engines that solve batches of events record each event with its
+    share of the batch time (see batch), and are listed in the report.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.event_keys = []
+        self.event_times = []
+        self.event_estimated = []
+        self.estimated_engines = set()
+        self.n_events = 0
+        self.n_reconstructed = 0
+        self.n_compilations = 0
+        self.compile_time = 0.0
+        # Time spent in nested stages of each open stage, innermost last
+        self._nested = []
+
+    def add_stage(self, name: str, seconds: float, calls: int = 1):
+        stage = self.stages.setdefault(name, {"time": 0.0, "calls": 0})
+        stage["time"] += seconds
+        stage["calls"] += calls
+
+    def add_event(self, idx: int, source_idx: int, seconds: float, estimated: bool = False):
+        self.event_keys.append((source_idx, idx))
+        self.event_times.append(seconds)
+        self.event_estimated.append(estimated)
+
+    def add_batch(self, idxs, source_idx: int, seconds: float, engine: str):
+        """Record events solved together, each with an equal share of the batch time.
+
+        :param idxs: Event indexes of the batch in their file.
+        :type idxs: Iterable[int]
+        :param source_idx: Index of the file the events come from.
+        :type source_idx: int
+        :param seconds: Wall time of the batch.
+        :type seconds: float
+        :param engine: Name of the engine, listed among the per-batch estimates.
+        :type engine: str
+        """
+        idxs = list(idxs)
+        for idx in idxs:
+            self.add_event(idx, source_idx, seconds / len(idxs), estimated=True)
+        self.estimated_engines.add(engine)
+
+    def count_events(self, n_events: int, n_reconstructed: int):
+        """Count events given to the reconstruction and events reconstructed.
+
+        :param n_events: Number of input events.
+        :type n_events: int
+        :param n_reconstructed: Number of events that passed the reconstruction.
+        :type n_reconstructed: int
+        """
+        self.n_events += n_events
+        self.n_reconstructed += n_reconstructed
+
+    def merge(self, other: "Profiler"):
+        """Add measurements of another profiler (e.g., of a worker process).
+
+        :param other: Profiler to merge.
+        :type other: Profiler
+        """
+        for name, stage in other.stages.items():
+            self.add_stage(name, stage["time"], stage["calls"])
+        self.event_keys.extend(other.event_keys)
+        self.event_times.extend(other.event_times)
+        self.event_estimated.extend(other.event_estimated)
+        self.estimated_engines |= other.estimated_engines
+        self.count_events(other.n_events, other.n_reconstructed)
+        self.n_compilations += other.n_compilations
+        self.compile_time += other.compile_time
+
+    def report(self, n_slowest: int = 20, n_bins: int = 20) -> Dict:
+        """Summarize measurements. Stage times of merged profilers add up, so they can
+        be larger than the wall time of a parallel run. The time of a nested stage
+        isn't counted in the stage around it. Latencies of the engines in
+        'per_batch_engines' are their batch times divided by the batch sizes.
+
+        :param n_slowest: Number of slowest events listed, defaults to 20.
+        :type n_slowest: int, optional
+        :param n_bins: Number of log-spaced bins of the latency histogram, defaults to 20.
+        :type n_bins: int, optional
+        :return: Wall time, throughput, time per stage, JIT compilations, event latency
+                 histogram and slowest events.
+        :rtype: Dict
+        """
+        wall_time = time.perf_counter() - self.start
+        report = {
+            "wall_time": wall_time,
+            "n_events": self.n_events,
+            "n_reconstructed": self.n_reconstructed,
+            "events_per_second": self.n_events / wall_time if wall_time > 0 else None,
+            "stages": {
+                name: {**stage, "time_per_call": stage["time"] / stage["calls"]}
+                for name, stage in sorted(
+                    self.stages.items(), key=lambda item: -item[1]["time"]
+                )
+            },
+            "jit": {"compilations": self.n_compilations, "compile_time": self.compile_time},
+        }
+        if not self.event_times:
+            return report
+
+        times = np.array(self.event_times)
+        low = max(times.min(), 1e-6)
+        edges = np.geomspace(low, max(times.max(), 2 * low), n_bins + 1)
+        counts, _ = np.histogram(np.clip(times, edges[0], edges[-1]), bins=edges)
+        slowest = np.argsort(-times, kind="stable")[:n_slowest]
+        report["event_latency"] = {
+            "n_events": len(times),
+            "mean": float(np.mean(times)),
+            "median": float(np.median(times)),
+            "p90": float(np.percentile(times, 90)),
+            "p99": float(np.percentile(times, 99)),
+            "max": float(np.max(times)),
+            "n_estimated": int(np.sum(self.event_estimated)),
+            "per_batch_engines": sorted(self.estimated_engines),
+            "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+        }
+        report["slowest_events"] = [
+            {
+                "source": int(self.event_keys[i][0]),
+                "idx": int(self.event_keys[i][1]),
+                "time": float(times[i]),
+                "estimated": bool(self.event_estimated[i]),
+            }
+            for i in slowest
+        ]
+        return report
+
+
+class _Timer:
+    def __init__(self, callback: Callable[[float], None]):
+        self.callback = callback
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.callback(time.perf_counter() - self.start)
+        return False
+
+
+class _StageTimer:
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._nested.append(0.0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        nested = self.profiler._nested.pop()
+        self.profiler.add_stage(self.name, seconds - nested)
+        if self.profiler._nested:
+            self.profiler._nested[-1] += seconds
+        return False
+
+
+class _Clock:
+    def __init__(self, profiler: Profiler):
+        self.profiler = profiler
+        self.last = time.perf_counter()
+
+    def lap(self, name: str):
+        now = time.perf_counter()
+        self.profiler.add_stage(name, now - self.last)
+        self.last = now
+
+
+class _NullClock:
+    def lap(self, name: str):
+        pass
+
+
+_NULL_CLOCK = _NullClock()
+
+
+def _on_jax_event(event: str, seconds: float):
+    if _active is not None and event == JAX_COMPILE_EVENT:
+        _active.n_compilations += 1
+        _active.compile_time += seconds
+
+
+def enable() -> Profiler:
+    """Start profiling this process with a new profiler.
+
+    :return: Active profiler.
+    :rtype: Profiler
+    """
+    global _active, _listening
+    if not _listening:
+        # JAX listeners can't be removed, so it's registered once and ignores events
+        # while profiling is off
+        from jax import monitoring
+
+        monitoring.register_event_duration_secs_listener(_on_jax_event)
+        _listening = True
+    _active = Profiler()
+    return _active
+
+
+def disable() -> Optional[Profiler]:
+    """Stop profiling this process.
+
+    :return: Profiler that was active, if any.
+    :rtype: Optional[Profiler]
+    """
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def active() -> Optional[Profiler]:
+    return _active
+
+
+def stage(name: str):
+    """Context that adds its wall time to a stage of the active profiler, leaving
+    out the time of the stages nested in it (e.g., reading branches during the
+    selection).
+
+    :param name: Name of the stage.
+    :type name: str
+    :return: Timer, or a context that does nothing if profiling is off.
+    """
+    profiler = _active
+    if profiler is None:
+        return _NULL_CONTEXT
+    return _StageTimer(profiler, name)
+
+
+def clock():
+    """Stopwatch whose lap(name) adds the time since the previous lap (or since it was
+    created) to a stage of the active profiler. It splits a function in stages without
+    nesting its code in contexts.
+
+    :return: Stopwatch, or one that does nothing if profiling is off.
+    """
+    if _active is None:
+        return _NULL_CLOCK
+    return _Clock(_active)
+
+
+def event(idx: int, source_idx: int = 0):
+    """Context that records the latency of one event in the active profiler.
+
+    :param idx: Event index in its file.
+    :type idx: int
+    :param source_idx: Index of the file the event comes from, defaults to 0.
+    :type source_idx: int, optional
+    :return: Timer, or a context that does nothing if profiling is off.
+    """
+    profiler = _active
+    if profiler is None:
+        return _NULL_CONTEXT
+    return _Timer(lambda seconds: profiler.add_event(idx, source_idx, seconds))
+
+
+def batch(idxs, source_idx: int = 0, engine: str = None):
+    """Context that records events solved together in the active profiler, each with
+    an equal share of the wall time of the context (see Profiler.add_batch).
+
+    :param idxs: Event indexes of the batch in their file.
+    :type idxs: Iterable[int]
+    :param source_idx: Index of the file the events come from, defaults to 0.
+    :type source_idx: int, optional
+    :param engine: Name of the engine, defaults to None.
+    :type engine: str, optional
+    :return: Timer, or a context that does nothing if profiling is off.
+    """
+    profiler = _active
+    if profiler is None:
+        return _NULL_CONTEXT
+    return _Timer(lambda seconds: profiler.add_batch(idxs, source_idx, seconds, engine))
+
+
+def count_events(n_events: int, n_reconstructed: int):
+    if _active is not None:
+        _active.count_events(n_events, n_reconstructed)
+
+
+def run_profiled(function: Callable, *args, **kwargs) -> Tuple[object, Profiler]:
+    """Call function with a new profiler, e.g., in a worker process. Its
+    measurements can be merged into the profiler of the main process.
+
+    :param function: Function to call with args and kwargs.
+    :type function: Callable
+    :return: Result of the function and profiler with its measurements.
+    :rtype: Tuple[object, Profiler]
+    """
+    global _active
+    previous = _active
+    profiler = enable()
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        _active = previous
+    return result, profiler
+
+
+def save_report(path: str, profiler: Profiler = None, **extra):
+    """Save report of a profiler as JSON.
+
+    :param path: Path to the JSON file.
+    :type path: str
+    :param profiler: Profiler, defaults to None (the active one).
+    :type profiler: Profiler, optional
+    :param extra: Additional entries of the report (e.g., settings of the run).
+    """
+    profiler = profiler or _active
+    if profiler is None:
+        return
+    with open(path, "w") as f:
+        json.dump({**extra, **profiler.report()}, f, indent=2)
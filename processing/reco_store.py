@@ -0,0 +1,224 @@
+import os
+import json
+import numpy as np
+
+from typing import Dict, List
+
+
+HEADER_NAME = "header.json"
+FORMAT_VERSION = 1
+
+
+def column_path(path: str, name: str) -> str:
+    return os.path.join(path, f"{name}.bin")
+
+
+def is_store(path: str) -> bool:
+    """Check if a directory holds a reconstruction store.
+
+    :param path: Directory.
+    :type path: str
+    :return: Whether the directory has a store header.
+    :rtype: bool
+    """
+    return os.path.exists(os.path.join(path, HEADER_NAME))
+
+
+def save_header(header: Dict, path: str):
+    """Write header atomically. Rows appended after the last header write are ignored
+    by readers and overwritten by the next append.
+
+    :param header: Header of the store.
+    :type header: Dict
+    :param path: Store directory.
+    :type path: str
+    """
+    header_path = os.path.join(path, HEADER_NAME)
+    tmp_path = f"{header_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(header, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, header_path)
+
+
+def load_header(path: str) -> Dict:
+    """Load header of a store.
+
+    :param path: Store directory.
+    :type path: str
+    :raises ValueError: If the store was written with another format version.
+    :return: Metadata, columns, number of rows and chunks of the store.
+    :rtype: Dict
+    """
+    with open(os.path.join(path, HEADER_NAME)) as f:
+        header = json.load(f)
+    if header["format_version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"{path} has format version {header['format_version']}, expected {FORMAT_VERSION}"
+        )
+    return header
+
+
+def create_store(path: str, metadata: Dict) -> Dict:
+    """Create empty store, removing the columns of any previous store in path.
+
+    :param path: Store directory.
+    :type path: str
+    :param metadata: Settings of the run (e.g., seed, grid settings, source file).
+    :type metadata: Dict
+    :return: Header of the new store.
+    :rtype: Dict
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    elif is_store(path):
+        for name in load_header(path)["columns"]:
+            if os.path.exists(column_path(path, name)):
+                os.remove(column_path(path, name))
+    header = {
+        "format_version": FORMAT_VERSION,
+        # Round trip through JSON so that the metadata compares equal after loading
+        "metadata": json.loads(json.dumps(metadata)),
+        "columns": {},
+        "n_rows": 0,
+        "chunks": [],
+    }
+    save_header(header, path)
+    return header
+
+
+def open_store(path: str, metadata: Dict) -> Dict:
+    """Open store to append to it, or create it if there isn't any.
+
+    :param path: Store directory.
+    :type path: str
+    :param metadata: Settings of the current run.
+    :type metadata: Dict
+    :raises ValueError: If the store was written by a run with different settings.
+    :return: Header of the store.
+    :rtype: Dict
+    """
+    if not is_store(path):
+        return create_store(path, metadata)
+    header = load_header(path)
+    if header["metadata"] != json.loads(json.dumps(metadata)):
+        raise ValueError(
+            f"{path} has outputs of a run with settings {header['metadata']}, "
+            f"can't append with {metadata}"
+        )
+    return header
+
+
+def append_chunk(path: str, columns: Dict[str, np.ndarray], info: Dict = None) -> Dict:
+    """Append rows to every column of a store. Column files are extended first and the
+    header is written last, so an interrupted append leaves the store as it was.
+
+    :param path: Store directory.
+    :type path: str
+    :param columns: Rows of each column, shape (rows, width). Every chunk must have the
+                    same columns.
+    :type columns: Dict[str, np.ndarray]
+    :param info: Information saved with the chunk (e.g., range of events), defaults to None.
+    :type info: Dict, optional
+    :raises ValueError: If the columns don't match the ones already in the store.
+    :return: Updated header.
+    :rtype: Dict
+    """
+    header = load_header(path)
+    columns = {name: np.asarray(array) for name, array in columns.items()}
+    columns = {
+        name: array.reshape(array.shape[0], int(np.prod(array.shape[1:])))
+        for name, array in columns.items()
+    }
+    n_rows = {len(array) for array in columns.values()}
+    if len(n_rows) != 1:
+        raise ValueError(f"Columns have different number of rows: {n_rows}")
+    n_rows = n_rows.pop()
+
+    if not header["columns"]:
+        header["columns"] = {
+            name: {"dtype": array.dtype.str, "width": array.shape[1]}
+            for name, array in columns.items()
+        }
+    if set(columns) != set(header["columns"]):
+        raise ValueError(
+            f"Chunk has columns {sorted(columns)}, store has {sorted(header['columns'])}"
+        )
+    for name, array in columns.items():
+        column = header["columns"][name]
+        # Empty chunks have nothing to cast, whatever their dtype
+        castable = n_rows == 0 or np.can_cast(array.dtype, column["dtype"])
+        if array.shape[1] != column["width"] or not castable:
+            raise ValueError(
+                f"Column {name} has width {column['width']} and dtype {column['dtype']}, "
+                f"got {array.shape[1]} and {array.dtype.str}"
+            )
+
+    for name, array in columns.items():
+        column = header["columns"][name]
+        committed = header["n_rows"] * column["width"] * np.dtype(column["dtype"]).itemsize
+        with open(column_path(path, name), "ab") as f:
+            # Drop rows of an append that didn't reach the header
+            f.truncate(committed)
+            f.write(np.ascontiguousarray(array, dtype=column["dtype"]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    header["chunks"].append(
+        {"start": header["n_rows"], "stop": header["n_rows"] + n_rows, **(info or {})}
+    )
+    header["n_rows"] += n_rows
+    save_header(header, path)
+    return header
+
+
+def write_store(path: str, columns: Dict[str, np.ndarray], metadata: Dict) -> Dict:
+    """Create store with a single chunk.
+
+    :param path: Store directory.
+    :type path: str
+    :param columns: Rows of each column, shape (rows, width).
+    :type columns: Dict[str, np.ndarray]
+    :param metadata: Settings of the run.
+    :type metadata: Dict
+    :return: Header of the store.
+    :rtype: Dict
+    """
+    create_store(path, metadata)
+    return append_chunk(path, columns)
+
+
+def read_column(path: str, name: str, header: Dict = None) -> np.ndarray:
+    """Memory-map a column of a store without reading it.
+
+    :param path: Store directory.
+    :type path: str
+    :param name: Name of the column.
+    :type name: str
+    :param header: Header of the store, defaults to None (loaded from path).
+    :type header: Dict, optional
+    :return: Read-only column, shape (rows, width).
+    :rtype: np.ndarray
+    """
+    header = header or load_header(path)
+    column = header["columns"][name]
+    shape = (header["n_rows"], column["width"])
+    if header["n_rows"] == 0:
+        return np.empty(shape, dtype=column["dtype"])
+    return np.memmap(column_path(path, name), dtype=column["dtype"], mode="r", shape=shape)
+
+
+def read_columns(path: str, names: List[str] = None) -> Dict[str, np.ndarray]:
+    """Memory-map several columns of a store.
+
+    :param path: Store directory.
+    :type path: str
+    :param names: Names of the columns, defaults to None (all columns).
+    :type names: List[str], optional
+    :return: Read-only columns by name.
+    :rtype: Dict[str, np.ndarray]
+    """
+    header = load_header(path)
+    names = list(header["columns"]) if names is None else names
+    return {name: read_column(path, name, header=header) for name in names}
@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+import uproot
+import numpy as np
+
+from typing import Dict
+from awkward.array.jagged import JaggedArray
+
+from processing import event_selection
+from processing.branch_cache import BranchCache
+
+
+def file_hash(path: str, chunk_size: int = 1 << 24) -> str:
+    """Calculate SHA-256 hash of a file's content.
+
+    :param path: Path to file.
+    :type path: str
+    :param chunk_size: Number of bytes read at a time, defaults to 16 MiB.
+    :type chunk_size: int, optional
+    :return: Hex digest of the file's content.
+    :rtype: str
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_key(root_path: str) -> str:
+    """Build key for the selected events of a ROOT file. The key changes if
+    either the file's content or any of the selection cuts change.
+
+    :param root_path: Path to Delphes ROOT file.
+    :type root_path: str
+    :return: Key for the cached selection.
+    :rtype: str
+    """
+    cuts = json.dumps(event_selection.selection_cuts(), sort_keys=True)
+    key = hashlib.sha256((file_hash(root_path) + cuts).encode())
+    return key.hexdigest()[:32]
+
+
+def save_selection(objects: Dict[str, JaggedArray], path: str, metadata: Dict = None):
+    """Save selected objects as flat columns with their counts per event.
+
+    :param objects: Selected objects' kinematics by name.
+    :type objects: Dict[str, JaggedArray]
+    :param path: Output .npz file.
+    :type path: str
+    :param metadata: Extra information saved with the columns, defaults to None.
+    :type metadata: Dict, optional
+    """
+    columns = {}
+    for name, jagged_array in objects.items():
+        columns[f"{name}.counts"] = jagged_array.counts
+        columns[f"{name}.content"] = jagged_array.flatten()
+    columns["metadata"] = np.array(json.dumps(metadata or {}))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **columns)
+    os.replace(tmp_path, path)
+
+
+def load_selection(path: str) -> Dict[str, JaggedArray]:
+    """Load selected objects saved with save_selection.
+
+    :param path: Path to .npz file.
+    :type path: str
+    :return: Selected objects' kinematics by name.
+    :rtype: Dict[str, JaggedArray]
+    """
+    objects = {}
+    with np.load(path) as columns:
+        names = [key[: -len(".counts")] for key in columns.files if key.endswith(".counts")]
+        for name in names:
+            objects[name] = JaggedArray.fromcounts(
+                columns[f"{name}.counts"], columns[f"{name}.content"]
+            )
+    return objects
+
+
+def load_or_select(
+    root_path: str, cache_dir: str, tree_name: str = "Delphes"
+) -> Dict[str, JaggedArray]:
+    """Get the selected objects of a ROOT file from the cache, applying the
+    selection and filling the cache if they aren't there.
+
+    :param root_path: Path to Delphes ROOT file.
+    :type root_path: str
+    :param cache_dir: Directory with the cached selections.
+    :type cache_dir: str
+    :param tree_name: Name of the TTree with the events, defaults to "Delphes".
+    :type tree_name: str, optional
+    :return: Selected objects' kinematics by name.
+    :rtype: Dict[str, JaggedArray]
+    """
+    key = cache_key(root_path)
+    path = os.path.join(cache_dir, f"selection_{key}.npz")
+    if os.path.exists(path):
+        return load_selection(path)
+
+    events = BranchCache(uproot.open(root_path)[tree_name])
+    objects = event_selection.select_objects(events)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    metadata = {
+        "source": os.path.abspath(root_path),
+        "cuts": event_selection.selection_cuts(),
+    }
+    save_selection(objects, path, metadata=metadata)
+    return objects
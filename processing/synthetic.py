@@ -0,0 +1,336 @@
+import numpy as np
+import uproot
+
+from typing import Dict, Tuple
+from awkward.array.jagged import JaggedArray
+
+from processing import lorentz
+
+
+# Masses of the generated particles
+M_TOP = 172.5
+M_W = 80.4
+M_B = 4.7
+# Hard-process kinematics
+TOP_PT_SCALE = 80.0
+TOP_ETA_WIDTH = 1.2
+# Detector response and event content
+JET_PT_RESOLUTION = 0.1
+BTAG_EFFICIENCY = 0.77
+MISTAG_RATE = 0.01
+LIGHT_JETS_MEAN = 1.5
+LIGHT_JET_PT_SCALE = 40.0
+LIGHT_JET_PT_MIN = 15.0
+LEPTON_EFFICIENCY = 0.9
+FAKE_LEPTON_RATE = 0.05
+FAKE_LEPTON_PT_SCALE = 15.0
+FAKE_LEPTON_PT_MIN = 10.0
+MET_RESOLUTION = 5.0
+EXTRA_PARTICLES_MEAN = 20
+# Status codes of the hard-process particles, the first ones of each event in the
+# truth record: t, tbar, W+, W-, b, bbar, l+, nu, l-, nubar
+HARD_PROCESS_STATUS = np.array([22, 22, 22, 22, 23, 23, 1, 1, 1, 1])
+# Position of the mother of each hard-process particle in its event, -1 for none
+HARD_PROCESS_MOTHER = np.array([-1, -1, 0, 1, 0, 1, 2, 2, 3, 3])
+ELECTRON_PID = 11
+MUON_PID = 13
+
+
+class SyntheticBranch:
+    """Stand-in for a TBranch holding a generated array."""
+
+    def __init__(self, array: JaggedArray):
+        self._array = array
+
+    def array(self, entrystart: int = None, entrystop: int = None) -> JaggedArray:
+        if entrystart is None and entrystop is None:
+            return self._array
+        return self._array[entrystart:entrystop]
+
+
+class SyntheticTree(dict):
+    """Generated Delphes-like events. It can be passed anywhere a Delphes TTree is
+    expected (e.g., to BranchCache or event_selection.select_objects) since
+    `tree[key].array()` works the same way.
+
+    :param columns: Jagged array of each branch by name (e.g., 'Jet.PT').
+    :type columns: Dict[str, JaggedArray]
+    :param n_events: Number of events.
+    :type n_events: int
+    """
+
+    def __init__(self, columns: Dict[str, JaggedArray], n_events: int):
+        super().__init__({key: SyntheticBranch(array) for key, array in columns.items()})
+        self.n_events = n_events
+
+    def __len__(self) -> int:
+        return self.n_events
+
+
+def boost(p: np.ndarray, beta: np.ndarray) -> np.ndarray:
+    """Boost four-vectors by velocities.
+
+    :param p: Four-vectors in (x, y, z, E) coordinates, shape (N, 4).
+    :type p: np.ndarray
+    :param beta: Velocity of the boost, shape (N, 3).
+    :type beta: np.ndarray
+    :return: Boosted four-vectors, shape (N, 4).
+    :rtype: np.ndarray
+    """
+    beta2 = np.sum(beta ** 2, axis=1, keepdims=True)
+    gamma = 1 / np.sqrt(1 - beta2)
+    beta_p = np.sum(p[:, :3] * beta, axis=1, keepdims=True)
+    gamma2 = np.where(beta2 > 0, (gamma - 1) / np.where(beta2 > 0, beta2, 1), 0)
+    space = p[:, :3] + gamma2 * beta_p * beta + gamma * beta * p[:, 3:]
+    time = gamma * (p[:, 3:] + beta_p)
+    return np.concatenate([space, time], axis=1)
+
+
+def two_body_decay(
+    rng: np.random.Generator, parent: np.ndarray, m1: float, m2: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Decay particles isotropically in their rest frame into two daughters.
+
+    :param rng: Random number generator.
+    :type rng: np.random.Generator
+    :param parent: Four-momenta of the parents, shape (N, 4).
+    :type parent: np.ndarray
+    :param m1: Mass of the first daughter.
+    :type m1: float
+    :param m2: Mass of the second daughter.
+    :type m2: float
+    :return: Four-momenta of both daughters in the lab frame, shape (N, 4) each.
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    n = len(parent)
+    m = np.sqrt(np.maximum(parent[:, 3] ** 2 - np.sum(parent[:, :3] ** 2, axis=1), 0))
+    p_star = np.sqrt((m ** 2 - (m1 + m2) ** 2) * (m ** 2 - (m1 - m2) ** 2)) / (2 * m)
+    cos_theta = rng.uniform(-1, 1, n)
+    sin_theta = np.sqrt(1 - cos_theta ** 2)
+    phi = rng.uniform(-np.pi, np.pi, n)
+    direction = np.stack([sin_theta * np.cos(phi), sin_theta * np.sin(phi), cos_theta], axis=1)
+    p = direction * p_star[:, None]
+    p1 = np.concatenate([p, np.sqrt(p_star ** 2 + m1 ** 2)[:, None]], axis=1)
+    p2 = np.concatenate([-p, np.sqrt(p_star ** 2 + m2 ** 2)[:, None]], axis=1)
+    beta = parent[:, :3] / parent[:, 3:]
+    return boost(p1, beta), boost(p2, beta)
+
+
+def generate_tops(rng: np.random.Generator, n_events: int) -> np.ndarray:
+    """Draw four-momenta of on-shell top quarks.
+
+    :param rng: Random number generator.
+    :type rng: np.random.Generator
+    :param n_events: Number of events.
+    :type n_events: int
+    :return: Four-momenta, shape (n_events, 4).
+    :rtype: np.ndarray
+    """
+    pt = rng.exponential(TOP_PT_SCALE, n_events) + 10
+    eta = rng.normal(0, TOP_ETA_WIDTH, n_events)
+    phi = rng.uniform(-np.pi, np.pi, n_events)
+    return lorentz.FourVectorBatch.from_pt_eta_phi_mass(
+        pt, eta, phi, np.full(n_events, M_TOP)
+    ).to_array()
+
+
+def jagged_columns(
+    parents: np.ndarray, pt: np.ndarray, n_events: int, columns: Dict[str, np.ndarray]
+) -> Dict[str, JaggedArray]:
+    """Group objects by event, ordered by decreasing pt in each event as in Delphes.
+
+    :param parents: Event of each object.
+    :type parents: np.ndarray
+    :param pt: Transverse momentum of each object.
+    :type pt: np.ndarray
+    :param n_events: Number of events.
+    :type n_events: int
+    :param columns: Flat values of each branch by name.
+    :type columns: Dict[str, np.ndarray]
+    :return: Jagged array of each branch by name.
+    :rtype: Dict[str, JaggedArray]
+    """
+    order = np.lexsort((-pt, parents))
+    counts = np.bincount(parents, minlength=n_events)
+    return {
+        name: JaggedArray.fromcounts(counts, values[order]) for name, values in columns.items()
+    }
+
+
+def generate_ttbar_dilepton(n_events: int, random_seed: int = 0) -> SyntheticTree:
+    """Generate Delphes-like dilepton ttbar events without MadGraph or Delphes. Tops
+    decay through W bosons to b quarks, electrons or muons and neutrinos. Reconstructed
+    objects get a simple detector response: smeared b-jet pt, b-tagging efficiency
+    and mistags, additional light jets, lepton efficiency, fake leptons and MET
+    resolution. The truth record holds the hard process followed by soft particles.
+    Kinematics are rough, the events are meant for tests and benchmarks, not physics.
+
+    :param n_events: Number of events.
+    :type n_events: int
+    :param random_seed: Seed of the generator, defaults to 0.
+    :type random_seed: int, optional
+    :return: Events with the Jet, Electron, Muon, MissingET and Particle branches.
+    :rtype: SyntheticTree
+    """
+    rng = np.random.default_rng(random_seed)
+    event_idxs = np.arange(n_events)
+
+    p_top = generate_tops(rng, n_events)
+    p_tbar = generate_tops(rng, n_events)
+    p_w_plus, p_b = two_body_decay(rng, p_top, M_W, M_B)
+    p_w_minus, p_bbar = two_body_decay(rng, p_tbar, M_W, M_B)
+    p_l_plus, p_nu = two_body_decay(rng, p_w_plus, 0.0, 0.0)
+    p_l_minus, p_nubar = two_body_decay(rng, p_w_minus, 0.0, 0.0)
+    pid_l_plus = -rng.choice([ELECTRON_PID, MUON_PID], n_events)
+    pid_l_minus = rng.choice([ELECTRON_PID, MUON_PID], n_events)
+
+    columns = {}
+
+    # Jets: both b quarks and a random number of light jets
+    b_quarks = lorentz.FourVectorBatch.from_array(np.concatenate([p_b, p_bbar]))
+    n_light = rng.poisson(LIGHT_JETS_MEAN, n_events)
+    n_b, n_jets = 2 * n_events, 2 * n_events + n_light.sum()
+    jet_parents = np.concatenate([event_idxs, event_idxs, np.repeat(event_idxs, n_light)])
+    jet_pt = np.concatenate(
+        [
+            b_quarks.pt * rng.normal(1, JET_PT_RESOLUTION, n_b),
+            rng.exponential(LIGHT_JET_PT_SCALE, n_jets - n_b) + LIGHT_JET_PT_MIN,
+        ]
+    )
+    is_b = np.arange(n_jets) < n_b
+    jet_columns = {
+        "Jet.PT": jet_pt.astype(np.float32),
+        "Jet.Eta": np.concatenate(
+            [b_quarks.eta, rng.normal(0, 2, n_jets - n_b)]
+        ).astype(np.float32),
+        "Jet.Phi": np.concatenate(
+            [b_quarks.phi, rng.uniform(-np.pi, np.pi, n_jets - n_b)]
+        ).astype(np.float32),
+        "Jet.Mass": np.concatenate(
+            [M_B + rng.uniform(0, 8, n_b), rng.uniform(2, 10, n_jets - n_b)]
+        ).astype(np.float32),
+        "Jet.BTag": (
+            rng.random(n_jets) < np.where(is_b, BTAG_EFFICIENCY, MISTAG_RATE)
+        ).astype(np.int32),
+    }
+    columns.update(jagged_columns(jet_parents, jet_pt, n_events, jet_columns))
+
+    # Leptons: W decay products found with some efficiency, plus fakes
+    leptons = lorentz.FourVectorBatch.from_array(np.concatenate([p_l_plus, p_l_minus]))
+    found = rng.random(2 * n_events) < LEPTON_EFFICIENCY
+    has_fake = rng.random(n_events) < FAKE_LEPTON_RATE
+    n_fakes = has_fake.sum()
+    lepton_parents = np.concatenate([event_idxs, event_idxs])[found]
+    lepton_parents = np.concatenate([lepton_parents, event_idxs[has_fake]])
+    lepton_pid = np.concatenate(
+        [
+            np.concatenate([pid_l_plus, pid_l_minus])[found],
+            rng.choice([-1, 1], n_fakes) * rng.choice([ELECTRON_PID, MUON_PID], n_fakes),
+        ]
+    )
+    lepton_pt = np.concatenate(
+        [leptons.pt[found], rng.exponential(FAKE_LEPTON_PT_SCALE, n_fakes) + FAKE_LEPTON_PT_MIN]
+    )
+    lepton_eta = np.concatenate([leptons.eta[found], rng.normal(0, 1.5, n_fakes)])
+    lepton_phi = np.concatenate([leptons.phi[found], rng.uniform(-np.pi, np.pi, n_fakes)])
+    for name, pid in [("Electron", ELECTRON_PID), ("Muon", MUON_PID)]:
+        flavour = np.abs(lepton_pid) == pid
+        lepton_columns = {
+            f"{name}.PT": lepton_pt[flavour].astype(np.float32),
+            f"{name}.Eta": lepton_eta[flavour].astype(np.float32),
+            f"{name}.Phi": lepton_phi[flavour].astype(np.float32),
+            # Negative PIDs are positive leptons
+            f"{name}.Charge": -np.sign(lepton_pid[flavour]).astype(np.int32),
+        }
+        columns.update(
+            jagged_columns(lepton_parents[flavour], lepton_pt[flavour], n_events, lepton_columns)
+        )
+
+    # Missing ET: neutrinos' transverse momenta with a resolution
+    met = p_nu[:, :2] + p_nubar[:, :2] + rng.normal(0, MET_RESOLUTION, (n_events, 2))
+    single = np.ones(n_events, dtype=np.int64)
+    columns["MissingET.MET"] = JaggedArray.fromcounts(
+        single, np.hypot(met[:, 0], met[:, 1]).astype(np.float32)
+    )
+    columns["MissingET.Phi"] = JaggedArray.fromcounts(
+        single, np.arctan2(met[:, 1], met[:, 0]).astype(np.float32)
+    )
+
+    # Truth record: hard process first, then soft pions and photons
+    hard_process = np.stack(
+        [p_top, p_tbar, p_w_plus, p_w_minus, p_b, p_bbar, p_l_plus, p_nu, p_l_minus, p_nubar],
+        axis=1,
+    )
+    n_hard = hard_process.shape[1]
+    hard_pid = np.stack(
+        [np.full(n_events, pid) for pid in [6, -6, 24, -24, 5, -5]]
+        # Neutrinos have the opposite sign of their lepton's PID and |PID| + 1
+        + [pid_l_plus, 1 - pid_l_plus, pid_l_minus, -1 - pid_l_minus],
+        axis=1,
+    )
+    n_extra = rng.poisson(EXTRA_PARTICLES_MEAN, n_events)
+    n_soft = n_extra.sum()
+    soft = lorentz.FourVectorBatch.from_pt_eta_phi_mass(
+        rng.exponential(2, n_soft),
+        rng.normal(0, 3, n_soft),
+        rng.uniform(-np.pi, np.pi, n_soft),
+        np.zeros(n_soft),
+    ).to_array()
+    particle_parents = np.concatenate(
+        [np.repeat(event_idxs, n_hard), np.repeat(event_idxs, n_extra)]
+    )
+    # Stable sort keeps the hard process first in each event
+    order = np.argsort(particle_parents, kind="stable")
+    particles = np.concatenate([hard_process.reshape(-1, 4), soft])[order]
+    particle_pid = np.concatenate(
+        [hard_pid.ravel(), rng.choice([211, -211, 22], n_soft)]
+    )[order]
+    particle_status = np.concatenate(
+        [np.tile(HARD_PROCESS_STATUS, n_events), np.ones(n_soft, dtype=int)]
+    )[order]
+    particle_mother = np.concatenate(
+        [np.tile(HARD_PROCESS_MOTHER, n_events), np.full(n_soft, -1)]
+    )[order]
+    particle_counts = n_hard + n_extra
+    p = lorentz.FourVectorBatch.from_array(particles)
+    particle_columns = {
+        "Particle.PID": particle_pid.astype(np.int32),
+        "Particle.Status": particle_status.astype(np.int32),
+        "Particle.M1": particle_mother.astype(np.int32),
+        "Particle.M2": np.full(len(particle_mother), -1, dtype=np.int32),
+    }
+    for branch, values in [
+        ("Px", p.px), ("Py", p.py), ("Pz", p.pz), ("E", p.E),
+        ("PT", p.pt), ("Eta", p.eta), ("Phi", p.phi), ("Mass", p.mass),
+    ]:
+        particle_columns[f"Particle.{branch}"] = values.astype(np.float32)
+    for name, values in particle_columns.items():
+        columns[name] = JaggedArray.fromcounts(particle_counts, values)
+
+    return SyntheticTree(columns, n_events)
+
+
+def write_root(tree: SyntheticTree, path: str, tree_name: str = "Delphes"):
+    """Write generated events to a ROOT file readable like a Delphes output, so that
+    scripts reading ROOT files (e.g., ttbar_dilepton.py) can run on them.
+
+    :param tree: Generated events.
+    :type tree: SyntheticTree
+    :param path: Path to the ROOT file.
+    :type path: str
+    :param tree_name: Name of the TTree, defaults to 'Delphes'.
+    :type tree_name: str, optional
+    """
+    arrays = {key: branch.array() for key, branch in tree.items()}
+    # Branches of a collection share the counts stored in '<collection>_size'
+    branches = {
+        key: uproot.newbranch(array.content.dtype, size=f"{key.split('.')[0]}_size")
+        for key, array in arrays.items()
+    }
+    sizes = {
+        f"{key.split('.')[0]}_size": array.counts.astype(np.int32)
+        for key, array in arrays.items()
+    }
+    with uproot.recreate(path, compression=None) as f:
+        f[tree_name] = uproot.newtree(branches)
+        f[tree_name].extend({**arrays, **sizes})
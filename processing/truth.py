@@ -0,0 +1,271 @@
+import os
+import uproot
+import numpy as np
+
+from typing import Dict
+
+from processing import lorentz, selection_cache
+from processing.branch_cache import BranchCache
+
+
+# PIDs, status and mother of the hard-process particles. The shower makes copies
+# of a particle (e.g., after radiating a photon), linked by Particle.M1; a particle
+# comes from its mother if the first copy of its chain is a daughter of any copy
+# of the mother. If status is None, the first copy of the particle is used.
+TRUTH_PARTICLES = {
+    "top": ([6], 22, None),
+    "tbar": ([-6], 22, None),
+    "w_plus": ([24], None, "top"),
+    "w_minus": ([-24], None, "tbar"),
+    "b": ([5], None, "top"),
+    "bbar": ([-5], None, "tbar"),
+    "l_plus": ([-11, -13], 1, "w_plus"),
+    "l_minus": ([11, 13], 1, "w_minus"),
+    "nu": ([12, 14], 1, "w_plus"),
+    "nubar": ([-12, -14], 1, "w_minus"),
+}
+# Maximum number of copies of a particle followed up the mother chain
+MAX_ANCESTRY_DEPTH = 100
+# Version of the truth selection, part of the cached index file names
+TRUTH_INDEX_VERSION = 2
+# Hard-process particle each reconstructed object is compared with
+RECO_TRUTH_PAIRS = {
+    "p_top": "top",
+    "p_l_t": "l_plus",
+    "p_b_t": "b",
+    "p_nu_t": "nu",
+    "p_tbar": "tbar",
+    "p_l_tbar": "l_minus",
+    "p_b_tbar": "bbar",
+    "p_nu_tbar": "nubar",
+}
+
+
+def first_copies(flat_pid: np.ndarray, flat_mother: np.ndarray) -> np.ndarray:
+    """Follow the mother of each particle through the copies with the same PID up
+    to the first copy of the particle.
+
+    :param flat_pid: Flat PIDs of the particles of all events.
+    :type flat_pid: np.ndarray
+    :param flat_mother: Flat index of the first mother of each particle, -1 if
+                        it has none.
+    :type flat_mother: np.ndarray
+    :return: Flat index of the first copy of each particle.
+    :rtype: np.ndarray
+    """
+    first_copy = np.arange(len(flat_pid))
+    for _ in range(MAX_ANCESTRY_DEPTH):
+        mother = flat_mother[first_copy]
+        is_copy = mother >= 0
+        is_copy[is_copy] = flat_pid[mother[is_copy]] == flat_pid[first_copy[is_copy]]
+        if not is_copy.any():
+            break
+        first_copy[is_copy] = mother[is_copy]
+    return first_copy
+
+
+def build_truth_index(events) -> Dict[str, np.ndarray]:
+    """Find position of the hard-process particles of each event in the flat
+    contents of the Particle branches. The decay chain t -> W b, W -> l nu is
+    checked following Particle.M1, so leptons from other sources (e.g., tau or
+    hadron decays) aren't used.
+
+    :param events: Delphes event TTree
+    :type events: TTree
+    :return: Flat index of each particle by name (see TRUTH_PARTICLES), -1 if the
+             particle isn't in the event.
+    :rtype: Dict[str, np.ndarray]
+    """
+    pid = events["Particle.PID"].array()
+    status = events["Particle.Status"].array()
+    mother = events["Particle.M1"].array()
+    counts = pid.counts
+    flat_pid = pid.flatten()
+    flat_status = status.flatten()
+    parents = np.repeat(np.arange(len(counts)), counts)
+    # Particle.M1 is the position of the mother within its event
+    flat_mother = mother.flatten().astype(np.int64)
+    has_mother = flat_mother >= 0
+    flat_mother[has_mother] += pid.starts[parents[has_mother]]
+    first_copy = first_copies(flat_pid, flat_mother)
+    # First copy of the mother of each particle's chain, -1 if there's no mother
+    chain_mother = flat_mother[first_copy]
+    has_mother = chain_mother >= 0
+    chain_mother[has_mother] = first_copy[chain_mother[has_mother]]
+
+    truth_index = {}
+    for name, (pids, required_status, required_mother) in TRUTH_PARTICLES.items():
+        match = np.isin(flat_pid, pids)
+        if required_status is not None:
+            match &= flat_status == required_status
+        else:
+            match &= first_copy == np.arange(len(flat_pid))
+        if required_mother is not None:
+            mother_index = truth_index[required_mother][parents]
+            match &= (chain_mother == mother_index) & (mother_index >= 0)
+        positions = np.nonzero(match)[0]
+        # positions are sorted, so the first match of each event comes first
+        matched_events, first_match = np.unique(parents[positions], return_index=True)
+        particle_index = np.full(len(counts), -1, dtype=np.int64)
+        particle_index[matched_events] = positions[first_match]
+        truth_index[name] = particle_index
+    return truth_index
+
+
+def load_or_build_truth_index(
+    root_path: str, cache_dir: str = None, tree_name: str = "Delphes"
+) -> Dict[str, np.ndarray]:
+    """Get truth index of a ROOT file from the cache, building it if it isn't there.
+
+    :param root_path: Path to Delphes ROOT file.
+    :type root_path: str
+    :param cache_dir: Directory with the cached indexes, defaults to None (the
+                      directory of the ROOT file).
+    :type cache_dir: str, optional
+    :param tree_name: Name of the TTree with the events, defaults to "Delphes".
+    :type tree_name: str, optional
+    :return: Flat index of each hard-process particle by name.
+    :rtype: Dict[str, np.ndarray]
+    """
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(root_path))
+    key = selection_cache.file_hash(root_path)[:32]
+    path = os.path.join(cache_dir, f"truth_index_v{TRUTH_INDEX_VERSION}_{key}.npz")
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            return {name: cached[name] for name in cached.files}
+
+    events = BranchCache(uproot.open(root_path)[tree_name])
+    truth_index = build_truth_index(events)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **truth_index)
+    os.replace(tmp_path, path)
+    return truth_index
+
+
+def truth_values(
+    events, truth_index: Dict[str, np.ndarray], name: str, key: str
+) -> np.ndarray:
+    """Gather a Particle quantity for one hard-process particle in each event.
+
+    :param events: Delphes event TTree
+    :type events: TTree
+    :param truth_index: Flat index of each hard-process particle by name.
+    :type truth_index: Dict[str, np.ndarray]
+    :param name: Name of the particle (e.g., 'top').
+    :type name: str
+    :param key: Key for Particle TBranchElement (e.g., 'Particle.PT').
+    :type key: str
+    :return: Particle's quantity in each event, NaN if the particle isn't in the event.
+    :rtype: np.ndarray
+    """
+    particle_index = truth_index[name]
+    flat_values = events[key].array().flatten()
+    values = np.full(len(particle_index), np.nan)
+    found = particle_index >= 0
+    values[found] = flat_values[particle_index[found]]
+    return values
+
+
+def truth_four_momenta(events, truth_index: Dict[str, np.ndarray], name: str) -> np.ndarray:
+    """Gather four-momentum of one hard-process particle in each event.
+
+    :param events: Delphes event TTree
+    :type events: TTree
+    :param truth_index: Flat index of each hard-process particle by name.
+    :type truth_index: Dict[str, np.ndarray]
+    :param name: Name of the particle (e.g., 'top').
+    :type name: str
+    :return: Four-momenta in (x, y, z, E) coordinates, NaN if the particle
+             isn't in the event.
+    :rtype: np.ndarray
+    """
+    coords = ["Px", "Py", "Pz", "E"]
+    return np.stack(
+        [truth_values(events, truth_index, name, f"Particle.{coord}") for coord in coords],
+        axis=1,
+    )
+
+
+def gather_truth_four_momenta(
+    recos: Dict[str, np.ndarray], events, truth_index, name: str
+) -> np.ndarray:
+    """Gather the four-momentum of one hard-process particle for each reconstructed
+    row. Rows are joined with the events on (source, idx) when the outputs have a
+    'source' column (see reconstruct/process_dataset.py), and on idx otherwise.
+
+    :param recos: Reconstructed quantities with the 'idx' (and optionally the
+                  'source') of the event each row comes from.
+    :type recos: Dict[str, np.ndarray]
+    :param events: Delphes event TTree, or a list of TTrees by source index.
+    :type events: TTree or List[TTree]
+    :param truth_index: Truth index of the events, or a list of them by source index.
+    :type truth_index: Dict[str, np.ndarray] or List[Dict[str, np.ndarray]]
+    :param name: Name of the particle (e.g., 'top').
+    :type name: str
+    :return: Four-momenta in (x, y, z, E) coordinates, NaN if the particle
+             isn't in the event.
+    :rtype: np.ndarray
+    """
+    event_idx = np.asarray(recos["idx"]).reshape(-1).astype(np.int64)
+    if "source" not in recos:
+        return truth_four_momenta(events, truth_index, name)[event_idx]
+
+    source = np.asarray(recos["source"]).reshape(-1).astype(np.int64)
+    if len(source) and source.max() >= len(events):
+        raise ValueError(
+            f"Outputs come from {source.max() + 1} sources, but {len(events)} were given"
+        )
+    p_truth = np.full((len(event_idx), 4), np.nan)
+    for source_idx in np.unique(source):
+        rows = source == source_idx
+        p_source = truth_four_momenta(events[source_idx], truth_index[source_idx], name)
+        p_truth[rows] = p_source[event_idx[rows]]
+    return p_truth
+
+
+def match_reconstruction(
+    recos: Dict[str, np.ndarray],
+    events,
+    truth_index,
+    max_dR: float = 0.4,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """Compare reconstructed objects with their hard-process particles for all
+    events at once. Outputs of several files (with a 'source' column) are
+    matched with the events of their own file.
+
+    :param recos: Reconstructed four-momenta by name (e.g., 'p_l_t'), the 'idx'
+                  of the event each row comes from and optionally its 'source'.
+    :type recos: Dict[str, np.ndarray]
+    :param events: Delphes event TTree the reconstruction was run on, or a list
+                   of TTrees by source index if recos has a 'source' column.
+    :type events: TTree or List[TTree]
+    :param truth_index: Flat index of each hard-process particle by name, or a
+                        list of them by source index.
+    :type truth_index: Dict[str, np.ndarray] or List[Dict[str, np.ndarray]]
+    :param max_dR: Maximum delta R for an object to be matched, defaults to 0.4.
+    :type max_dR: float, optional
+    :return: For each reconstructed object: delta R to the truth particle, match
+             flag and relative residuals of pt and energy (NaN if the particle
+             isn't in the event).
+    :rtype: Dict[str, Dict[str, np.ndarray]]
+    """
+    matches = {}
+    for reco_name, truth_name in RECO_TRUTH_PAIRS.items():
+        if reco_name not in recos:
+            continue
+        p_reco = lorentz.FourVectorBatch.from_array(np.asarray(recos[reco_name]))
+        p_truth = lorentz.FourVectorBatch.from_array(
+            gather_truth_four_momenta(recos, events, truth_index, truth_name)
+        )
+        dR = p_reco.dR(p_truth)
+        matches[reco_name] = {
+            "dR": dR,
+            "matched": dR < max_dR,
+            "pt_residual": (p_reco.pt - p_truth.pt) / p_truth.pt,
+            "E_residual": (p_reco.E - p_truth.E) / p_truth.E,
+        }
+    return matches
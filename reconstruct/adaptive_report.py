@@ -0,0 +1,142 @@
+import sys
+import json
+import time
+import uproot
+import numpy as np
+
+from argparse import ArgumentParser
+from typing import Dict
+
+sys.path.append("..")
+from processing import event_selection, lorentz  # noqa: E402
+from processing.branch_cache import BranchCache  # noqa: E402
+from ttbar_dilepton import (  # noqa: E402
+    ADAPTIVE_SEARCH,
+    M_T_SEARCH,
+    NU_ETA_GRID,
+    reconstruct_batch,
+)
+
+
+def grid_points(adaptive: Dict) -> Dict[str, int]:
+    """Count (top mass, eta) points evaluated per event by the dense and adaptive searches.
+
+    :param adaptive: Settings of the coarse-to-fine eta search (see ADAPTIVE_SEARCH).
+    :type adaptive: Dict
+    :return: Number of points of each search.
+    :rtype: Dict[str, int]
+    """
+    n_refined = adaptive["n_seeds"] * (2 * adaptive["radius"] + 1) ** 2
+    n_adaptive = adaptive["n_coarse"] ** 2 + adaptive["depth"] * n_refined
+    return {
+        "dense": int(M_T_SEARCH.shape[0] * NU_ETA_GRID.shape[0]),
+        "adaptive": int(M_T_SEARCH.shape[0] * n_adaptive),
+    }
+
+
+def compare_solutions(
+    dense: Dict[str, np.ndarray], adaptive: Dict[str, np.ndarray]
+) -> Dict[str, float]:
+    """Compare solutions of the dense and adaptive searches for the same events.
+
+    :param dense: Reconstructed quantities of the dense search.
+    :type dense: Dict[str, np.ndarray]
+    :param adaptive: Reconstructed quantities of the adaptive search.
+    :type adaptive: Dict[str, np.ndarray]
+    :return: Summary of the differences for the events reconstructed by both searches.
+    :rtype: Dict[str, float]
+    """
+    common, dense_idx, adaptive_idx = np.intersect1d(
+        dense["idx"][:, 0], adaptive["idx"][:, 0], return_indices=True
+    )
+    report = {
+        "n_dense": int(len(dense["idx"])),
+        "n_adaptive": int(len(adaptive["idx"])),
+        "n_common": int(len(common)),
+    }
+    if len(common) == 0:
+        return report
+
+    same_bjets = np.all(
+        (dense["p_b_t"][dense_idx] == adaptive["p_b_t"][adaptive_idx])
+        & (dense["p_b_tbar"][dense_idx] == adaptive["p_b_tbar"][adaptive_idx]),
+        axis=1,
+    )
+    weight_diff = adaptive["weight"][adaptive_idx, 0] - dense["weight"][dense_idx, 0]
+    report.update(
+        {
+            "same_bjets_fraction": float(np.mean(same_bjets)),
+            "weight_diff_mean": float(np.mean(weight_diff)),
+            "weight_diff_min": float(np.min(weight_diff)),
+            "weight_not_lower_fraction": float(np.mean(weight_diff >= -1e-6)),
+        }
+    )
+    for name in ["p_nu_t", "p_nu_tbar", "p_top", "p_tbar"]:
+        p_dense = lorentz.FourVectorBatch.from_array(dense[name][dense_idx])
+        p_adaptive = lorentz.FourVectorBatch.from_array(adaptive[name][adaptive_idx])
+        pt_residual = np.abs(p_adaptive.pt - p_dense.pt) / p_dense.pt
+        report[f"{name}_dR_median"] = float(np.median(p_adaptive.dR(p_dense)))
+        report[f"{name}_pt_residual_median"] = float(np.median(pt_residual))
+    return report
+
+
+def adaptive_report(
+    selected: Dict, n_events: int, random_seed: int, adaptive: Dict = None
+) -> Dict:
+    """Reconstruct events with the dense and adaptive searches and compare them. Both
+    use the same smearing since every event has its own random stream.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict
+    :param n_events: Number of events to reconstruct.
+    :type n_events: int
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param adaptive: Settings of the adaptive search, defaults to None (ADAPTIVE_SEARCH).
+    :type adaptive: Dict, optional
+    :return: Settings, timings and comparison of the solutions.
+    :rtype: Dict
+    """
+    adaptive = {**ADAPTIVE_SEARCH, **(adaptive or {})}
+    outputs = {}
+    timings = {}
+    for name, engine, options in [
+        ("dense", "scan", {}),
+        ("adaptive", "adaptive", {"adaptive": adaptive}),
+    ]:
+        start = time.perf_counter()
+        outputs[name] = reconstruct_batch(
+            selected, 0, n_events, random_seed, engine=engine, engine_options=options
+        )
+        timings[f"{name}_time"] = time.perf_counter() - start
+    timings["speedup"] = timings["dense_time"] / timings["adaptive_time"]
+    return {
+        "settings": adaptive,
+        "grid_points": grid_points(adaptive),
+        **timings,
+        **compare_solutions(outputs["dense"], outputs["adaptive"]),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("path", help="Delphes ROOT file")
+    parser.add_argument("--n_events", type=int, default=1000)
+    parser.add_argument("--random_seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Save report as JSON")
+    for name, value in ADAPTIVE_SEARCH.items():
+        parser.add_argument(f"--{name}", type=type(value), default=value)
+    args = parser.parse_args()
+
+    events = BranchCache(uproot.open(args.path)["Delphes"], entrystop=args.n_events)
+    selected = event_selection.select_objects(events)
+    report = adaptive_report(
+        selected,
+        n_events=len(events),
+        random_seed=args.random_seed,
+        adaptive={name: getattr(args, name) for name in ADAPTIVE_SEARCH},
+    )
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,235 @@
+import numpy as np
+
+from typing import Tuple
+
+
+def minkowski_square(p: np.ndarray) -> np.ndarray:
+    """Calculate invariant mass squared of four-vectors in (x, y, z, E) coordinates.
+
+    :param p: Four-vectors, shape (N, 4).
+    :type p: np.ndarray
+    :return: Invariant masses squared.
+    :rtype: np.ndarray
+    """
+    return p[:, 3] ** 2 - np.sum(p[:, :3] ** 2, axis=1)
+
+
+def neutrino_linear_terms(
+    p_l: np.ndarray, p_b: np.ndarray, m_t: np.ndarray, m_w: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Write neutrino's energy and pz as linear functions of its px and py using the
+    W and top mass constraints of a massless neutrino.
+
+    :param p_l: Lepton's four-momentum, shape (N, 4).
+    :type p_l: np.ndarray
+    :param p_b: b-jet's four-momentum, shape (N, 4).
+    :type p_b: np.ndarray
+    :param m_t: Top's mass, shape (N,).
+    :type m_t: np.ndarray
+    :param m_w: W's mass.
+    :type m_w: float
+    :return: Coefficients (constant, px, py) of the energy and pz, shape (N, 3) each.
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    # E_l E - p_l.p = k_l and E_b E - p_b.p = k_b
+    k_l = (m_w ** 2 - minkowski_square(p_l)) / 2
+    k_b = (m_t ** 2 - minkowski_square(p_l + p_b)) / 2 - k_l
+    r_l = np.stack([k_l, p_l[:, 0], p_l[:, 1]], axis=1)
+    r_b = np.stack([k_b, p_b[:, 0], p_b[:, 1]], axis=1)
+    det = (p_l[:, 2] * p_b[:, 3] - p_l[:, 3] * p_b[:, 2]).reshape(-1, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        energy = (p_l[:, 2:3] * r_b - p_b[:, 2:3] * r_l) / det
+        pz = (p_l[:, 3:4] * r_b - p_b[:, 3:4] * r_l) / det
+    return energy, pz
+
+
+def neutrino_conic(energy: np.ndarray, pz: np.ndarray) -> np.ndarray:
+    """Get conic in the (px, py) plane where E**2 = px**2 + py**2 + pz**2.
+
+    :param energy: Coefficients (constant, px, py) of the neutrino's energy.
+    :type energy: np.ndarray
+    :param pz: Coefficients (constant, px, py) of the neutrino's pz.
+    :type pz: np.ndarray
+    :return: Coefficients (x**2, xy, y**2, x, y, 1) of the conic, shape (N, 6).
+    :rtype: np.ndarray
+    """
+    e0, ex, ey = energy.T
+    z0, zx, zy = pz.T
+    return np.stack(
+        [
+            ex ** 2 - zx ** 2 - 1,
+            2 * (ex * ey - zx * zy),
+            ey ** 2 - zy ** 2 - 1,
+            2 * (e0 * ex - z0 * zx),
+            2 * (e0 * ey - z0 * zy),
+            e0 ** 2 - z0 ** 2,
+        ],
+        axis=1,
+    )
+
+
+def reflect_conic(conic: np.ndarray, met_x: np.ndarray, met_y: np.ndarray) -> np.ndarray:
+    """Rewrite a conic in (x', y') as a conic in (x, y) with x' = met_x - x and
+    y' = met_y - y.
+
+    :param conic: Coefficients (x**2, xy, y**2, x, y, 1) of the conic, shape (N, 6).
+    :type conic: np.ndarray
+    :param met_x: Missing ET in x direction, shape (N,).
+    :type met_x: np.ndarray
+    :param met_y: Missing ET in y direction, shape (N,).
+    :type met_y: np.ndarray
+    :return: Coefficients of the reflected conic, shape (N, 6).
+    :rtype: np.ndarray
+    """
+    a, b, c, d, e, f = conic.T
+    return np.stack(
+        [
+            a,
+            b,
+            c,
+            -2 * a * met_x - b * met_y - d,
+            -2 * c * met_y - b * met_x - e,
+            a * met_x ** 2 + b * met_x * met_y + c * met_y ** 2 + d * met_x + e * met_y + f,
+        ],
+        axis=1,
+    )
+
+
+def polymul(p1: np.ndarray, p2: np.ndarray) -> np.ndarray:
+    """Multiply batches of polynomials with coefficients in increasing order.
+
+    :param p1: Coefficients, shape (N, n1).
+    :type p1: np.ndarray
+    :param p2: Coefficients, shape (N, n2).
+    :type p2: np.ndarray
+    :return: Coefficients of the products, shape (N, n1 + n2 - 1).
+    :rtype: np.ndarray
+    """
+    product = np.zeros((p1.shape[0], p1.shape[1] + p2.shape[1] - 1))
+    for i in range(p1.shape[1]):
+        product[:, i:i + p2.shape[1]] += p1[:, i:i + 1] * p2
+    return product
+
+
+def quartic_roots(coefficients: np.ndarray) -> np.ndarray:
+    """Find roots of a batch of quartic polynomials as eigenvalues of their
+    companion matrices.
+
+    :param coefficients: Coefficients in increasing order, shape (N, 5).
+    :type coefficients: np.ndarray
+    :return: Complex roots, shape (N, 4). NaN for degenerate polynomials.
+    :rtype: np.ndarray
+    """
+    leading = coefficients[:, 4:]
+    scale = np.max(np.abs(coefficients), axis=1, keepdims=True)
+    degenerate = ~(np.abs(leading) > 1e-12 * scale)[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        monic = coefficients[:, :4] / leading
+    monic[degenerate] = 0
+    companion = np.zeros((len(coefficients), 4, 4))
+    companion[:, 1:, :3] = np.eye(3)
+    companion[:, :, 3] = -monic
+    roots = np.linalg.eigvals(companion)
+    roots[degenerate] = np.nan
+    return roots
+
+
+def conic_intersections(
+    conic1: np.ndarray, conic2: np.ndarray, imag_tol: float = 1e-6
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find up to four real intersections of two conics. y is eliminated with the
+    resultant of both conics seen as quadratics in y, which leaves a quartic in x.
+
+    :param conic1: Coefficients (x**2, xy, y**2, x, y, 1) of the first conic, shape (N, 6).
+    :type conic1: np.ndarray
+    :param conic2: Coefficients of the second conic, shape (N, 6).
+    :type conic2: np.ndarray
+    :param imag_tol: Relative imaginary part below which a root is real, defaults to 1e-6.
+    :type imag_tol: float, optional
+    :return: x and y of the intersections and mask of real intersections, shape (N, 4).
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    # Quadratics in y: a y**2 + b(x) y + c(x), with polynomials in increasing order
+    n = len(conic1)
+
+    def quadratic_in_y(conic):
+        a = np.stack([conic[:, 2], np.zeros(n), np.zeros(n)], axis=1)
+        b = np.stack([conic[:, 4], conic[:, 1], np.zeros(n)], axis=1)
+        c = np.stack([conic[:, 5], conic[:, 3], conic[:, 0]], axis=1)
+        return a, b, c
+
+    a1, b1, c1 = quadratic_in_y(conic1)
+    a2, b2, c2 = quadratic_in_y(conic2)
+    ac = polymul(a1, c2) - polymul(a2, c1)
+    ab = polymul(a1, b2) - polymul(a2, b1)
+    bc = polymul(b1, c2) - polymul(b2, c1)
+    resultant = polymul(ac, ac) - polymul(ab, bc)
+
+    roots = quartic_roots(resultant[:, :5])
+    x = np.real(roots)
+    real = np.abs(np.imag(roots)) <= imag_tol * np.maximum(1, np.abs(x))
+
+    # Common root of both quadratics: (a2 b1 - a1 b2) y = a1 c2 - a2 c1
+    def evaluate(polynomial):
+        return sum(polynomial[:, i:i + 1] * x ** i for i in range(polynomial.shape[1]))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y = evaluate(ac) / -evaluate(ab)
+    real &= np.isfinite(x) & np.isfinite(y)
+    return x, y, real
+
+
+def solve_dilepton(
+    p_l_t: np.ndarray,
+    p_l_tbar: np.ndarray,
+    p_b_t: np.ndarray,
+    p_b_tbar: np.ndarray,
+    met_x: np.ndarray,
+    met_y: np.ndarray,
+    m_t: np.ndarray,
+    m_w: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Solve the neutrino momenta of dilepton ttbar decays in closed form. The W and
+    top mass constraints restrict each neutrino's (px, py) to a conic, and the
+    neutrinos' transverse momenta must add up to the missing ET, which leaves up to
+    four solutions per row.
+
+    :param p_l_t: Four-momentum of lepton assigned to top quark, shape (N, 4).
+    :type p_l_t: np.ndarray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark, shape (N, 4).
+    :type p_l_tbar: np.ndarray
+    :param p_b_t: Four-momentum of b-jet assigned to top quark, shape (N, 4).
+    :type p_b_t: np.ndarray
+    :param p_b_tbar: Four-momentum of b-jet assigned to anti-top quark, shape (N, 4).
+    :type p_b_tbar: np.ndarray
+    :param met_x: Missing ET in x direction, shape (N,).
+    :type met_x: np.ndarray
+    :param met_y: Missing ET in y direction, shape (N,).
+    :type met_y: np.ndarray
+    :param m_t: Top's mass, shape (N,).
+    :type m_t: np.ndarray
+    :param m_w: W's mass.
+    :type m_w: float
+    :return: Neutrino four-momenta assigned to top and anti-top quarks, shape
+             (N, 4, 4), and mask of physical solutions, shape (N, 4).
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    energy_t, pz_t = neutrino_linear_terms(p_l_t, p_b_t, m_t, m_w)
+    energy_tbar, pz_tbar = neutrino_linear_terms(p_l_tbar, p_b_tbar, m_t, m_w)
+    conic_t = neutrino_conic(energy_t, pz_t)
+    conic_tbar = reflect_conic(neutrino_conic(energy_tbar, pz_tbar), met_x, met_y)
+    px, py, valid = conic_intersections(conic_t, conic_tbar)
+
+    def four_momenta(energy, pz, px, py):
+        values = [pz[:, 0:1] + pz[:, 1:2] * px + pz[:, 2:3] * py]
+        values.append(energy[:, 0:1] + energy[:, 1:2] * px + energy[:, 2:3] * py)
+        return np.stack([px, py] + values, axis=2)
+
+    with np.errstate(invalid="ignore"):
+        p_nu_t = four_momenta(energy_t, pz_t, px, py)
+        p_nu_tbar = four_momenta(
+            energy_tbar, pz_tbar, met_x[:, None] - px, met_y[:, None] - py
+        )
+    # Only positive energies are physical
+    valid &= (p_nu_t[..., 3] > 0) & (p_nu_tbar[..., 3] > 0)
+    return p_nu_t, p_nu_tbar, valid
@@ -3,16 +3,16 @@ import sys
 import uproot
 import numpy as np
 
-from typing import List, Tuple
+from typing import List
+from itertools import permutations
 
 sys.path.append("..")
-from processing import event_selection
+from processing import event_selection, kinematics
+from processing.branch_cache import BranchCache  # noqa: E402
 
 
 M_T = 172.5
 M_W = 80.4
-M_ELECTRON = 0.000510998902
-M_MUON = 0.105658389
 SIGMA_X = 10.0
 SIGMA_Y = 10.0
 
@@ -33,51 +33,6 @@ def neutrino_four_momentum(px: float, py: float, eta: float) -> np.ndarray:
     return np.array([px, py, pz, E])
 
 
-def ttbar_leptons_kinematics(
-    event_ls_pt: List[float],
-    event_ls_phi: List[float],
-    event_ls_eta: List[float],
-    event_ls_charge: List[float],
-    m_ls: List[float],
-) -> Tuple[Tuple[float], Tuple[float], float, float]:
-    """Assign leptons to top and anti-top quarks using leptons' charge.
-
-    :param event_ls_pt: PTs for leptons in the event.
-    :type event_ls_pt: List[float]
-    :param event_ls_phi: Phi for leptons in the event.
-    :type event_ls_phi: List[float]
-    :param event_ls_eta: Eta for leptons in the event.
-    :type event_ls_eta: List[float]
-    :param event_ls_charge: Charges for leptons in the event.
-    :type event_ls_charge: List[float]
-    :param m_ls: Masses for leptons in the event.
-    :type m_ls: List[float]
-    :return: Leptons' momenta and masses assigned to top and anti-top quarks.
-    :rtype: Tuple[Tuple[float], Tuple[float], float, float]
-    """
-    if event_ls_charge[0] == 1:
-        l_idx_t = 0
-        l_idx_tbar = 1
-    else:
-        l_idx_t = 1
-        l_idx_tbar = 0
-    pt_l_t = event_ls_pt[l_idx_t]
-    phi_l_t = event_ls_phi[l_idx_t]
-    eta_l_t = event_ls_eta[l_idx_t]
-    m_l_t = m_ls[l_idx_t]
-    p_l_t = four_momentum(pt=pt_l_t, phi=phi_l_t, eta=eta_l_t, mass=m_l_t)
-
-    pt_l_tbar = event_ls_pt[l_idx_tbar]
-    phi_l_tbar = event_ls_phi[l_idx_tbar]
-    eta_l_tbar = event_ls_eta[l_idx_tbar]
-    m_l_tbar = m_ls[l_idx_tbar]
-    p_l_tbar = four_momentum(
-        pt=pt_l_tbar, phi=phi_l_tbar, eta=eta_l_tbar, mass=m_l_tbar
-    )
-
-    return p_l_t, p_l_tbar, m_l_t, m_l_tbar
-
-
 def solve_quadratic_equation(a: float, b: float, c: float) -> List[float]:
     a_c = complex(a)
     b_c = complex(b)
@@ -130,92 +85,6 @@ def solve_p_nu(eta, p_l, p_b, m_t, m_b, m_w=M_W):
     return px1, px2, py1, py2
 
 
-def lepton_kinematics(
-    electron_pt: np.ndarray,
-    electron_phi: np.ndarray,
-    electron_eta: np.ndarray,
-    electron_charge: np.ndarray,
-    muon_pt: np.ndarray,
-    muon_phi: np.ndarray,
-    muon_eta: np.ndarray,
-    muon_charge: np.ndarray,
-) -> Tuple[Tuple[float], Tuple[float], float, float]:
-    """Select events that have two leptons (e + e, e + mu, or mu + mu). Assign
-    each lepton to the parent top quark.
-
-    :param electron_pt: PT of electrons in event.
-    :type electron_pt: np.ndarray
-    :param electron_phi: Phi of electrons in event.
-    :type electron_phi: np.ndarray
-    :param electron_eta: Eta of electrons in event.
-    :type electron_eta: np.ndarray
-    :param electron_charge: Charge of electrons in event.
-    :type electron_charge: np.ndarray
-    :param muon_pt: PT of muons in event.
-    :type muon_pt: np.ndarray
-    :param muon_phi: Phi of muons in event.
-    :type muon_phi: np.ndarray
-    :param muon_eta: Eta of muons in event.
-    :type muon_eta: np.ndarray
-    :param muon_charge: Charge of muons in event.
-    :type muon_charge: np.ndarray
-    :return: Leptons' momenta and masses assigned to top and anti-top quarks.
-    :rtype: Tuple[Tuple[float], Tuple[float], float, float]
-    """
-    if len(electron_pt) + len(muon_pt) < 2:
-        return None, None, None, None
-    n_electrons = len(electron_pt)
-    n_muons = len(muon_pt)
-    if n_electrons == 2:
-        if np.sum(electron_charge) != 0:
-            return None, None, None, None
-
-        m_ls = [M_ELECTRON] * 2
-        p_l_t, p_l_tbar, m_l_t, m_l_tbar = ttbar_leptons_kinematics(
-            event_ls_pt=electron_pt,
-            event_ls_phi=electron_phi,
-            event_ls_eta=electron_eta,
-            event_ls_charge=electron_charge,
-            m_ls=m_ls,
-        )
-        return p_l_t, p_l_tbar, m_l_t, m_l_tbar
-
-    elif n_muons == 2:
-        if np.sum(muon_charge) != 0:
-            return None, None, None, None
-
-        m_ls = [M_MUON] * 2
-        p_l_t, p_l_tbar, m_l_t, m_l_tbar = ttbar_leptons_kinematics(
-            event_ls_pt=muon_pt,
-            event_ls_phi=muon_phi,
-            event_ls_eta=muon_eta,
-            event_ls_charge=muon_charge,
-            m_ls=m_ls,
-        )
-        return p_l_t, p_l_tbar, m_l_t, m_l_tbar
-
-    elif (n_electrons == 1) and (n_muons == 1):
-        if (electron_charge[0] + muon_charge[0]) != 0:
-            return None, None, None, None
-
-        m_ls = [M_ELECTRON, M_MUON]
-        event_ls_pt = [electron_pt[0], muon_pt[0]]
-        event_ls_phi = [electron_phi[0], muon_phi[0]]
-        event_ls_eta = [electron_eta[0], muon_eta[0]]
-        event_ls_charge = [electron_charge[0], muon_charge[0]]
-        p_l_t, p_l_tbar, m_l_t, m_l_tbar = ttbar_leptons_kinematics(
-            event_ls_pt=event_ls_pt,
-            event_ls_phi=event_ls_phi,
-            event_ls_eta=event_ls_eta,
-            event_ls_charge=event_ls_charge,
-            m_ls=m_ls,
-        )
-        return p_l_t, p_l_tbar, m_l_t, m_l_tbar
-
-    else:
-        return None, None, None, None
-
-
 def neutrino_weight(
     total_px: float, total_py: float, met_ex: float, met_ey: float
 ) -> float:
@@ -231,43 +100,36 @@ def reconstruct_event(
     bjets_pt,
     bjets_phi,
     bjets_eta,
-    electron_pt,
-    electron_phi,
-    electron_eta,
-    electron_charge,
-    muon_pt,
-    muon_phi,
-    muon_eta,
-    muon_charge,
+    p_l_t,
+    p_l_tbar,
     met,
     met_phi,
     idx,
     rng,
 ):
-
-    p_l_t, p_l_tbar, m_l_t, m_l_tbar = lepton_kinematics(
-        electron_pt=electron_pt,
-        electron_phi=electron_phi,
-        electron_eta=electron_eta,
-        electron_charge=electron_charge,
-        muon_pt=muon_pt,
-        muon_phi=muon_phi,
-        muon_eta=muon_eta,
-        muon_charge=muon_charge,
-    )
-    if p_l_t is None:
-        return None
+    """Reconstruct an event looping over every neutrino eta, top mass, smear, b-jet
+    permutation and solution. It's a slow reference for the engines in ttbar_dilepton.py
+    and draws the same smears from rng. Leptons come already assigned to the top and
+    anti-top quarks (see kinematics.dilepton_kinematics).
+
+    :return: Particles of the solution with the highest weight, idx and weight (see
+             ttbar_dilepton.RECO_NAMES), whatever the weight is. Return None if the
+             event has less than two b-jets or no real solution.
+    """
 
     if len(bjets_mass) < 2:
         return None
 
     smeared_bjets_pt = rng.normal(bjets_pt, bjets_pt * 0.14, (5, len(bjets_pt)))
+    # MET branches are float32, the solver works in float64
+    met = np.asarray(met, dtype=np.float64)
+    met_phi = np.asarray(met_phi, dtype=np.float64)
     met_x = (met * np.cos(met_phi))[0]
     met_y = (met * np.sin(met_phi))[0]
 
     best_weight = -1
-    best_totalx = None
-    best_totaly = None
+    best_b_t = None
+    best_b_tbar = None
     nu_t = None
     nu_tbar = None
 
@@ -275,7 +137,7 @@ def reconstruct_event(
         for nu_t_eta in np.linspace(-5, 5, 51):
             for m_t_val in np.linspace(171, 174, 7):
                 for smeared_pt in smeared_bjets_pt:
-                    for bjet_t_idx, bjet_tbar_idx in [(0, 1), (1, 0)]:
+                    for bjet_t_idx, bjet_tbar_idx in permutations(range(len(bjets_mass)), 2):
                         p_b_t = four_momentum(
                             pt=smeared_pt[bjet_t_idx],
                             phi=bjets_phi[bjet_t_idx],
@@ -327,8 +189,8 @@ def reconstruct_event(
                                 weight = np.real(weight)
                                 if weight > best_weight:
                                     best_weight = weight
-                                    best_totalx = np.real(total_px)
-                                    best_totaly = np.real(total_py)
+                                    best_b_t = p_b_t
+                                    best_b_tbar = p_b_tbar
                                     nu_t = neutrino_four_momentum(
                                         np.real(px_t), np.real(py_t), nu_t_eta
                                     )
@@ -336,14 +198,20 @@ def reconstruct_event(
                                         np.real(px_tbar), np.real(py_tbar), nu_tbar_eta
                                     )
 
-    print("-----------", idx)
-    print("Best weight: ", best_weight)
-    print("metx: ", met_x, "total_px: ", best_totalx)
-    print("mety: ", met_y, "total_py: ", best_totaly)
-    print("nu_t: ", nu_t)
-    print("nu_tbar: ", nu_tbar)
-    print("-----------\n")
-    return None
+    if nu_t is None:
+        return None
+    return (
+        best_b_t + p_l_t + nu_t,
+        p_l_t,
+        best_b_t,
+        nu_t,
+        best_b_tbar + p_l_tbar + nu_tbar,
+        p_l_tbar,
+        best_b_tbar,
+        nu_tbar,
+        np.array([idx]),
+        np.array([best_weight]),
+    )
 
 
 if __name__ == "__main__":
@@ -352,7 +220,7 @@ if __name__ == "__main__":
     n_batches = 10
 
     print("Loading events...", end="\r")
-    sm_events = uproot.open(sm_path)["Delphes"]
+    sm_events = BranchCache(uproot.open(sm_path)["Delphes"])
     print("Loading events...Done")
 
     print("Applying selection criteria...", end="\r")
@@ -362,7 +230,7 @@ if __name__ == "__main__":
     jets_mask = event_selection.select_jet(sm_events)
 
     # Get mask for b-jets
-    bjets_mask = sm_events["Jet.BTag"].array()[jets_mask].astype(bool)
+    bjets_mask = event_selection.select_bjet(sm_events["Jet.BTag"].array()[jets_mask])
 
     # Select b-jets that pass selection criteria from Jet TTree
     bjets_mass = sm_events["Jet.Mass"].array()[jets_mask][bjets_mask]
@@ -385,7 +253,22 @@ if __name__ == "__main__":
     # MET for all events
     met = sm_events["MissingET.MET"].array()
     met_phi = sm_events["MissingET.Phi"].array()
+
+    # Pair the leptons of all the events at once
+    leptons = kinematics.dilepton_kinematics(
+        {
+            "electron_pt": electron_pt,
+            "electron_phi": electron_phi,
+            "electron_eta": electron_eta,
+            "electron_charge": electron_charge,
+            "muon_pt": muon_pt,
+            "muon_phi": muon_phi,
+            "muon_eta": muon_eta,
+            "muon_charge": muon_charge,
+        }
+    )
     print("Applying selection criteria...Done")
+    print(f"Branch cache: {sm_events.stats()}")
 
     reco_names = [
         "p_top",
@@ -410,20 +293,15 @@ if __name__ == "__main__":
                 bjets_pt=bjets_pt[idx],
                 bjets_phi=bjets_phi[idx],
                 bjets_eta=bjets_eta[idx],
-                electron_pt=electron_pt[idx],
-                electron_phi=electron_phi[idx],
-                electron_eta=electron_eta[idx],
-                electron_charge=electron_charge[idx],
-                muon_pt=muon_pt[idx],
-                muon_phi=muon_phi[idx],
-                muon_eta=muon_eta[idx],
-                muon_charge=muon_charge[idx],
+                p_l_t=leptons["p_l_t"][idx],
+                p_l_tbar=leptons["p_l_tbar"][idx],
                 met=met[idx],
                 met_phi=met_phi[idx],
                 idx=idx,
                 rng=rng,
             )
             for idx in range(init_idx, end_idx)
+            if leptons["valid"][idx]
         ]
 
         recos = {name: [] for name in reco_names}
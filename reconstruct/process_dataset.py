@@ -0,0 +1,256 @@
+import os
+import sys
+import glob
+import json
+import uproot
+import numpy as np
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from typing import Dict, List, Tuple
+from tqdm import tqdm
+
+sys.path.append("..")
+from processing import event_selection, profiling, reco_store  # noqa: E402
+from processing.branch_cache import BranchCache  # noqa: E402
+from ttbar_dilepton import ENGINES, RECO_NAMES, grid_settings, reconstruct_batch  # noqa: E402
+
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    """Expand glob patterns into a sorted list of unique files.
+
+    :param patterns: Paths or glob patterns for Delphes ROOT files.
+    :type patterns: List[str]
+    :return: Paths to ROOT files.
+    :rtype: List[str]
+    """
+    paths = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+        if not matches:
+            raise FileNotFoundError(f"No files match {pattern}")
+        paths.update(matches)
+    return sorted(paths)
+
+
+def create_tasks(
+    paths: List[str], chunk_size: int, tree_name: str = "Delphes"
+) -> List[Tuple[int, str, int, int]]:
+    """Split files in entry ranges that are processed independently.
+
+    :param paths: Paths to ROOT files.
+    :type paths: List[str]
+    :param chunk_size: Maximum number of entries per task. If None, one task per file.
+    :type chunk_size: int
+    :param tree_name: Name of the TTree with the events, defaults to "Delphes".
+    :type tree_name: str, optional
+    :return: Source index, path, first entry and end entry of each task.
+    :rtype: List[Tuple[int, str, int, int]]
+    """
+    tasks = []
+    for source_idx, path in enumerate(paths):
+        n_entries = len(uproot.open(path)[tree_name])
+        step = n_entries if chunk_size is None else chunk_size
+        for entrystart in range(0, n_entries, max(step, 1)):
+            entrystop = min(entrystart + step, n_entries)
+            tasks.append((source_idx, path, entrystart, entrystop))
+    return tasks
+
+
+def reconstruct_task(
+    task: Tuple[int, str, int, int],
+    random_seed: int,
+    tree_name: str = "Delphes",
+    engine: str = "event",
+    engine_options: Dict = None,
+    preselect: bool = True,
+) -> Dict[str, np.ndarray]:
+    """Select and reconstruct the events of one task. Every event has its own random
+    stream, so results don't depend on the number of workers or the chunk size.
+
+    :param task: Source index, path, first entry and end entry.
+    :type task: Tuple[int, str, int, int]
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param tree_name: Name of the TTree with the events, defaults to "Delphes".
+    :type tree_name: str, optional
+    :param engine: Reconstruction engine (see reconstruct_batch), defaults to 'event'.
+    :type engine: str, optional
+    :param engine_options: Keyword arguments for the engine (see reconstruct_batch),
+                           defaults to None.
+    :type engine_options: Dict, optional
+    :param preselect: Only reconstruct events that pass preselect_events, defaults to True.
+    :type preselect: bool, optional
+    :return: Reconstructed quantities with the source index of each event.
+    :rtype: Dict[str, np.ndarray]
+    """
+    source_idx, path, entrystart, entrystop = task
+    # Branches are read from the file (the "read" stage) when the selection needs them
+    with profiling.stage("selection"):
+        events = BranchCache(
+            uproot.open(path)[tree_name], entrystart=entrystart, entrystop=entrystop
+        )
+        selected = event_selection.select_objects(events)
+    reco_arrays = reconstruct_batch(
+        selected,
+        0,
+        len(events),
+        random_seed,
+        idx_offset=entrystart,
+        source_idx=source_idx,
+        progress=False,
+        engine=engine,
+        engine_options=engine_options,
+        preselect=preselect,
+    )
+    reco_arrays["source"] = np.full((len(reco_arrays["idx"]), 1), source_idx)
+    return reco_arrays
+
+
+def merge_outputs(outputs: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """Concatenate task outputs and sort them by source and event index.
+
+    :param outputs: Reconstructed quantities of each task.
+    :type outputs: List[Dict[str, np.ndarray]]
+    :return: Merged reconstructed quantities.
+    :rtype: Dict[str, np.ndarray]
+    """
+    names = RECO_NAMES + ["source"]
+    merged = {name: np.concatenate([output[name] for output in outputs]) for name in names}
+    order = np.lexsort((merged["idx"][:, 0], merged["source"][:, 0]))
+    return {name: array[order] for name, array in merged.items()}
+
+
+def save_outputs(
+    merged: Dict[str, np.ndarray], paths: List[str], output_dir: str, metadata: Dict = None
+):
+    """Save merged outputs as a store (see processing.reco_store) with the list of
+    sources they come from.
+
+    :param merged: Merged reconstructed quantities.
+    :type merged: Dict[str, np.ndarray]
+    :param paths: Paths to ROOT files in the order of their source index.
+    :type paths: List[str]
+    :param output_dir: Output directory.
+    :type output_dir: str
+    :param metadata: Settings of the run saved in the header, defaults to None.
+    :type metadata: Dict, optional
+    """
+    metadata = {"sources": [os.path.abspath(path) for path in paths], **(metadata or {})}
+    reco_store.write_store(output_dir, merged, metadata)
+
+
+def process_dataset(
+    paths: List[str],
+    output_dir: str,
+    random_seed: int,
+    n_workers: int,
+    chunk_size: int = None,
+    tree_name: str = "Delphes",
+    engine: str = "event",
+    engine_options: Dict = None,
+    preselect: bool = True,
+    profile: bool = False,
+) -> Dict[str, np.ndarray]:
+    """Reconstruct events from several ROOT files in parallel and merge the outputs.
+
+    :param paths: Paths to ROOT files.
+    :type paths: List[str]
+    :param output_dir: Output directory.
+    :type output_dir: str
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param n_workers: Number of worker processes.
+    :type n_workers: int
+    :param chunk_size: Maximum number of entries per task, defaults to None (whole file).
+    :type chunk_size: int, optional
+    :param tree_name: Name of the TTree with the events, defaults to "Delphes".
+    :type tree_name: str, optional
+    :param engine: Reconstruction engine (see reconstruct_batch), defaults to 'event'.
+    :type engine: str, optional
+    :param engine_options: Keyword arguments for the engine (see reconstruct_batch),
+                           defaults to None.
+    :type engine_options: Dict, optional
+    :param preselect: Only reconstruct events that pass preselect_events, defaults to True.
+    :type preselect: bool, optional
+    :param profile: Save time per stage, throughput and slowest events of all workers
+                    in output_dir/profile.json (see processing.profiling), defaults to False.
+    :type profile: bool, optional
+    :return: Merged reconstructed quantities.
+    :rtype: Dict[str, np.ndarray]
+    """
+    profiler = profiling.enable() if profile else None
+    tasks = create_tasks(paths, chunk_size=chunk_size, tree_name=tree_name)
+    run_task = reconstruct_task
+    if profiler is not None:
+        run_task = partial(profiling.run_profiled, reconstruct_task)
+    # JAX is multithreaded, so workers are spawned instead of forked
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=get_context("spawn")) as pool:
+        futures = [
+            pool.submit(
+                run_task, task, random_seed, tree_name, engine, engine_options, preselect
+            )
+            for task in tasks
+        ]
+        outputs = [future.result() for future in tqdm(futures)]
+    if profiler is not None:
+        for _, worker_profiler in outputs:
+            profiler.merge(worker_profiler)
+        outputs = [output for output, _ in outputs]
+    merged = merge_outputs(outputs)
+    metadata = {
+        "random_seed": random_seed,
+        "chunk_size": chunk_size,
+        "engine": engine,
+        "engine_options": engine_options or {},
+        "preselect": preselect,
+        "grid": grid_settings(),
+    }
+    with profiling.stage("write"):
+        save_outputs(merged, paths, output_dir, metadata=metadata)
+    if profiler is not None:
+        profiling.save_report(
+            os.path.join(output_dir, "profile.json"), n_workers=n_workers, **metadata
+        )
+        profiling.disable()
+    return merged
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="Delphes ROOT files or glob patterns")
+    parser.add_argument("--output_dir", required=True)
+    parser.add_argument("--random_seed", type=int, default=0)
+    parser.add_argument("--n_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk_size", type=int, default=None)
+    parser.add_argument("--tree_name", default="Delphes")
+    parser.add_argument("--engine", choices=ENGINES, default="event")
+    parser.add_argument(
+        "--engine_options",
+        type=json.loads,
+        default=None,
+        help='Keyword arguments for the engine as JSON, e.g. \'{"dtype": "float64"}\'',
+    )
+    parser.add_argument(
+        "--no_preselect",
+        dest="preselect",
+        action="store_false",
+        help="Reconstruct events that fail the preselection too",
+    )
+    parser.add_argument("--profile", action="store_true", help="Save profile.json report")
+    args = parser.parse_args()
+
+    process_dataset(
+        paths=expand_paths(args.paths),
+        output_dir=args.output_dir,
+        random_seed=args.random_seed,
+        n_workers=args.n_workers,
+        chunk_size=args.chunk_size,
+        tree_name=args.tree_name,
+        engine=args.engine,
+        engine_options=args.engine_options,
+        preselect=args.preselect,
+        profile=args.profile,
+    )
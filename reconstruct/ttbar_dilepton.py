@@ -4,20 +4,85 @@ import uproot
 import numpy as np
 import jax.numpy as jnp
 
-from jax import jit
-from typing import Union, Tuple
+from jax import jit, lax
+from jax.experimental import enable_x64
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, Iterator, List, Union, Tuple
 from itertools import permutations
 from tqdm import tqdm
+from awkward.array.jagged import JaggedArray
 
 sys.path.append("..")
-from processing import event_selection, kinematics  # noqa: E402
+from processing import (  # noqa: E402
+    event_selection,
+    kinematics,
+    profiling,
+    reco_store,
+    selection_cache,
+)
+from processing.branch_cache import iterate_chunks  # noqa: E402
+import analytic_solver  # noqa: E402
 
 
 M_W = 80.4
-M_ELECTRON = 0.000510998902
-M_MUON = 0.105658389
 SIGMA_X = 10.0
 SIGMA_Y = 10.0
+RECO_NAMES = [
+    "p_top",
+    "p_l_t",
+    "p_b_t",
+    "p_nu_t",
+    "p_tbar",
+    "p_l_tbar",
+    "p_b_tbar",
+    "p_nu_tbar",
+    "idx",
+    "weight",
+]
+RECO_WIDTHS = {name: 1 if name in ("idx", "weight") else 4 for name in RECO_NAMES}
+# Selected objects used by the reconstruction besides the leptons (see event_objects)
+EVENT_OBJECTS = ("bjets_mass", "bjets_pt", "bjets_phi", "bjets_eta", "met", "met_phi")
+# Reconstruction engines that can be selected in reconstruct_batch
+ENGINES = ("event", "bucketed", "scan", "adaptive", "analytic", "compiled")
+# Neutrino weighting search: eta pairs for both neutrinos, top masses and b-jet pt smears
+NU_ETA_RANGE = np.linspace(-5, 5, 51)
+NU_ETA_GRID = np.array(np.meshgrid(NU_ETA_RANGE, NU_ETA_RANGE)).T.reshape(-1, 2)
+M_T_SEARCH = np.linspace(171, 174, 7)
+N_SMEARS = 5
+# Relative resolution of the b-jets' pt used to smear them
+BJET_PT_RESOLUTION = 0.14
+# Events whose best solution has a lower weight aren't reconstructed
+MIN_WEIGHT = 0.4
+# Smears below this many standard deviations are taken into account by the m(lb) veto of
+# preselect_events
+PRESELECTION_SIGMAS = 5
+# Padded number of b-jet permutations, so that the batched solver compiles once per bucket
+PERM_BUCKETS = (2, 6, 12, 20, 30)
+# Number of (top mass, eta) points evaluated per step by the 'scan' engine
+SCAN_BLOCK_SIZE = 1024
+# Coarse-to-fine eta search of the 'adaptive' engine: points per axis of the coarse grid,
+# number of refinements, best points refined at each level, half-width of the refined
+# grids in steps, and step reduction at each level
+ADAPTIVE_SEARCH = {"n_coarse": 11, "depth": 3, "n_seeds": 3, "radius": 2, "shrink": 2}
+
+
+def grid_settings() -> Dict:
+    """Get settings of the neutrino weighting search, saved with the outputs.
+
+    :return: Settings by name.
+    :rtype: Dict
+    """
+    return {
+        "nu_eta_range": [float(NU_ETA_RANGE[0]), float(NU_ETA_RANGE[-1]), len(NU_ETA_RANGE)],
+        "m_t_search": M_T_SEARCH.tolist(),
+        "n_smears": N_SMEARS,
+        "bjet_pt_resolution": BJET_PT_RESOLUTION,
+        "sigma_x": SIGMA_X,
+        "sigma_y": SIGMA_Y,
+        "m_w": M_W,
+    }
 
 
 def ttbar_bjets_kinematics(
@@ -63,51 +128,6 @@ def ttbar_bjets_kinematics(
     return p_b_t, p_b_tbar, mass_combinations[:, 0:1], mass_combinations[:, 1:]
 
 
-def ttbar_leptons_kinematics(
-    event_ls_pt: np.ndarray,
-    event_ls_phi: np.ndarray,
-    event_ls_eta: np.ndarray,
-    event_ls_charge: np.ndarray,
-    m_ls: np.ndarray,
-) -> Tuple[np.ndarray, np.ndarray, float, float]:
-    """Assign lepton to parent quark using leptons' charge.
-
-    :param event_ls_pt: PT of leptons in the event.
-    :type event_ls_pt: np.ndarray
-    :param event_ls_phi: Phi of leptons in the event.
-    :type event_ls_phi: np.ndarray
-    :param event_ls_eta: Eta of leptons in the event.
-    :type event_ls_eta: np.ndarray
-    :param event_ls_charge: Charge of lepton in the event.
-    :type event_ls_charge: np.ndarray
-    :param m_ls: Mass of leptons in the event.
-    :type m_ls: np.ndarray
-    :return: Leptons' four-momenta and masses assigned to parent quark.
-    :rtype: Tuple[Tuple[float], Tuple[float], float, float]
-    """
-    if event_ls_charge[0] == 1:
-        l_idx_t = 0
-        l_idx_tbar = 1
-    else:
-        l_idx_t = 1
-        l_idx_tbar = 0
-    pt_l_t = np.array(event_ls_pt[l_idx_t]).reshape(-1, 1)
-    phi_l_t = np.array(event_ls_phi[l_idx_t]).reshape(-1, 1)
-    eta_l_t = np.array(event_ls_eta[l_idx_t]).reshape(-1, 1)
-    m_l_t = np.array(m_ls[l_idx_t]).reshape(-1, 1)
-    p_l_t = kinematics.four_momentum(pt=pt_l_t, phi=phi_l_t, eta=eta_l_t, mass=m_l_t)
-
-    pt_l_tbar = np.array(event_ls_pt[l_idx_tbar]).reshape(-1, 1)
-    phi_l_tbar = np.array(event_ls_phi[l_idx_tbar]).reshape(-1, 1)
-    eta_l_tbar = np.array(event_ls_eta[l_idx_tbar]).reshape(-1, 1)
-    m_l_tbar = np.array(m_ls[l_idx_tbar]).reshape(-1, 1)
-    p_l_tbar = kinematics.four_momentum(
-        pt=pt_l_tbar, phi=phi_l_tbar, eta=eta_l_tbar, mass=m_l_tbar
-    )
-
-    return p_l_t, p_l_tbar, m_l_t, m_l_tbar
-
-
 def scalar_product(p1: jnp.DeviceArray, p2: jnp.DeviceArray) -> jnp.DeviceArray:
     """Calculate four-vector scalar product with (-,-,-,+) metric.
 
@@ -135,9 +155,11 @@ def solve_quadratic_equation(
     :return: Solutions for quadratic equation.
     :rtype: jnp.DeviceArray
     """
-    a_c = a.astype(jnp.complex64)
-    b_c = b.astype(jnp.complex64)
-    c_c = c.astype(jnp.complex64)
+    # complex64, or complex128 for float64 coefficients
+    complex_dtype = jnp.result_type(a.dtype, jnp.complex64)
+    a_c = a.astype(complex_dtype)
+    b_c = b.astype(complex_dtype)
+    c_c = c.astype(complex_dtype)
 
     det = jnp.sqrt(b_c ** 2 - (4 * a_c * c_c))
     sol1 = ((-b_c) + det) / (2 * a_c)
@@ -145,15 +167,39 @@ def solve_quadratic_equation(
     return jnp.concatenate([sol1, sol2], axis=1)
 
 
-def solve_p_nu(
+def solve_quadratic_equation_real(
+    a: jnp.DeviceArray, b: jnp.DeviceArray, c: jnp.DeviceArray
+) -> Tuple[jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray]:
+    """Solve quadratic equation in real arithmetic. Solutions are only meaningful
+    where the discriminant isn't negative.
+
+    :param a: Coefficient of x**2.
+    :type a: jnp.DeviceArray
+    :param b: Coefficient of x**1.
+    :type b: jnp.DeviceArray
+    :param c: Coeffiecient of x**0.
+    :type c: jnp.DeviceArray
+    :return: Both solutions and mask of real solutions.
+    :rtype: Tuple[jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray]
+    """
+    discriminant = b ** 2 - (4 * a * c)
+    real = discriminant >= 0
+    det = jnp.sqrt(jnp.where(real, discriminant, 0))
+    sol1 = ((-b) + det) / (2 * a)
+    sol2 = ((-b) - det) / (2 * a)
+    return sol1, sol2, real
+
+
+def p_nu_coefficients(
     eta: jnp.DeviceArray,
     p_l: jnp.DeviceArray,
     p_b: jnp.DeviceArray,
     m_t: jnp.DeviceArray,
     m_b: jnp.DeviceArray,
     m_w=M_W,
-) -> Tuple[jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray]:
-    """Get possible solutions for neutrino's px and py.
+) -> Tuple[jnp.DeviceArray, ...]:
+    """Get coefficients of the neutrino's px = A py + B and of the quadratic equation
+    C py**2 + D py + F = 0 given by the W and top mass constraints.
 
     :param eta: Neutrino's eta.
     :type eta: jnp.DeviceArray
@@ -167,8 +213,8 @@ def solve_p_nu(
     :type m_b: jnp.DeviceArray
     :param m_w: W's mass value, defaults to M_W
     :type m_w: float, optional
-    :return: Solutions for neutrino's px and py.
-    :rtype: Tuple[jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray]
+    :return: Coefficients A, B, C, D and F.
+    :rtype: Tuple[jnp.DeviceArray, ...]
     """
     E_l_prime = (p_l[:, 3:] * jnp.cosh(eta)) - (p_l[:, 2:3] * jnp.sinh(eta))
     E_b_prime = (p_b[:, 3:] * jnp.cosh(eta)) - (p_b[:, 2:3] * jnp.sinh(eta))
@@ -186,7 +232,35 @@ def solve_p_nu(
     par2 = ((m_w ** 2) / 2 + p_l[:, 0:1] * B) / E_l_prime
     D = 2 * (A * B - par2 * par1)
     F = B ** 2 - par2 ** 2
+    return A, B, C, D, F
+
+
+def solve_p_nu(
+    eta: jnp.DeviceArray,
+    p_l: jnp.DeviceArray,
+    p_b: jnp.DeviceArray,
+    m_t: jnp.DeviceArray,
+    m_b: jnp.DeviceArray,
+    m_w=M_W,
+) -> Tuple[jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray]:
+    """Get possible solutions for neutrino's px and py.
 
+    :param eta: Neutrino's eta.
+    :type eta: jnp.DeviceArray
+    :param p_l: Lepton's four-momentum.
+    :type p_l: jnp.DeviceArray
+    :param p_b: b-jet's four-momentum.
+    :type p_b: jnp.DeviceArray
+    :param m_t: Top's mass value.
+    :type m_t: jnp.DeviceArray
+    :param m_b: Bottom's mass value.
+    :type m_b: jnp.DeviceArray
+    :param m_w: W's mass value, defaults to M_W
+    :type m_w: float, optional
+    :return: Solutions for neutrino's px and py.
+    :rtype: Tuple[jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray, jnp.DeviceArray]
+    """
+    A, B, C, D, F = p_nu_coefficients(eta=eta, p_l=p_l, p_b=p_b, m_t=m_t, m_b=m_b, m_w=m_w)
     sols = solve_quadratic_equation(a=C, b=D, c=F)
 
     py1 = sols[:, 0:1]
@@ -196,6 +270,38 @@ def solve_p_nu(
     return px1, px2, py1, py2
 
 
+def solve_p_nu_real(
+    eta: jnp.DeviceArray,
+    p_l: jnp.DeviceArray,
+    p_b: jnp.DeviceArray,
+    m_t: jnp.DeviceArray,
+    m_b: jnp.DeviceArray,
+    m_w=M_W,
+) -> Tuple[jnp.DeviceArray, ...]:
+    """Same as solve_p_nu in real arithmetic, in the precision of the inputs.
+
+    :param eta: Neutrino's eta.
+    :type eta: jnp.DeviceArray
+    :param p_l: Lepton's four-momentum.
+    :type p_l: jnp.DeviceArray
+    :param p_b: b-jet's four-momentum.
+    :type p_b: jnp.DeviceArray
+    :param m_t: Top's mass value.
+    :type m_t: jnp.DeviceArray
+    :param m_b: Bottom's mass value.
+    :type m_b: jnp.DeviceArray
+    :param m_w: W's mass value, defaults to M_W
+    :type m_w: float, optional
+    :return: Solutions for neutrino's px and py, and mask of real solutions.
+    :rtype: Tuple[jnp.DeviceArray, ...]
+    """
+    A, B, C, D, F = p_nu_coefficients(eta=eta, p_l=p_l, p_b=p_b, m_t=m_t, m_b=m_b, m_w=m_w)
+    py1, py2, real = solve_quadratic_equation_real(a=C, b=D, c=F)
+    px1 = A * py1 + B
+    px2 = A * py2 + B
+    return px1, px2, py1, py2, real
+
+
 def solution_weight(
     met_x: np.ndarray,
     met_y: np.ndarray,
@@ -222,6 +328,33 @@ def solution_weight(
     return weight_x * weight_y
 
 
+def device_solution_weight(
+    met_x: jnp.DeviceArray,
+    met_y: jnp.DeviceArray,
+    neutrino_px: jnp.DeviceArray,
+    neutrino_py: jnp.DeviceArray,
+) -> jnp.DeviceArray:
+    """Same as solution_weight for arrays that live on the device (e.g., inside jitted
+    functions).
+
+    :param met_x: Missing ET in x direction in event.
+    :type met_x: jnp.DeviceArray
+    :param met_y: Missing ET in y direction in event.
+    :type met_y: jnp.DeviceArray
+    :param neutrino_px: Total neutrino px in the event.
+    :type neutrino_px: jnp.DeviceArray
+    :param neutrino_py: Total neutrino py in the event.
+    :type neutrino_py: jnp.DeviceArray
+    :return: Solution's weight.
+    :rtype: jnp.DeviceArray
+    """
+    dx = met_x - neutrino_px
+    dy = met_y - neutrino_py
+    weight_x = jnp.exp(-(dx ** 2) / (2 * SIGMA_X ** 2))
+    weight_y = jnp.exp(-(dy ** 2) / (2 * SIGMA_Y ** 2))
+    return weight_x * weight_y
+
+
 @jit
 def get_neutrino_momentum(
     nu_eta_t: jnp.DeviceArray,
@@ -282,90 +415,295 @@ def get_neutrino_momentum(
     return nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py
 
 
-def lepton_kinematics(
-    electron_pt: np.ndarray,
-    electron_phi: np.ndarray,
-    electron_eta: np.ndarray,
-    electron_charge: np.ndarray,
-    muon_pt: np.ndarray,
-    muon_phi: np.ndarray,
-    muon_eta: np.ndarray,
-    muon_charge: np.ndarray,
-) -> Tuple[np.ndarray, np.ndarray, float, float]:
-    """Assign lepton four-momenta to top and anti-top quarks using combination
-    of muons and electrons in the event.
-
-    :param electron_pt: PT of electrons in the event.
-    :type electron_pt: np.ndarray
-    :param electron_phi: Phi of electrons in the event.
-    :type electron_phi: np.ndarray
-    :param electron_eta: Eta of electrons in the event.
-    :type electron_eta: np.ndarray
-    :param electron_charge: Charges of electrons in the event.
-    :type electron_charge: np.ndarray
-    :param muon_pt: PT of muons in the event.
-    :type muon_pt: np.ndarray
-    :param muon_phi: Phi of muons in the event.
-    :type muon_phi: np.ndarray
-    :param muon_eta: Eta of muons in the event.
-    :type muon_eta: np.ndarray
-    :param muon_charge: Charges of muons in the event.
-    :type muon_charge: np.ndarray
-    :return: Leptons' four-momenta and masses assigned to parent top and anti-top quarks.
-    :rtype: Tuple[np.ndarray, np.ndarray, float, float]
-    """
-    if len(electron_pt) + len(muon_pt) < 2:
-        return None, None, None, None
-    n_electrons = len(electron_pt)
-    n_muons = len(muon_pt)
-    if n_electrons == 2:
-        if np.sum(electron_charge) != 0:
-            return None, None, None, None
-
-        m_ls = [M_ELECTRON] * 2
-        p_l_t, p_l_tbar, m_l_t, m_l_tbar = ttbar_leptons_kinematics(
-            event_ls_pt=electron_pt,
-            event_ls_phi=electron_phi,
-            event_ls_eta=electron_eta,
-            event_ls_charge=electron_charge,
-            m_ls=m_ls,
-        )
-        return p_l_t, p_l_tbar, m_l_t, m_l_tbar
-
-    elif n_muons == 2:
-        if np.sum(muon_charge) != 0:
-            return None, None, None, None
-
-        m_ls = [M_MUON] * 2
-        p_l_t, p_l_tbar, m_l_t, m_l_tbar = ttbar_leptons_kinematics(
-            event_ls_pt=muon_pt,
-            event_ls_phi=muon_phi,
-            event_ls_eta=muon_eta,
-            event_ls_charge=muon_charge,
-            m_ls=m_ls,
-        )
-        return p_l_t, p_l_tbar, m_l_t, m_l_tbar
-
-    elif (n_electrons == 1) and (n_muons == 1):
-        if (electron_charge[0] + muon_charge[0]) != 0:
-            return None, None, None, None
-
-        m_ls = [M_ELECTRON, M_MUON]
-        event_ls_pt = [electron_pt[0], muon_pt[0]]
-        event_ls_phi = [electron_phi[0], muon_phi[0]]
-        event_ls_eta = [electron_eta[0], muon_eta[0]]
-        event_ls_charge = [electron_charge[0], muon_charge[0]]
-        p_l_t, p_l_tbar, m_l_t, m_l_tbar = ttbar_leptons_kinematics(
-            event_ls_pt=event_ls_pt,
-            event_ls_phi=event_ls_phi,
-            event_ls_eta=event_ls_eta,
-            event_ls_charge=event_ls_charge,
-            m_ls=m_ls,
-        )
-        return p_l_t, p_l_tbar, m_l_t, m_l_tbar
+@jit
+def get_neutrino_momentum_real(
+    nu_eta_t: jnp.DeviceArray,
+    p_l_t: jnp.DeviceArray,
+    p_b_t: jnp.DeviceArray,
+    m_b_t: jnp.DeviceArray,
+    nu_eta_tbar: jnp.DeviceArray,
+    p_l_tbar: jnp.DeviceArray,
+    p_b_tbar: jnp.DeviceArray,
+    m_b_tbar: jnp.DeviceArray,
+    m_t_val: jnp.DeviceArray,
+) -> Tuple[jnp.DeviceArray, ...]:
+    """Same as get_neutrino_momentum in real arithmetic (see solve_p_nu_real). The
+    precision is the one of the inputs.
 
-    else:
-        return None, None, None, None
+    :param nu_eta_t: Eta for neutrino assigned to top quark.
+    :type nu_eta_t: jnp.DeviceArray
+    :param p_l_t: Four-momentum of lepton assigned to top quark.
+    :type p_l_t: jnp.DeviceArray
+    :param p_b_t: Four-momentum of b-jet assigned to top quark.
+    :type p_b_t: jnp.DeviceArray
+    :param m_b_t: Mass of b-jet assigned to top quark.
+    :type m_b_t: jnp.DeviceArray
+    :param nu_eta_tbar: Eta for neutrino assigned to anti-top quark.
+    :type nu_eta_tbar: jnp.DeviceArray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark.
+    :type p_l_tbar: jnp.DeviceArray
+    :param p_b_tbar: Four-momentum of b-jet assigned to anti-top quark.
+    :type p_b_tbar: jnp.DeviceArray
+    :param m_b_tbar: Mass of b-jet assigned to anti-top quark.
+    :type m_b_tbar: jnp.DeviceArray
+    :param m_t_val: Top quark's mass.
+    :type m_t_val: jnp.DeviceArray
+    :return: Solutions for neutrino's px and py assigned to top and anti-top quarks,
+             and mask of combinations where both solutions are real.
+    :rtype: Tuple[jnp.DeviceArray, ...]
+    """
+    nu_t_px1, nu_t_px2, nu_t_py1, nu_t_py2, real_t = solve_p_nu_real(
+        eta=nu_eta_t, p_l=p_l_t, p_b=p_b_t, m_t=m_t_val, m_b=m_b_t
+    )
+    nu_tbar_px1, nu_tbar_px2, nu_tbar_py1, nu_tbar_py2, real_tbar = solve_p_nu_real(
+        eta=nu_eta_tbar, p_l=p_l_tbar, p_b=p_b_tbar, m_t=m_t_val, m_b=m_b_tbar
+    )
+
+    nu_t_px = jnp.concatenate([nu_t_px1, nu_t_px1, nu_t_px2, nu_t_px2], axis=0)
+    nu_t_py = jnp.concatenate([nu_t_py1, nu_t_py1, nu_t_py2, nu_t_py2], axis=0)
+    nu_tbar_px = jnp.concatenate(
+        [nu_tbar_px1, nu_tbar_px2, nu_tbar_px1, nu_tbar_px2], axis=0
+    )
+    nu_tbar_py = jnp.concatenate(
+        [nu_tbar_py1, nu_tbar_py2, nu_tbar_py1, nu_tbar_py2], axis=0
+    )
+    # Both solutions of an equation are real or complex together
+    real = jnp.tile(real_t & real_tbar, (4, 1))
+    return nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py, real
+
+
+def event_inputs(
+    bjets_mass: np.ndarray,
+    bjets_pt: np.ndarray,
+    bjets_phi: np.ndarray,
+    bjets_eta: np.ndarray,
+    p_l_t: np.ndarray,
+    p_l_tbar: np.ndarray,
+    met: np.ndarray,
+    met_phi: np.ndarray,
+    rng: np.random.Generator,
+) -> Union[Tuple[np.ndarray, ...], None]:
+    """Smear b-jets and build the b-jet permutations of an event. Random numbers are
+    only drawn for events that have two b-jets.
+
+    :param bjets_mass: Mass of b-jets in event.
+    :type bjets_mass: np.ndarray
+    :param bjets_pt: PT of b-jets in event.
+    :type bjets_pt: np.ndarray
+    :param bjets_phi: Phi of b-jets in event.
+    :type bjets_phi: np.ndarray
+    :param bjets_eta: Eta of b-jets in event.
+    :type bjets_eta: np.ndarray
+    :param p_l_t: Four-momentum of lepton assigned to top quark
+                  (see kinematics.dilepton_kinematics).
+    :type p_l_t: np.ndarray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark.
+    :type p_l_tbar: np.ndarray
+    :param met: MET in event.
+    :type met: np.ndarray
+    :param met_phi: Phi of MET in event.
+    :type met_phi: np.ndarray
+    :param rng: Numpy's random number generator.
+    :type rng: np.random.Generator
+    :return: Lepton four-momenta assigned to top and anti-top, b-jet four-momenta and
+             masses for every smear and permutation, and MET's x and y components.
+             Return None if the event has less than two b-jets.
+    :rtype: Union[Tuple[np.ndarray, ...], None]
+    """
+    if len(bjets_mass) < 2:
+        return None
+
+    bjets_combinations_idxs = np.array(list(permutations(range(len(bjets_mass)), 2)))
+    smeared_bjets_pt = rng.normal(
+        bjets_pt, bjets_pt * BJET_PT_RESOLUTION, (N_SMEARS, len(bjets_pt))
+    )
+    p_b_t, p_b_tbar, m_b_t, m_b_tbar = ttbar_bjets_kinematics(
+        smeared_bjets_pt=smeared_bjets_pt,
+        bjets_phi=bjets_phi,
+        bjets_eta=bjets_eta,
+        bjets_mass=bjets_mass,
+        bjets_combinations_idxs=bjets_combinations_idxs,
+    )
+
+    # MET branches are float32, the solver works in float64
+    met = np.asarray(met, dtype=np.float64)
+    met_phi = np.asarray(met_phi, dtype=np.float64)
+    met_x = (met * np.cos(met_phi))[0]
+    met_y = (met * np.sin(met_phi))[0]
+    return p_l_t, p_l_tbar, p_b_t, p_b_tbar, m_b_t, m_b_tbar, met_x, met_y
+
+
+def event_objects(
+    selected: Dict[str, JaggedArray], leptons: Dict[str, np.ndarray], idx: int
+) -> Union[Dict[str, np.ndarray], None]:
+    """Get the inputs of event_inputs (and reconstruct_event) for one event.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict[str, JaggedArray]
+    :param leptons: Lepton pairs of the same events (see kinematics.dilepton_kinematics).
+    :type leptons: Dict[str, np.ndarray]
+    :param idx: Event index.
+    :type idx: int
+    :return: B-jets, leptons and MET of the event by name. Return None if the event
+             doesn't have an opposite-charge lepton pair.
+    :rtype: Union[Dict[str, np.ndarray], None]
+    """
+    if not leptons["valid"][idx]:
+        return None
+    return {
+        **{name: selected[name][idx] for name in EVENT_OBJECTS},
+        "p_l_t": leptons["p_l_t"][idx],
+        "p_l_tbar": leptons["p_l_tbar"][idx],
+    }
+
+
+def best_solution(
+    p_b_t: np.ndarray,
+    p_l_t: np.ndarray,
+    nu_t_px: float,
+    nu_t_py: float,
+    nu_eta_t: float,
+    p_b_tbar: np.ndarray,
+    p_l_tbar: np.ndarray,
+    nu_tbar_px: float,
+    nu_tbar_py: float,
+    nu_eta_tbar: float,
+    idx: int,
+    weight: float,
+) -> Tuple[np.ndarray, ...]:
+    """Build the reconstructed particles of an event from its best solution.
+
+    :param p_b_t: Four-momentum of b-jet assigned to top quark.
+    :type p_b_t: np.ndarray
+    :param p_l_t: Four-momentum of lepton assigned to top quark.
+    :type p_l_t: np.ndarray
+    :param nu_t_px: px of neutrino assigned to top quark.
+    :type nu_t_px: float
+    :param nu_t_py: py of neutrino assigned to top quark.
+    :type nu_t_py: float
+    :param nu_eta_t: Eta of neutrino assigned to top quark.
+    :type nu_eta_t: float
+    :param p_b_tbar: Four-momentum of b-jet assigned to anti-top quark.
+    :type p_b_tbar: np.ndarray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark.
+    :type p_l_tbar: np.ndarray
+    :param nu_tbar_px: px of neutrino assigned to anti-top quark.
+    :type nu_tbar_px: float
+    :param nu_tbar_py: py of neutrino assigned to anti-top quark.
+    :type nu_tbar_py: float
+    :param nu_eta_tbar: Eta of neutrino assigned to anti-top quark.
+    :type nu_eta_tbar: float
+    :param idx: Event index.
+    :type idx: int
+    :param weight: Solution's weight.
+    :type weight: float
+    :return: Particles in the event with idx and reconstruction weight (see RECO_NAMES).
+    :rtype: Tuple[np.ndarray, ...]
+    """
+    p_nu_t = kinematics.neutrino_four_momentum(px=nu_t_px, py=nu_t_py, eta=nu_eta_t)
+    p_nu_tbar = kinematics.neutrino_four_momentum(
+        px=nu_tbar_px, py=nu_tbar_py, eta=nu_eta_tbar
+    )
+    p_top = p_b_t + p_l_t + p_nu_t
+    p_tbar = p_b_tbar + p_l_tbar + p_nu_tbar
+    return (
+        p_top,
+        p_l_t,
+        p_b_t,
+        p_nu_t,
+        p_tbar,
+        p_l_tbar,
+        p_b_tbar,
+        p_nu_tbar,
+        np.array([idx]),
+        weight,
+    )
+
+
+def event_rng(random_seed: int, idx: int, source_idx: int = 0) -> np.random.Generator:
+    """Create the random number generator of one event. Streams only depend on the
+    seed and the event, so results don't depend on how events are split in batches,
+    chunks or workers.
+
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param idx: Event index in its file.
+    :type idx: int
+    :param source_idx: Index of the file the event comes from, defaults to 0.
+    :type source_idx: int, optional
+    :return: Numpy's random number generator.
+    :rtype: np.random.Generator
+    """
+    return np.random.default_rng([random_seed, source_idx, idx])
+
+
+def max_lb_invariant(m_b: np.ndarray, m_t: float) -> np.ndarray:
+    """Calculate the largest 2 p_l.p_b allowed in a top decay t -> b W(l nu) with a
+    massless lepton, reached when the lepton goes opposite to the b in the top's rest
+    frame. It's m(lb)**2 - m_b**2 at the m(lb) endpoint.
+
+    :param m_b: b-jet masses.
+    :type m_b: np.ndarray
+    :param m_t: Top's mass.
+    :type m_t: float
+    :return: Largest 2 p_l.p_b, -inf if the top can't decay into the b-jet and a W.
+    :rtype: np.ndarray
+    """
+    e_b = (m_t ** 2 + m_b ** 2 - M_W ** 2) / (2 * m_t)
+    with np.errstate(invalid="ignore"):
+        p_b = np.sqrt(e_b ** 2 - m_b ** 2)
+    bound = (m_t - e_b + p_b) * (e_b + p_b)
+    return np.where(m_b + M_W < m_t, bound, -np.inf)
+
+
+def preselect_events(
+    selected: Dict[str, JaggedArray],
+    n_sigmas: float = PRESELECTION_SIGMAS,
+    leptons: Dict[str, np.ndarray] = None,
+) -> np.ndarray:
+    """Find events that can be reconstructed with columnar operations over all the
+    events, so that the reconstruction only loops over them. Events need a dilepton
+    channel with opposite charges (see kinematics.dilepton_kinematics), at least
+    two b-jets, and two different b-jets that each lepton can come from along with
+    a W. A lepton and a b-jet are vetoed when their 2 p_l.p_b is above the endpoint
+    of the heaviest top mass searched even after smearing the b-jet down by n_sigmas,
+    since no neutrino solves the mass constraints then.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict[str, JaggedArray]
+    :param n_sigmas: Largest downward smear of the b-jets' pt, in standard deviations,
+                     defaults to PRESELECTION_SIGMAS.
+    :type n_sigmas: float, optional
+    :param leptons: Lepton pairs of the same events (see kinematics.dilepton_kinematics),
+                    defaults to None (paired from selected).
+    :type leptons: Dict[str, np.ndarray], optional
+    :return: Mask of events that can be reconstructed.
+    :rtype: np.ndarray
+    """
+    if leptons is None:
+        leptons = kinematics.dilepton_kinematics(selected)
+    n_bjets = selected["bjets_pt"].counts
+    passed = leptons["valid"] & (n_bjets >= 2)
+
+    # Pair every b-jet with both leptons of its event
+    parents = np.repeat(np.arange(len(n_bjets)), n_bjets)
+    p_b = kinematics.four_momentum(
+        *[selected[f"bjets_{name}"].flatten().reshape(-1, 1) for name in ("pt", "phi", "eta")],
+        mass=selected["bjets_mass"].flatten().reshape(-1, 1),
+    )
+    bound = max_lb_invariant(selected["bjets_mass"].flatten(), np.max(M_T_SEARCH))
+    # Smearing scales the b-jet's pt, and 2 p_l.p_b shrinks at most by the same factor
+    scale = max(1 - n_sigmas * BJET_PT_RESOLUTION, 0)
+    feasible = []
+    for p_l in (leptons["p_l_t"][parents], leptons["p_l_tbar"][parents]):
+        lb = 2 * (p_l[:, 3] * p_b[:, 3] - np.sum(p_l[:, :3] * p_b[:, :3], axis=1))
+        feasible.append(scale * lb <= bound)
+
+    # Pairs of different b-jets, (b_i, b_j) with i != j, compatible with each lepton
+    n_first = np.bincount(parents, feasible[0], minlength=len(n_bjets))
+    n_second = np.bincount(parents, feasible[1], minlength=len(n_bjets))
+    n_both = np.bincount(parents, feasible[0] & feasible[1], minlength=len(n_bjets))
+    return passed & (n_first * n_second - n_both > 0)
 
 
 def reconstruct_event(
@@ -373,18 +711,13 @@ def reconstruct_event(
     bjets_pt: np.ndarray,
     bjets_phi: np.ndarray,
     bjets_eta: np.ndarray,
-    electron_pt: np.ndarray,
-    electron_phi: np.ndarray,
-    electron_eta: np.ndarray,
-    electron_charge: np.ndarray,
-    muon_pt: np.ndarray,
-    muon_phi: np.ndarray,
-    muon_eta: np.ndarray,
-    muon_charge: np.ndarray,
+    p_l_t: np.ndarray,
+    p_l_tbar: np.ndarray,
     met: np.ndarray,
     met_phi: np.ndarray,
     idx: int,
     rng: np.random.Generator,
+    dtype: str = "float32",
 ) -> Union[
     Tuple[
         np.ndarray,
@@ -410,22 +743,11 @@ def reconstruct_event(
     :type bjets_phi: np.ndarray
     :param bjets_eta: Eta of b-jets in event.
     :type bjets_eta: np.ndarray
-    :param electron_pt: PT of electrons in event.
-    :type electron_pt: np.ndarray
-    :param electron_phi: Phi of electrons in event.
-    :type electron_phi: np.ndarray
-    :param electron_eta: Eta of electrons in event.
-    :type electron_eta: np.ndarray
-    :param electron_charge: Charges of electrons in event.
-    :type electron_charge: np.ndarray
-    :param muon_pt: PT of muons in event.
-    :type muon_pt: np.ndarray
-    :param muon_phi: Phi of muons in event.
-    :type muon_phi: np.ndarray
-    :param muon_eta: Eta of muons in event.
-    :type muon_eta: np.ndarray
-    :param muon_charge: Charge of muons in event.
-    :type muon_charge: np.ndarray
+    :param p_l_t: Four-momentum of lepton assigned to top quark
+                  (see kinematics.dilepton_kinematics).
+    :type p_l_t: np.ndarray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark.
+    :type p_l_tbar: np.ndarray
     :param met: MET in event.
     :type met: np.ndarray
     :param met_phi: Phi of MET in event.
@@ -434,43 +756,33 @@ def reconstruct_event(
     :type idx: int
     :param rng: Numpy's random number generator.
     :type rng: np.random.Generator
+    :param dtype: Floating point type of the solver, 'float32' or 'float64',
+                  defaults to 'float32'.
+    :type dtype: str, optional
     :return: Particles in the event with idx and reconstruction weight. Return
              None if event doesn't meet selection criteria.
     :rtype: Union[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray,
                  np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray], None]
     """
-    p_l_t, p_l_tbar, m_l_t, m_l_tbar = lepton_kinematics(
-        electron_pt=electron_pt,
-        electron_phi=electron_phi,
-        electron_eta=electron_eta,
-        electron_charge=electron_charge,
-        muon_pt=muon_pt,
-        muon_phi=muon_phi,
-        muon_eta=muon_eta,
-        muon_charge=muon_charge,
-    )
-    if p_l_t is None:
-        return None
-
-    if len(bjets_mass) < 2:
-        return None
-
-    bjets_combinations_idxs = np.array(list(permutations(range(len(bjets_mass)), 2)))
-    smeared_bjets_pt = rng.normal(bjets_pt, bjets_pt * 0.14, (5, len(bjets_pt)))
-    p_b_t, p_b_tbar, m_b_t, m_b_tbar = ttbar_bjets_kinematics(
-        smeared_bjets_pt=smeared_bjets_pt,
+    clock = profiling.clock()
+    inputs = event_inputs(
+        bjets_mass=bjets_mass,
+        bjets_pt=bjets_pt,
         bjets_phi=bjets_phi,
         bjets_eta=bjets_eta,
-        bjets_mass=bjets_mass,
-        bjets_combinations_idxs=bjets_combinations_idxs,
+        p_l_t=p_l_t,
+        p_l_tbar=p_l_tbar,
+        met=met,
+        met_phi=met_phi,
+        rng=rng,
     )
-
-    met_x = (met * np.cos(met_phi))[0]
-    met_y = (met * np.sin(met_phi))[0]
+    clock.lap("inputs")
+    if inputs is None:
+        return None
+    p_l_t, p_l_tbar, p_b_t, p_b_tbar, m_b_t, m_b_tbar, met_x, met_y = inputs
 
     # Vectorize Eta grid for loop
-    eta_range = np.linspace(-5, 5, 51)
-    eta_grid = np.array(np.meshgrid(eta_range, eta_range)).T.reshape(-1, 2)
+    eta_grid = NU_ETA_GRID
 
     eta_vectorized_mask = [
         i for i in range(eta_grid.shape[0]) for j in range(p_b_t.shape[0])
@@ -479,8 +791,6 @@ def reconstruct_event(
 
     p_l_t = np.tile(p_l_t, (eta_grid.shape[0] * p_b_t.shape[0], 1))
     p_l_tbar = np.tile(p_l_tbar, (eta_grid.shape[0] * p_b_t.shape[0], 1))
-    m_l_t = np.tile(m_l_t, (eta_grid.shape[0] * p_b_t.shape[0], 1))
-    m_l_tbar = np.tile(m_l_tbar, (eta_grid.shape[0] * p_b_t.shape[0], 1))
 
     p_b_t = np.tile(p_b_t, (eta_grid.shape[0], 1))
     p_b_tbar = np.tile(p_b_tbar, (eta_grid.shape[0], 1))
@@ -488,7 +798,7 @@ def reconstruct_event(
     m_b_tbar = np.tile(m_b_tbar, (eta_grid.shape[0], 1))
 
     # Vectorize top mass for loop
-    m_t_search = np.linspace(171, 174, 7).reshape(-1, 1)
+    m_t_search = M_T_SEARCH.reshape(-1, 1)
     mass_vectorized_mask = [
         i for i in range(m_t_search.shape[0]) for j in range(p_b_t.shape[0])
     ]
@@ -496,8 +806,6 @@ def reconstruct_event(
 
     p_l_t = np.tile(p_l_t, (m_t_search.shape[0], 1))
     p_l_tbar = np.tile(p_l_tbar, (m_t_search.shape[0], 1))
-    m_l_t = np.tile(m_l_t, (m_t_search.shape[0], 1))
-    m_l_tbar = np.tile(m_l_tbar, (m_t_search.shape[0], 1))
 
     p_b_t = np.tile(p_b_t, (m_t_search.shape[0], 1))
     p_b_tbar = np.tile(p_b_tbar, (m_t_search.shape[0], 1))
@@ -508,22 +816,26 @@ def reconstruct_event(
 
     nu_eta_t = nu_etas[:, 0:1]
     nu_eta_tbar = nu_etas[:, 1:]
-
-    nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py = get_neutrino_momentum(
-        nu_eta_t=jnp.array(nu_eta_t),
-        p_l_t=jnp.array(p_l_t),
-        p_b_t=jnp.array(p_b_t),
-        m_b_t=jnp.array(m_b_t),
-        nu_eta_tbar=jnp.array(nu_eta_tbar),
-        p_l_tbar=jnp.array(p_l_tbar),
-        p_b_tbar=jnp.array(p_b_tbar),
-        m_b_tbar=jnp.array(m_b_tbar),
-        m_t_val=jnp.array(m_t_val),
-    )
-    nu_t_px = np.array(nu_t_px)
-    nu_t_py = np.array(nu_t_py)
-    nu_tbar_px = np.array(nu_tbar_px)
-    nu_tbar_py = np.array(nu_tbar_py)
+    clock.lap("grid")
+
+    with enable_x64(np.dtype(dtype) == np.float64):
+        nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py = get_neutrino_momentum(
+            nu_eta_t=jnp.array(nu_eta_t, dtype=dtype),
+            p_l_t=jnp.array(p_l_t, dtype=dtype),
+            p_b_t=jnp.array(p_b_t, dtype=dtype),
+            m_b_t=jnp.array(m_b_t, dtype=dtype),
+            nu_eta_tbar=jnp.array(nu_eta_tbar, dtype=dtype),
+            p_l_tbar=jnp.array(p_l_tbar, dtype=dtype),
+            p_b_tbar=jnp.array(p_b_tbar, dtype=dtype),
+            m_b_tbar=jnp.array(m_b_tbar, dtype=dtype),
+            m_t_val=jnp.array(m_t_val, dtype=dtype),
+        )
+        nu_t_px = np.array(nu_t_px)
+        nu_t_py = np.array(nu_t_py)
+        nu_tbar_px = np.array(nu_tbar_px)
+        nu_tbar_py = np.array(nu_tbar_py)
+    # Includes transfers, since the solver runs asynchronously until its outputs are read
+    clock.lap("solve")
 
     total_nu_px = nu_t_px + nu_tbar_px
     total_nu_py = nu_t_py + nu_tbar_py
@@ -549,150 +861,1507 @@ def reconstruct_event(
     weights = solution_weight(
         met_x=met_x, met_y=met_y, neutrino_px=total_nu_px, neutrino_py=total_nu_py
     )
+    clock.lap("weighting")
     if len(weights) == 0:
         return None
     best_weight_idx = np.argmax(weights)
-    if weights[best_weight_idx] < 0.4:
+    if weights[best_weight_idx] < MIN_WEIGHT:
         return None
 
-    best_weight = np.real(weights[best_weight_idx])
-    best_b_t = p_b_t[best_weight_idx]
-    best_l_t = p_l_t[best_weight_idx]
-    best_nu_t = kinematics.neutrino_four_momentum(
-        px=np.real(nu_t_px[best_weight_idx]),
-        py=np.real(nu_t_py[best_weight_idx]),
-        eta=nu_eta_t[best_weight_idx],
+    return best_solution(
+        p_b_t=p_b_t[best_weight_idx],
+        p_l_t=p_l_t[best_weight_idx],
+        nu_t_px=np.real(nu_t_px[best_weight_idx]),
+        nu_t_py=np.real(nu_t_py[best_weight_idx]),
+        nu_eta_t=nu_eta_t[best_weight_idx],
+        p_b_tbar=p_b_tbar[best_weight_idx],
+        p_l_tbar=p_l_tbar[best_weight_idx],
+        nu_tbar_px=np.real(nu_tbar_px[best_weight_idx]),
+        nu_tbar_py=np.real(nu_tbar_py[best_weight_idx]),
+        nu_eta_tbar=nu_eta_tbar[best_weight_idx],
+        idx=idx,
+        weight=np.real(weights[best_weight_idx]),
     )
-    best_b_tbar = p_b_tbar[best_weight_idx]
-    best_l_tbar = p_l_tbar[best_weight_idx]
-    best_nu_tbar = kinematics.neutrino_four_momentum(
-        px=np.real(nu_tbar_px[best_weight_idx]),
-        py=np.real(nu_tbar_py[best_weight_idx]),
-        eta=nu_eta_tbar[best_weight_idx],
+
+
+@jit
+def best_neutrino_solutions(
+    p_l_t: jnp.DeviceArray,
+    p_l_tbar: jnp.DeviceArray,
+    p_b_t: jnp.DeviceArray,
+    p_b_tbar: jnp.DeviceArray,
+    m_b_t: jnp.DeviceArray,
+    m_b_tbar: jnp.DeviceArray,
+    met_x: jnp.DeviceArray,
+    met_y: jnp.DeviceArray,
+    valid: jnp.DeviceArray,
+) -> Tuple[jnp.DeviceArray, ...]:
+    """Scan the neutrino eta grid and top masses for a batch of events and keep the
+    solution with the highest weight in each event. Rows are ordered as in
+    reconstruct_event, so ties are broken the same way.
+
+    :param p_l_t: Four-momentum of lepton assigned to top quark, shape (events, 4).
+    :type p_l_t: jnp.DeviceArray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark, shape (events, 4).
+    :type p_l_tbar: jnp.DeviceArray
+    :param p_b_t: Four-momenta of b-jet assigned to top quark for every smear and
+                  permutation, shape (events, b-jet rows, 4).
+    :type p_b_t: jnp.DeviceArray
+    :param p_b_tbar: Same as p_b_t for the anti-top quark.
+    :type p_b_tbar: jnp.DeviceArray
+    :param m_b_t: Mass of b-jet assigned to top quark, shape (events, b-jet rows).
+    :type m_b_t: jnp.DeviceArray
+    :param m_b_tbar: Mass of b-jet assigned to anti-top quark, shape (events, b-jet rows).
+    :type m_b_tbar: jnp.DeviceArray
+    :param met_x: Missing ET in x direction, shape (events,).
+    :type met_x: jnp.DeviceArray
+    :param met_y: Missing ET in y direction, shape (events,).
+    :type met_y: jnp.DeviceArray
+    :param valid: False for padded b-jet rows, shape (events, b-jet rows).
+    :type valid: jnp.DeviceArray
+    :return: Index of the best solution in each event (-1 weight if there's no real
+             solution), its weight, and px and py of both neutrinos.
+    :rtype: Tuple[jnp.DeviceArray, ...]
+    """
+    n_events, n_b_rows = valid.shape
+    shape = (n_events, M_T_SEARCH.shape[0], NU_ETA_GRID.shape[0], n_b_rows)
+    eta_grid = jnp.asarray(NU_ETA_GRID, dtype=p_l_t.dtype)
+    m_t_search = jnp.asarray(M_T_SEARCH, dtype=p_l_t.dtype)
+
+    # Inputs have one axis per loop (event, mass, eta, b-jet row) and are flattened
+    # into rows in the same order as in reconstruct_event
+    def rows(array):
+        tail = array.shape[4:]
+        return jnp.broadcast_to(array, shape + tail).reshape((-1,) + tail)
+
+    nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py, real = get_neutrino_momentum_real(
+        nu_eta_t=rows(eta_grid[None, None, :, None, 0:1]),
+        p_l_t=rows(p_l_t[:, None, None, None, :]),
+        p_b_t=rows(p_b_t[:, None, None, :, :]),
+        m_b_t=rows(m_b_t[:, None, None, :, None]),
+        nu_eta_tbar=rows(eta_grid[None, None, :, None, 1:]),
+        p_l_tbar=rows(p_l_tbar[:, None, None, None, :]),
+        p_b_tbar=rows(p_b_tbar[:, None, None, :, :]),
+        m_b_tbar=rows(m_b_tbar[:, None, None, :, None]),
+        m_t_val=rows(m_t_search[None, :, None, None, None]),
     )
 
-    p_top = best_b_t + best_l_t + best_nu_t
-    p_tbar = best_b_tbar + best_l_tbar + best_nu_tbar
-    idx_arr = np.array([idx])
+    # Solutions come out as (combination, event, mass, eta, b-jet row)
+    def per_event(array):
+        return jnp.swapaxes(array.reshape(4, n_events, -1), 0, 1).reshape(n_events, -1)
+
+    nu_t_px, nu_t_py = per_event(nu_t_px), per_event(nu_t_py)
+    nu_tbar_px, nu_tbar_py = per_event(nu_tbar_px), per_event(nu_tbar_py)
+    total_nu_px = nu_t_px + nu_tbar_px
+    total_nu_py = nu_t_py + nu_tbar_py
+    real_mask = per_event(real)
+    valid_mask = jnp.broadcast_to(
+        valid[:, None, None, None, :], (n_events, 4) + shape[1:]
+    ).reshape(n_events, -1)
+
+    weights = device_solution_weight(
+        met_x=met_x[:, None],
+        met_y=met_y[:, None],
+        neutrino_px=total_nu_px,
+        neutrino_py=total_nu_py,
+    )
+    weights = jnp.where(real_mask & valid_mask, weights, -1.0)
+    best_idx = jnp.argmax(weights, axis=1)
+
+    def best(array):
+        return jnp.take_along_axis(array, best_idx[:, None], axis=1)[:, 0]
 
     return (
-        p_top,
-        best_l_t,
-        best_b_t,
-        best_nu_t,
-        p_tbar,
-        best_l_tbar,
-        best_b_tbar,
-        best_nu_tbar,
-        idx_arr,
-        best_weight,
+        best_idx,
+        best(weights),
+        best(nu_t_px),
+        best(nu_t_py),
+        best(nu_tbar_px),
+        best(nu_tbar_py),
     )
 
 
-if __name__ == "__main__":
-    process_name = "SM_spin-OFF_100k"
-    random_seed = 0
+@partial(jit, static_argnames="block_size")
+def scan_neutrino_solutions(
+    p_l_t: jnp.DeviceArray,
+    p_l_tbar: jnp.DeviceArray,
+    p_b_t: jnp.DeviceArray,
+    p_b_tbar: jnp.DeviceArray,
+    m_b_t: jnp.DeviceArray,
+    m_b_tbar: jnp.DeviceArray,
+    met_x: jnp.DeviceArray,
+    met_y: jnp.DeviceArray,
+    valid: jnp.DeviceArray,
+    block_size: int = 1024,
+) -> Tuple[jnp.DeviceArray, ...]:
+    """Same as best_neutrino_solutions, but walking the (top mass, eta) grid in blocks
+    and keeping only the running best solution of each event. Memory grows with the
+    block size instead of the grid size. Ties are broken in favour of the solution
+    that comes first in reconstruct_event, so the same solution is selected.
+
+    :param p_l_t: Four-momentum of lepton assigned to top quark, shape (events, 4).
+    :type p_l_t: jnp.DeviceArray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark, shape (events, 4).
+    :type p_l_tbar: jnp.DeviceArray
+    :param p_b_t: Four-momenta of b-jet assigned to top quark for every smear and
+                  permutation, shape (events, b-jet rows, 4).
+    :type p_b_t: jnp.DeviceArray
+    :param p_b_tbar: Same as p_b_t for the anti-top quark.
+    :type p_b_tbar: jnp.DeviceArray
+    :param m_b_t: Mass of b-jet assigned to top quark, shape (events, b-jet rows).
+    :type m_b_t: jnp.DeviceArray
+    :param m_b_tbar: Mass of b-jet assigned to anti-top quark, shape (events, b-jet rows).
+    :type m_b_tbar: jnp.DeviceArray
+    :param met_x: Missing ET in x direction, shape (events,).
+    :type met_x: jnp.DeviceArray
+    :param met_y: Missing ET in y direction, shape (events,).
+    :type met_y: jnp.DeviceArray
+    :param valid: False for padded b-jet rows, shape (events, b-jet rows).
+    :type valid: jnp.DeviceArray
+    :param block_size: Number of (top mass, eta) points evaluated per step,
+                       defaults to 1024.
+    :type block_size: int, optional
+    :return: Index of the best solution in each event (-1 weight if there's no real
+             solution), its weight, and px and py of both neutrinos.
+    :rtype: Tuple[jnp.DeviceArray, ...]
+    """
+    n_events, n_b_rows = valid.shape
+    n_points = M_T_SEARCH.shape[0] * NU_ETA_GRID.shape[0]
+    n_blocks = -(-n_points // block_size)
+    n_padded = n_blocks * block_size - n_points
+    # Grid points in the order of reconstruct_event (top mass, then eta pair)
+    m_t_points = np.pad(np.repeat(M_T_SEARCH, NU_ETA_GRID.shape[0]), (0, n_padded))
+    eta_points = np.tile(NU_ETA_GRID, (M_T_SEARCH.shape[0], 1))
+    eta_points = np.pad(eta_points, ((0, n_padded), (0, 0)))
+    blocks = (
+        jnp.asarray(m_t_points.reshape(n_blocks, block_size), dtype=p_l_t.dtype),
+        jnp.asarray(eta_points.reshape(n_blocks, block_size, 2), dtype=p_l_t.dtype),
+        jnp.arange(n_blocks * block_size).reshape(n_blocks, block_size) < n_points,
+        jnp.arange(n_blocks) * block_size,
+    )
+    shape = (n_events, block_size, n_b_rows)
+
+    def rows(array):
+        tail = array.shape[3:]
+        return jnp.broadcast_to(array, shape + tail).reshape((-1,) + tail)
+
+    def step(best, block):
+        m_t_block, eta_block, point_valid, offset = block
+        nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py, real = get_neutrino_momentum_real(
+            nu_eta_t=rows(eta_block[None, :, None, 0:1]),
+            p_l_t=rows(p_l_t[:, None, None, :]),
+            p_b_t=rows(p_b_t[:, None, :, :]),
+            m_b_t=rows(m_b_t[:, None, :, None]),
+            nu_eta_tbar=rows(eta_block[None, :, None, 1:]),
+            p_l_tbar=rows(p_l_tbar[:, None, None, :]),
+            p_b_tbar=rows(p_b_tbar[:, None, :, :]),
+            m_b_tbar=rows(m_b_tbar[:, None, :, None]),
+            m_t_val=rows(m_t_block[None, :, None, None]),
+        )
 
-    sm_path = os.path.join(
-        "../mg5_data",
-        f"{process_name}_{random_seed}",
-        "Events/run_01_decayed_1/tag_1_delphes_events.root"
+        def per_event(array):
+            return jnp.swapaxes(array.reshape(4, n_events, -1), 0, 1).reshape(n_events, -1)
+
+        solutions = [per_event(array) for array in (nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py)]
+        total_nu_px = solutions[0] + solutions[2]
+        total_nu_py = solutions[1] + solutions[3]
+        real_mask = per_event(real)
+        valid_mask = jnp.broadcast_to(
+            valid[:, None, None, :] & point_valid[None, None, :, None],
+            (n_events, 4) + shape[1:],
+        ).reshape(n_events, -1)
+
+        weights = device_solution_weight(
+            met_x=met_x[:, None],
+            met_y=met_y[:, None],
+            neutrino_px=total_nu_px,
+            neutrino_py=total_nu_py,
+        )
+        weights = jnp.where(real_mask & valid_mask, weights, -1.0)
+        block_idx = jnp.argmax(weights, axis=1)
+
+        # Index of the block's best solution in the full (combination, mass, eta,
+        # b-jet row) layout of best_neutrino_solutions
+        combination, point, b_row = jnp.unravel_index(block_idx, (4, block_size, n_b_rows))
+        flat_idx = ((combination * n_points + offset + point) * n_b_rows + b_row).astype(
+            jnp.int32
+        )
+
+        def take(array):
+            return jnp.take_along_axis(array, block_idx[:, None], axis=1)[:, 0]
+
+        candidate = (flat_idx, take(weights)) + tuple(take(array) for array in solutions)
+        better = (candidate[1] > best[1]) | ((candidate[1] == best[1]) & (flat_idx < best[0]))
+        best = tuple(jnp.where(better, new, old) for new, old in zip(candidate, best))
+        return best, None
+
+    init = (
+        jnp.full(n_events, jnp.iinfo(jnp.int32).max, dtype=jnp.int32),
+        jnp.full(n_events, -jnp.inf, dtype=p_l_t.dtype),
+    ) + tuple(jnp.zeros(n_events, dtype=p_l_t.dtype) for _ in range(4))
+    best, _ = lax.scan(step, init, blocks)
+    return best
+
+
+@jit
+def eta_point_solutions(
+    p_l_t: jnp.DeviceArray,
+    p_l_tbar: jnp.DeviceArray,
+    p_b_t: jnp.DeviceArray,
+    p_b_tbar: jnp.DeviceArray,
+    m_b_t: jnp.DeviceArray,
+    m_b_tbar: jnp.DeviceArray,
+    met_x: jnp.DeviceArray,
+    met_y: jnp.DeviceArray,
+    valid: jnp.DeviceArray,
+    eta_points: jnp.DeviceArray,
+) -> Tuple[jnp.DeviceArray, ...]:
+    """Get the best solution at each neutrino eta pair of each event, maximizing the
+    weight over solution combinations, top masses and b-jet rows.
+
+    :param p_l_t: Four-momentum of lepton assigned to top quark, shape (events, 4).
+    :type p_l_t: jnp.DeviceArray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark, shape (events, 4).
+    :type p_l_tbar: jnp.DeviceArray
+    :param p_b_t: Four-momenta of b-jet assigned to top quark for every smear and
+                  permutation, shape (events, b-jet rows, 4).
+    :type p_b_t: jnp.DeviceArray
+    :param p_b_tbar: Same as p_b_t for the anti-top quark.
+    :type p_b_tbar: jnp.DeviceArray
+    :param m_b_t: Mass of b-jet assigned to top quark, shape (events, b-jet rows).
+    :type m_b_t: jnp.DeviceArray
+    :param m_b_tbar: Mass of b-jet assigned to anti-top quark, shape (events, b-jet rows).
+    :type m_b_tbar: jnp.DeviceArray
+    :param met_x: Missing ET in x direction, shape (events,).
+    :type met_x: jnp.DeviceArray
+    :param met_y: Missing ET in y direction, shape (events,).
+    :type met_y: jnp.DeviceArray
+    :param valid: False for padded b-jet rows, shape (events, b-jet rows).
+    :type valid: jnp.DeviceArray
+    :param eta_points: Eta of the neutrinos assigned to top and anti-top quarks,
+                       shape (events, points, 2).
+    :type eta_points: jnp.DeviceArray
+    :return: Index of the best solution at each point in the (combination, mass, b-jet
+             row) layout, its weight (-1 if there's no real solution), and px and py
+             of both neutrinos. Each has shape (events, points).
+    :rtype: Tuple[jnp.DeviceArray, ...]
+    """
+    n_events, n_b_rows = valid.shape
+    n_points = eta_points.shape[1]
+    shape = (n_events, M_T_SEARCH.shape[0], n_points, n_b_rows)
+    m_t_search = jnp.asarray(M_T_SEARCH, dtype=p_l_t.dtype)
+
+    def rows(array):
+        tail = array.shape[4:]
+        return jnp.broadcast_to(array, shape + tail).reshape((-1,) + tail)
+
+    nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py, real = get_neutrino_momentum_real(
+        nu_eta_t=rows(eta_points[:, None, :, None, 0:1]),
+        p_l_t=rows(p_l_t[:, None, None, None, :]),
+        p_b_t=rows(p_b_t[:, None, None, :, :]),
+        m_b_t=rows(m_b_t[:, None, None, :, None]),
+        nu_eta_tbar=rows(eta_points[:, None, :, None, 1:]),
+        p_l_tbar=rows(p_l_tbar[:, None, None, None, :]),
+        p_b_tbar=rows(p_b_tbar[:, None, None, :, :]),
+        m_b_tbar=rows(m_b_tbar[:, None, None, :, None]),
+        m_t_val=rows(m_t_search[None, :, None, None, None]),
     )
-    output_dir = f"../reconstructed_events/{process_name}_{random_seed}"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    n_batches = 10
 
-    print("Loading events...", end="\r")
-    sm_events = uproot.open(sm_path)["Delphes"]
-    print("Loading events...Done")
-
-    print("Applying selection criteria...", end="\r")
-    # Apply ATLAS selection criteria
-    electron_mask = event_selection.select_electron(sm_events)
-    muon_mask = event_selection.select_muon(sm_events)
-    jets_mask = event_selection.select_jet(sm_events)
-
-    # Get mask for b-jets
-    bjets_mask = sm_events["Jet.BTag"].array()[jets_mask].astype(bool)
-
-    # Select b-jets that pass selection criteria from Jet TTree
-    bjets_mass = sm_events["Jet.Mass"].array()[jets_mask][bjets_mask]
-    bjets_pt = sm_events["Jet.PT"].array()[jets_mask][bjets_mask]
-    bjets_phi = sm_events["Jet.Phi"].array()[jets_mask][bjets_mask]
-    bjets_eta = sm_events["Jet.Eta"].array()[jets_mask][bjets_mask]
-
-    # Select electrons that pass selection criteria
-    electron_pt = sm_events["Electron.PT"].array()[electron_mask]
-    electron_phi = sm_events["Electron.Phi"].array()[electron_mask]
-    electron_eta = sm_events["Electron.Eta"].array()[electron_mask]
-    electron_charge = sm_events["Electron.Charge"].array()[electron_mask]
-
-    # Select muons that pass selection criteria
-    muon_pt = sm_events["Muon.PT"].array()[muon_mask]
-    muon_phi = sm_events["Muon.Phi"].array()[muon_mask]
-    muon_eta = sm_events["Muon.Eta"].array()[muon_mask]
-    muon_charge = sm_events["Muon.Charge"].array()[muon_mask]
-
-    # MET for all events
-    met = sm_events["MissingET.MET"].array()
-    met_phi = sm_events["MissingET.Phi"].array()
-    print("Applying selection criteria...Done")
-
-    reco_names = [
-        "p_top",
-        "p_l_t",
-        "p_b_t",
-        "p_nu_t",
-        "p_tbar",
-        "p_l_tbar",
-        "p_b_tbar",
-        "p_nu_tbar",
-        "idx",
-        "weight",
-    ]
-    step_size = len(muon_phi) // n_batches
-    rng = np.random.default_rng(random_seed)
-    for batch_idx in tqdm(range(n_batches)):
-        init_idx = batch_idx * step_size
-        end_idx = init_idx + step_size
-        reconstructed_events = [
-            reconstruct_event(
-                bjets_mass=bjets_mass[idx],
-                bjets_pt=bjets_pt[idx],
-                bjets_phi=bjets_phi[idx],
-                bjets_eta=bjets_eta[idx],
-                electron_pt=electron_pt[idx],
-                electron_phi=electron_phi[idx],
-                electron_eta=electron_eta[idx],
-                electron_charge=electron_charge[idx],
-                muon_pt=muon_pt[idx],
-                muon_phi=muon_phi[idx],
-                muon_eta=muon_eta[idx],
-                muon_charge=muon_charge[idx],
-                met=met[idx],
-                met_phi=met_phi[idx],
-                idx=idx,
-                rng=rng,
+    # Solutions come out as (combination, event, mass, point, b-jet row)
+    def per_point(array):
+        array = array.reshape((4,) + shape)
+        return jnp.transpose(array, (1, 3, 0, 2, 4)).reshape(n_events, n_points, -1)
+
+    solutions = [per_point(array) for array in (nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py)]
+    total_nu_px = solutions[0] + solutions[2]
+    total_nu_py = solutions[1] + solutions[3]
+    real_mask = per_point(real)
+    valid_mask = jnp.broadcast_to(
+        valid[:, None, None, None, :], (n_events, n_points, 4, shape[1], n_b_rows)
+    ).reshape(n_events, n_points, -1)
+
+    weights = device_solution_weight(
+        met_x=met_x[:, None, None],
+        met_y=met_y[:, None, None],
+        neutrino_px=total_nu_px,
+        neutrino_py=total_nu_py,
+    )
+    weights = jnp.where(real_mask & valid_mask, weights, -1.0)
+    best_idx = jnp.argmax(weights, axis=2)
+
+    def take(array):
+        return jnp.take_along_axis(array, best_idx[..., None], axis=2)[..., 0]
+
+    return (best_idx, take(weights)) + tuple(take(array) for array in solutions)
+
+
+def device_batch(batch: Dict[str, np.ndarray], dtype: str) -> Dict[str, jnp.DeviceArray]:
+    """Move padded batch to the device, with floating point inputs in the solver's
+    precision. float64 needs to be used inside enable_x64.
+
+    :param batch: Padded inputs of best_neutrino_solutions by name.
+    :type batch: Dict[str, np.ndarray]
+    :param dtype: Floating point type of the solver, 'float32' or 'float64'.
+    :type dtype: str
+    :return: Inputs on the device by name.
+    :rtype: Dict[str, jnp.DeviceArray]
+    """
+    with profiling.stage("solve/transfer"):
+        return {
+            name: jnp.asarray(
+                array, dtype=dtype if np.issubdtype(array.dtype, np.floating) else None
             )
-            for idx in tqdm(range(init_idx, end_idx), leave=False)
-        ]
+            for name, array in batch.items()
+        }
+
+
+def dense_solutions(
+    batch: Dict[str, np.ndarray], block_size: int = None, dtype: str = "float32"
+) -> Tuple[np.ndarray, ...]:
+    """Find the best solution of each event in a padded batch scanning the full
+    eta grid.
+
+    :param batch: Padded inputs of best_neutrino_solutions by name.
+    :type batch: Dict[str, np.ndarray]
+    :param block_size: Number of (top mass, eta) points per step of the grid scan,
+                       defaults to None (whole grid at once).
+    :type block_size: int, optional
+    :param dtype: Floating point type of the solver, 'float32' or 'float64',
+                  defaults to 'float32'.
+    :type dtype: str, optional
+    :return: Weight, eta of both neutrinos, b-jet row, and px and py of both
+             neutrinos of the best solution of each event.
+    :rtype: Tuple[np.ndarray, ...]
+    """
+    if block_size is None:
+        solve = best_neutrino_solutions
+    else:
+        solve = partial(scan_neutrino_solutions, block_size=block_size)
+    with enable_x64(np.dtype(dtype) == np.float64):
+        best_idx, weight, *momenta = (
+            np.asarray(array) for array in solve(**device_batch(batch, dtype))
+        )
+    n_b_rows = batch["valid"].shape[1]
+    eta_idx = (best_idx // n_b_rows) % NU_ETA_GRID.shape[0]
+    b_row = best_idx % n_b_rows
+    return (weight, NU_ETA_GRID[eta_idx, 0], NU_ETA_GRID[eta_idx, 1], b_row, *momenta)
+
+
+def adaptive_solutions(
+    batch: Dict[str, np.ndarray],
+    n_coarse: int,
+    depth: int,
+    n_seeds: int,
+    radius: int,
+    shrink: float,
+    dtype: str = "float32",
+) -> Tuple[np.ndarray, ...]:
+    """Find the best solution of each event in a padded batch with a coarse-to-fine
+    eta search. A coarse grid over [-5, 5] is scanned first, and then local grids
+    with smaller steps are scanned around the points with the highest weights.
+
+    :param batch: Padded inputs of best_neutrino_solutions by name.
+    :type batch: Dict[str, np.ndarray]
+    :param n_coarse: Number of points per neutrino in the coarse grid.
+    :type n_coarse: int
+    :param depth: Number of refinements.
+    :type depth: int
+    :param n_seeds: Number of points refined at each level.
+    :type n_seeds: int
+    :param radius: Half-width of the refined grids in steps.
+    :type radius: int
+    :param shrink: Step reduction at each level.
+    :type shrink: float
+    :param dtype: Floating point type of the solver, 'float32' or 'float64',
+                  defaults to 'float32'.
+    :type dtype: str, optional
+    :return: Weight, eta of both neutrinos, b-jet row, and px and py of both
+             neutrinos of the best solution of each event.
+    :rtype: Tuple[np.ndarray, ...]
+    """
+    n_events, n_b_rows = batch["valid"].shape
+    eta_range = np.linspace(-5, 5, n_coarse)
+    eta_points = np.array(np.meshgrid(eta_range, eta_range)).T.reshape(-1, 2)
+    eta_points = np.broadcast_to(eta_points, (n_events,) + eta_points.shape)
+    step = eta_range[1] - eta_range[0]
+    offsets = np.arange(-radius, radius + 1)
+    offsets = np.array(np.meshgrid(offsets, offsets)).T.reshape(-1, 2)
+
+    best = None
+    events = np.arange(n_events)
+    for level in range(depth + 1):
+        with enable_x64(np.dtype(dtype) == np.float64):
+            best_idx, weight, *momenta = (
+                np.asarray(array)
+                for array in eta_point_solutions(
+                    **device_batch({**batch, "eta_points": eta_points}, dtype)
+                )
+            )
+        # Best point of the level, keeping earlier solutions on ties
+        point = np.argmax(weight, axis=1)
+        level_best = (
+            weight[events, point],
+            eta_points[events, point, 0],
+            eta_points[events, point, 1],
+            best_idx[events, point] % n_b_rows,
+        ) + tuple(array[events, point] for array in momenta)
+        if best is None:
+            best = level_best
+        else:
+            better = level_best[0] > best[0]
+            best = tuple(np.where(better, new, old) for new, old in zip(level_best, best))
+        if level == depth:
+            break
+
+        seeds = np.argsort(-weight, axis=1, kind="stable")[:, :n_seeds]
+        step = step / shrink
+        seed_points = eta_points[events[:, None], seeds]
+        eta_points = seed_points[:, :, None, :] + step * offsets[None, None, :, :]
+        eta_points = np.clip(eta_points, -5, 5).reshape(n_events, -1, 2)
+    return best
+
+
+def perm_bucket(n_perms: int) -> int:
+    """Get padded number of b-jet permutations for an event.
+
+    :param n_perms: Number of b-jet permutations in the event.
+    :type n_perms: int
+    :return: Smallest bucket that fits the permutations. Larger events are padded to
+             a multiple of the largest bucket.
+    :rtype: int
+    """
+    for bucket in PERM_BUCKETS:
+        if n_perms <= bucket:
+            return bucket
+    return -(-n_perms // PERM_BUCKETS[-1]) * PERM_BUCKETS[-1]
+
+
+def reconstruct_bucketed(
+    selected: Dict[str, JaggedArray],
+    leptons: Dict[str, np.ndarray],
+    event_idxs: np.ndarray,
+    random_seed: int,
+    idx_offset: int = 0,
+    source_idx: int = 0,
+    max_rows: int = 1 << 22,
+    block_size: int = None,
+    adaptive: Dict = None,
+    dtype: str = "float32",
+    progress: bool = True,
+) -> list:
+    """Reconstruct events solving many events per compiled call. Events
+    are grouped by their padded number of b-jet permutations and each group is
+    evaluated in batches of a fixed number of events, so that the solver is only
+    compiled once per bucket. Each event draws from its own stream (see event_rng).
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict[str, JaggedArray]
+    :param leptons: Lepton pairs of the same events (see kinematics.dilepton_kinematics).
+    :type leptons: Dict[str, np.ndarray]
+    :param event_idxs: Events to reconstruct, in increasing order.
+    :type event_idxs: np.ndarray
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param idx_offset: Offset added to the event indexes saved in the output, defaults to 0.
+    :type idx_offset: int, optional
+    :param source_idx: Index of the file the events come from, defaults to 0.
+    :type source_idx: int, optional
+    :param max_rows: Approximate number of grid points held in memory at a time,
+                     defaults to 1 << 22.
+    :type max_rows: int, optional
+    :param block_size: Number of (top mass, eta) points per step of the grid scan (see
+                       scan_neutrino_solutions), defaults to None (whole grid at once).
+    :type block_size: int, optional
+    :param adaptive: Settings of the coarse-to-fine eta search (see ADAPTIVE_SEARCH and
+                     adaptive_solutions), defaults to None (full eta grid).
+    :type adaptive: Dict, optional
+    :param dtype: Floating point type of the solver, 'float32' or 'float64',
+                  defaults to 'float32'.
+    :type dtype: str, optional
+    :param progress: Show progress bar over the batches, defaults to True.
+    :type progress: bool, optional
+    :return: Reconstructed particles of each event that passed the reconstruction
+             (see reconstruct_event), in event order.
+    :rtype: list
+    """
+    clock = profiling.clock()
+    # Name of the engine in the profiler's report (see reconstruct_batch)
+    engine = "adaptive" if adaptive is not None else "bucketed" if block_size is None else "scan"
+    buckets = {}
+    for idx in event_idxs:
+        event = event_objects(selected, leptons, idx)
+        if event is None:
+            continue
+        inputs = event_inputs(
+            **event, rng=event_rng(random_seed, idx_offset + idx, source_idx)
+        )
+        if inputs is not None:
+            n_perms = inputs[2].shape[0] // N_SMEARS
+            buckets.setdefault(perm_bucket(n_perms), []).append((idx, inputs))
+    clock.lap("inputs")
+
+    # Number of (top mass, eta) points evaluated at the same time for each event
+    n_grid = M_T_SEARCH.shape[0] * NU_ETA_GRID.shape[0]
+    if adaptive is not None:
+        n_grid = M_T_SEARCH.shape[0] * max(
+            adaptive["n_coarse"] ** 2, adaptive["n_seeds"] * (2 * adaptive["radius"] + 1) ** 2
+        )
+    elif block_size is not None:
+        n_grid = min(block_size, n_grid)
+    batches = []
+    for bucket, events in sorted(buckets.items()):
+        n_b_rows = N_SMEARS * bucket
+        batch_size = max(1, max_rows // (n_grid * n_b_rows))
+        # Small buckets are padded to a power of two to bound the number of shapes
+        batch_size = min(batch_size, 1 << (len(events) - 1).bit_length())
+        for start in range(0, len(events), batch_size):
+            batches.append((bucket, batch_size, events[start:start + batch_size]))
+
+    reconstructed_events = {}
+    for bucket, batch_size, events in tqdm(batches, leave=False, disable=not progress):
+        with profiling.batch([idx_offset + idx for idx, _ in events], source_idx, engine):
+            n_b_rows = N_SMEARS * bucket
+            # Padded rows repeat the first permutation so that every input stays finite
+            padded = {name: np.zeros((batch_size, n_b_rows) + shape) for name, shape in [
+                ("p_b_t", (4,)), ("p_b_tbar", (4,)), ("m_b_t", ()), ("m_b_tbar", ())
+            ]}
+            p_l_t = np.zeros((batch_size, 4))
+            p_l_tbar = np.zeros((batch_size, 4))
+            met_x = np.zeros(batch_size, dtype=np.float32)
+            met_y = np.zeros(batch_size, dtype=np.float32)
+            valid = np.zeros((batch_size, n_b_rows), dtype=bool)
+            for i in range(batch_size):
+                _, inputs = events[min(i, len(events) - 1)]
+                p_l_t[i], p_l_tbar[i] = inputs[0], inputs[1]
+                met_x[i], met_y[i] = inputs[6], inputs[7]
+                n_perms = inputs[2].shape[0] // N_SMEARS
+                for name, array in zip(["p_b_t", "p_b_tbar", "m_b_t", "m_b_tbar"], inputs[2:6]):
+                    array = array.reshape((N_SMEARS, n_perms) + padded[name].shape[2:])
+                    fill = np.repeat(array[:, :1], bucket - n_perms, axis=1)
+                    padded[name][i] = np.concatenate([array, fill], axis=1).reshape(
+                        padded[name].shape[1:]
+                    )
+                valid[i] = np.tile(np.arange(bucket) < n_perms, N_SMEARS) & (i < len(events))
+
+            batch = {
+                "p_l_t": p_l_t,
+                "p_l_tbar": p_l_tbar,
+                **padded,
+                "met_x": met_x,
+                "met_y": met_y,
+                "valid": valid,
+            }
+            clock.lap("padding")
+            if adaptive is None:
+                solutions = dense_solutions(batch, block_size=block_size, dtype=dtype)
+            else:
+                solutions = adaptive_solutions(batch, **adaptive, dtype=dtype)
+            weight, nu_eta_t, nu_eta_tbar, b_row, nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py = (
+                solutions
+            )
+            clock.lap("solve")
+
+            for i, (idx, inputs) in enumerate(events):
+                if weight[i] < MIN_WEIGHT:
+                    continue
+                n_perms = inputs[2].shape[0] // N_SMEARS
+                b_idx = (b_row[i] // bucket) * n_perms + b_row[i] % bucket
+                reconstructed_events[idx] = best_solution(
+                    p_b_t=inputs[2][b_idx],
+                    p_l_t=inputs[0],
+                    nu_t_px=nu_t_px[i],
+                    nu_t_py=nu_t_py[i],
+                    nu_eta_t=nu_eta_t[i],
+                    p_b_tbar=inputs[3][b_idx],
+                    p_l_tbar=inputs[1],
+                    nu_tbar_px=nu_tbar_px[i],
+                    nu_tbar_py=nu_tbar_py[i],
+                    nu_eta_tbar=nu_eta_tbar[i],
+                    idx=idx_offset + idx,
+                    weight=weight[i],
+                )
+            clock.lap("solutions")
+    return [reconstructed_events[idx] for idx in sorted(reconstructed_events)]
+
+
+def root_grid_weights(
+    p_l_t: np.ndarray,
+    p_l_tbar: np.ndarray,
+    p_b_t: np.ndarray,
+    p_b_tbar: np.ndarray,
+    m_b_t: np.ndarray,
+    m_b_tbar: np.ndarray,
+    m_t: np.ndarray,
+    met: np.ndarray,
+    nu_eta: np.ndarray,
+    radius: int = 1,
+) -> np.ndarray:
+    """Weight closed-form solutions like the eta grid engines would: solve the
+    neutrino momenta at the NU_ETA_RANGE points around each solution's neutrino eta
+    and keep the best consistency of their sum with the measured missing ET (see
+    solution_weight). A solution outside the grid's eta range only gets the weight
+    of the closest grid points.
+
+    :param p_l_t: Four-momentum of lepton assigned to top quark, shape (N, 4).
+    :type p_l_t: np.ndarray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark, shape (N, 4).
+    :type p_l_tbar: np.ndarray
+    :param p_b_t: Four-momentum of b-jet assigned to top quark, shape (N, 4).
+    :type p_b_t: np.ndarray
+    :param p_b_tbar: Four-momentum of b-jet assigned to anti-top quark, shape (N, 4).
+    :type p_b_tbar: np.ndarray
+    :param m_b_t: Mass of b-jet assigned to top quark, shape (N, 1).
+    :type m_b_t: np.ndarray
+    :param m_b_tbar: Mass of b-jet assigned to anti-top quark, shape (N, 1).
+    :type m_b_tbar: np.ndarray
+    :param m_t: Top's mass, shape (N,).
+    :type m_t: np.ndarray
+    :param met: Measured missing ET's x and y components, shape (N, 2).
+    :type met: np.ndarray
+    :param nu_eta: Eta of the neutrinos assigned to top and anti-top, shape (N, 2).
+    :type nu_eta: np.ndarray
+    :param radius: Number of grid points on each side of the solution, defaults to 1.
+    :type radius: int, optional
+    :return: Weight of each solution, shape (N,).
+    :rtype: np.ndarray
+    """
+    step = NU_ETA_RANGE[1] - NU_ETA_RANGE[0]
+    nearest = np.rint((nu_eta - NU_ETA_RANGE[0]) / step).astype(np.int64)
+    offsets = np.arange(-radius, radius + 1)
+    offsets = np.array(np.meshgrid(offsets, offsets)).T.reshape(-1, 2)
+    eta_idx = np.clip(nearest[:, None, :] + offsets, 0, len(NU_ETA_RANGE) - 1)
+    nu_etas = NU_ETA_RANGE[eta_idx].reshape(-1, 2)
+
+    def repeat(array):
+        return np.repeat(array, len(offsets), axis=0)
+
+    with enable_x64():
+        nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py, real = (
+            np.asarray(array)
+            for array in get_neutrino_momentum_real(
+                nu_eta_t=nu_etas[:, 0:1],
+                p_l_t=repeat(p_l_t),
+                p_b_t=repeat(p_b_t),
+                m_b_t=repeat(m_b_t),
+                nu_eta_tbar=nu_etas[:, 1:],
+                p_l_tbar=repeat(p_l_tbar),
+                p_b_tbar=repeat(p_b_tbar),
+                m_b_tbar=repeat(m_b_tbar),
+                m_t_val=repeat(m_t.reshape(-1, 1)),
+            )
+        )
+    # Solutions come in 4 blocks of the (solution, grid point) rows
+    met = np.tile(repeat(met), (4, 1))
+    weights = solution_weight(
+        met_x=met[:, 0:1],
+        met_y=met[:, 1:2],
+        neutrino_px=nu_t_px + nu_tbar_px,
+        neutrino_py=nu_t_py + nu_tbar_py,
+    )
+    weights = np.where(real, weights, 0)
+    return weights.reshape(4, len(nu_eta), len(offsets)).max(axis=(0, 2))
+
+
+def reconstruct_analytic(
+    selected: Dict[str, JaggedArray],
+    leptons: Dict[str, np.ndarray],
+    event_idxs: np.ndarray,
+    random_seed: int,
+    idx_offset: int = 0,
+    source_idx: int = 0,
+    events_per_call: int = 1024,
+    progress: bool = True,
+) -> list:
+    """Reconstruct events solving the neutrino momenta in closed form (see
+    analytic_solver.solve_dilepton) for every top mass, smear and b-jet permutation,
+    with the measured missing ET as the grid engines. Every solution is weighted by
+    the missing ET consistency the eta grid reaches around it (see
+    root_grid_weights), so that MIN_WEIGHT has the same meaning as in the grid
+    engines. Among solutions with the highest weight, the one with the lowest ttbar
+    invariant mass is kept.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict[str, JaggedArray]
+    :param leptons: Lepton pairs of the same events (see kinematics.dilepton_kinematics).
+    :type leptons: Dict[str, np.ndarray]
+    :param event_idxs: Events to reconstruct, in increasing order.
+    :type event_idxs: np.ndarray
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param idx_offset: Offset added to the event indexes saved in the output, defaults to 0.
+    :type idx_offset: int, optional
+    :param source_idx: Index of the file the events come from, defaults to 0.
+    :type source_idx: int, optional
+    :param events_per_call: Number of events solved at the same time, defaults to 1024.
+    :type events_per_call: int, optional
+    :param progress: Show progress bar over the events, defaults to True.
+    :type progress: bool, optional
+    :return: Reconstructed particles of each event that passed the reconstruction
+             (see reconstruct_event), in event order.
+    :rtype: list
+    """
+    reconstructed_events = []
+    starts = range(0, len(event_idxs), events_per_call)
+    for start in tqdm(starts, leave=False, disable=not progress):
+        clock = profiling.clock()
+        rows = {
+            name: [] for name in ["p_l_t", "p_l_tbar", "p_b_t", "p_b_tbar", "m_b_t", "m_b_tbar"]
+        }
+        events = []
+        for idx in event_idxs[start:start + events_per_call]:
+            event = event_objects(selected, leptons, idx)
+            if event is None:
+                continue
+            inputs = event_inputs(
+                **event, rng=event_rng(random_seed, idx_offset + idx, source_idx)
+            )
+            if inputs is None:
+                continue
+            p_l_t, p_l_tbar, p_b_t, p_b_tbar, m_b_t, m_b_tbar, met_x, met_y = inputs
+            rows["p_l_t"].append(np.tile(p_l_t, (len(p_b_t), 1)))
+            rows["p_l_tbar"].append(np.tile(p_l_tbar, (len(p_b_t), 1)))
+            rows["p_b_t"].append(p_b_t)
+            rows["p_b_tbar"].append(p_b_tbar)
+            rows["m_b_t"].append(m_b_t)
+            rows["m_b_tbar"].append(m_b_tbar)
+            events.append((idx, inputs, len(p_b_t), np.array([met_x, met_y])))
+        clock.lap("inputs")
+        if not events:
+            continue
+
+        with profiling.batch(
+            [idx_offset + event[0] for event in events], source_idx, "analytic"
+        ):
+            # Rows are (event, b-jet row) for every top mass
+            n_masses = M_T_SEARCH.shape[0]
+            rows = {
+                name: np.tile(np.concatenate(arrays), (n_masses, 1))
+                for name, arrays in rows.items()
+            }
+            n_b_rows = np.array([event[2] for event in events])
+            event_rows = np.repeat(np.arange(len(events)), n_b_rows)
+            met = np.array([event[3] for event in events])[event_rows]
+            met = np.tile(met, (n_masses, 1))
+            m_t = np.repeat(M_T_SEARCH, len(event_rows))
+            clock.lap("grid")
+
+            p_nu_t, p_nu_tbar, valid = analytic_solver.solve_dilepton(
+                p_l_t=rows["p_l_t"],
+                p_l_tbar=rows["p_l_tbar"],
+                p_b_t=rows["p_b_t"],
+                p_b_tbar=rows["p_b_tbar"],
+                met_x=met[:, 0],
+                met_y=met[:, 1],
+                m_t=m_t,
+                m_w=M_W,
+            )
+            clock.lap("solve")
+            row_idx, solution_idx = np.nonzero(valid)
+            nu_eta = np.stack(
+                [
+                    kinematics.eta(p_nu_t[row_idx, solution_idx]),
+                    kinematics.eta(p_nu_tbar[row_idx, solution_idx]),
+                ],
+                axis=1,
+            )
+            weights = np.zeros(valid.shape)
+            weights[row_idx, solution_idx] = root_grid_weights(
+                p_l_t=rows["p_l_t"][row_idx],
+                p_l_tbar=rows["p_l_tbar"][row_idx],
+                p_b_t=rows["p_b_t"][row_idx],
+                p_b_tbar=rows["p_b_tbar"][row_idx],
+                m_b_t=rows["m_b_t"][row_idx],
+                m_b_tbar=rows["m_b_tbar"][row_idx],
+                m_t=m_t[row_idx],
+                met=met[row_idx],
+                nu_eta=nu_eta,
+            )
+            p_ttbar = (
+                (rows["p_l_t"] + rows["p_b_t"] + rows["p_l_tbar"] + rows["p_b_tbar"])[:, None, :]
+                + p_nu_t
+                + p_nu_tbar
+            )
+            m_ttbar = np.sqrt(np.abs(analytic_solver.minkowski_square(p_ttbar.reshape(-1, 4))))
+
+            # Highest weight, then lowest ttbar mass, of each event
+            solution_events = np.tile(event_rows, n_masses)[row_idx]
+            order = np.lexsort(
+                (
+                    m_ttbar.reshape(valid.shape)[row_idx, solution_idx],
+                    -weights[row_idx, solution_idx],
+                    solution_events,
+                )
+            )
+            first = np.unique(solution_events[order], return_index=True)[1]
+            clock.lap("weighting")
+            for best in order[first]:
+                row, solution = row_idx[best], solution_idx[best]
+                weight = np.float32(weights[row, solution])
+                if weight < MIN_WEIGHT:
+                    continue
+                idx, inputs, _, _ = events[solution_events[best]]
+                p_nu = [p_nu_t[row, solution], p_nu_tbar[row, solution]]
+                eta = nu_eta[best]
+                reconstructed_events.append(
+                    best_solution(
+                        p_b_t=rows["p_b_t"][row],
+                        p_l_t=inputs[0],
+                        nu_t_px=p_nu[0][0],
+                        nu_t_py=p_nu[0][1],
+                        nu_eta_t=eta[0],
+                        p_b_tbar=rows["p_b_tbar"][row],
+                        p_l_tbar=inputs[1],
+                        nu_tbar_px=p_nu[1][0],
+                        nu_tbar_py=p_nu[1][1],
+                        nu_eta_tbar=eta[1],
+                        idx=idx_offset + idx,
+                        weight=weight,
+                    )
+                )
+            clock.lap("solutions")
+    return reconstructed_events
+
+
+def device_four_momentum(
+    pt: jnp.DeviceArray, phi: jnp.DeviceArray, eta: jnp.DeviceArray, mass: jnp.DeviceArray
+) -> jnp.DeviceArray:
+    """Same as kinematics.four_momentum for arrays of any shape that live on the device.
+
+    :param pt: Transverse momentum.
+    :type pt: jnp.DeviceArray
+    :param phi: Azimuth angle.
+    :type phi: jnp.DeviceArray
+    :param eta: Pseudorapidity.
+    :type eta: jnp.DeviceArray
+    :param mass: Particle's mass.
+    :type mass: jnp.DeviceArray
+    :return: Four momentum in (x, y, z, E) coordinates, along a new last axis.
+    :rtype: jnp.DeviceArray
+    """
+    pt = jnp.abs(pt)
+    px = pt * jnp.cos(phi)
+    py = pt * jnp.sin(phi)
+    pz = pt * jnp.sinh(eta)
+    E = jnp.sqrt(px ** 2 + py ** 2 + pz ** 2 + mass ** 2)
+    return jnp.stack([px, py, pz, E], axis=-1)
 
-        recos = {name: [] for name in reco_names}
 
+@partial(jit, static_argnames="block_size")
+def reconstruct_padded_events(
+    p_l_t: jnp.DeviceArray,
+    p_l_tbar: jnp.DeviceArray,
+    bjets_pt: jnp.DeviceArray,
+    bjets_phi: jnp.DeviceArray,
+    bjets_eta: jnp.DeviceArray,
+    bjets_mass: jnp.DeviceArray,
+    n_bjets: jnp.DeviceArray,
+    smears: jnp.DeviceArray,
+    met: jnp.DeviceArray,
+    met_phi: jnp.DeviceArray,
+    valid: jnp.DeviceArray,
+    block_size: int = None,
+) -> Dict[str, jnp.DeviceArray]:
+    """Reconstruct a batch of padded events in a single compiled program: b-jet
+    smearing and permutations (as in event_inputs), the neutrino solutions on the full
+    grid, weighting and the choice of the best solution (as in reconstruct_event). Only
+    the best solutions leave the device.
+
+    :param p_l_t: Four-momentum of lepton assigned to top quark
+                  (see kinematics.dilepton_kinematics), shape (events, 4).
+    :type p_l_t: jnp.DeviceArray
+    :param p_l_tbar: Four-momentum of lepton assigned to anti-top quark, shape (events, 4).
+    :type p_l_tbar: jnp.DeviceArray
+    :param bjets_pt: PT of b-jets padded with the first b-jet, shape (events, b-jets).
+    :type bjets_pt: jnp.DeviceArray
+    :param bjets_phi: Phi of b-jets, shape (events, b-jets).
+    :type bjets_phi: jnp.DeviceArray
+    :param bjets_eta: Eta of b-jets, shape (events, b-jets).
+    :type bjets_eta: jnp.DeviceArray
+    :param bjets_mass: Mass of b-jets, shape (events, b-jets).
+    :type bjets_mass: jnp.DeviceArray
+    :param n_bjets: Number of b-jets, shape (events,).
+    :type n_bjets: jnp.DeviceArray
+    :param smears: Standard normal draws of each event's stream used to smear the b-jets'
+                   pt, shape (events, N_SMEARS, b-jets).
+    :type smears: jnp.DeviceArray
+    :param met: MET, shape (events,).
+    :type met: jnp.DeviceArray
+    :param met_phi: Phi of MET, shape (events,).
+    :type met_phi: jnp.DeviceArray
+    :param valid: False for padded events, shape (events,).
+    :type valid: jnp.DeviceArray
+    :param block_size: Number of (top mass, eta) points per step of the grid scan (see
+                       scan_neutrino_solutions), defaults to None (whole grid at once).
+    :type block_size: int, optional
+    :return: Reconstructed particles and weight of each event (see RECO_NAMES, without
+             idx) and whether the event was reconstructed ('accepted').
+    :rtype: Dict[str, jnp.DeviceArray]
+    """
+    dtype = bjets_pt.dtype
+    n_events, n_bjets_max = bjets_pt.shape
+
+    # B-jets: rows ordered by (smear, permutation) as in event_inputs, with numpy's
+    # normal(pt, pt * resolution) written in terms of standard normal draws
+    pairs = np.array(list(permutations(range(n_bjets_max), 2)))
+    n_b_rows = N_SMEARS * len(pairs)
+    smeared_pt = bjets_pt[:, None, :] + (bjets_pt * BJET_PT_RESOLUTION)[:, None, :] * smears
+    p_bjets = device_four_momentum(
+        smeared_pt, bjets_phi[:, None, :], bjets_eta[:, None, :], bjets_mass[:, None, :]
+    )
+    p_b_t = p_bjets[:, :, pairs[:, 0]].reshape(n_events, n_b_rows, 4)
+    p_b_tbar = p_bjets[:, :, pairs[:, 1]].reshape(n_events, n_b_rows, 4)
+    m_b_t = jnp.tile(bjets_mass[:, pairs[:, 0]], (1, N_SMEARS))
+    m_b_tbar = jnp.tile(bjets_mass[:, pairs[:, 1]], (1, N_SMEARS))
+    pair_valid = jnp.all(jnp.asarray(pairs)[None] < n_bjets[:, None, None], axis=2)
+    event_valid = valid & (n_bjets >= 2)
+    rows_valid = jnp.tile(pair_valid, (1, N_SMEARS)) & event_valid[:, None]
+
+    inputs = {
+        "p_l_t": p_l_t,
+        "p_l_tbar": p_l_tbar,
+        "p_b_t": p_b_t,
+        "p_b_tbar": p_b_tbar,
+        "m_b_t": m_b_t,
+        "m_b_tbar": m_b_tbar,
+        "met_x": met * jnp.cos(met_phi),
+        "met_y": met * jnp.sin(met_phi),
+        "valid": rows_valid,
+    }
+    if block_size is None:
+        solutions = best_neutrino_solutions(**inputs)
+    else:
+        solutions = scan_neutrino_solutions(**inputs, block_size=block_size)
+    best_idx, weight, nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py = solutions
+
+    # Best solution's index in the (combination, mass, eta, b-jet row) layout
+    eta_grid = jnp.asarray(NU_ETA_GRID, dtype=dtype)
+    eta_idx = (best_idx // n_b_rows) % NU_ETA_GRID.shape[0]
+    b_row = best_idx % n_b_rows
+
+    def neutrino(px, py, eta):
+        pt = jnp.sqrt(px ** 2 + py ** 2)
+        pz = pt * jnp.sinh(eta)
+        return jnp.stack([px, py, pz, jnp.sqrt(pt ** 2 + pz ** 2)], axis=-1)
+
+    def best_row(p_b):
+        return jnp.take_along_axis(p_b, b_row[:, None, None], axis=1)[:, 0]
+
+    p_nu_t = neutrino(nu_t_px, nu_t_py, eta_grid[eta_idx, 0])
+    p_nu_tbar = neutrino(nu_tbar_px, nu_tbar_py, eta_grid[eta_idx, 1])
+    p_b_t = best_row(p_b_t)
+    p_b_tbar = best_row(p_b_tbar)
+    return {
+        "p_top": p_b_t + p_l_t + p_nu_t,
+        "p_l_t": p_l_t,
+        "p_b_t": p_b_t,
+        "p_nu_t": p_nu_t,
+        "p_tbar": p_b_tbar + p_l_tbar + p_nu_tbar,
+        "p_l_tbar": p_l_tbar,
+        "p_b_tbar": p_b_tbar,
+        "p_nu_tbar": p_nu_tbar,
+        "weight": weight[:, None],
+        "accepted": event_valid & (weight >= MIN_WEIGHT),
+    }
+
+
+def bjets_bucket(n_bjets: int) -> int:
+    """Get padded number of b-jets of an event for the compiled engine.
+
+    :param n_bjets: Number of b-jets in the event.
+    :type n_bjets: int
+    :return: Number of b-jets if their permutations are one of PERM_BUCKETS. Larger
+             events are padded to a power of two.
+    :rtype: int
+    """
+    n_bjets = int(n_bjets)
+    if n_bjets * (n_bjets - 1) in PERM_BUCKETS:
+        return n_bjets
+    return 1 << (n_bjets - 1).bit_length()
+
+
+def padded_objects(array: JaggedArray, event_idxs: np.ndarray, n_objects: int) -> np.ndarray:
+    """Get the first objects' values of some events in a dense array. Missing objects
+    repeat the event's first object, so that every input of the solver stays finite.
+
+    :param array: Objects' values in each event.
+    :type array: JaggedArray
+    :param event_idxs: Events to take.
+    :type event_idxs: np.ndarray
+    :param n_objects: Number of objects kept per event.
+    :type n_objects: int
+    :return: Values, shape (events, n_objects). Zero for events without objects.
+    :rtype: np.ndarray
+    """
+    counts = array.counts[event_idxs]
+    positions = np.arange(n_objects)[None, :]
+    positions = np.where(positions < counts[:, None], positions, 0)
+    flat_idx = array.starts[event_idxs][:, None] + positions
+    if len(array.content) == 0:
+        return np.zeros(flat_idx.shape, dtype=array.content.dtype)
+    values = array.content[np.minimum(flat_idx, len(array.content) - 1)]
+    return np.where(counts[:, None] > 0, values, 0)
+
+
+def reconstruct_compiled(
+    selected: Dict[str, JaggedArray],
+    leptons: Dict[str, np.ndarray],
+    event_idxs: np.ndarray,
+    random_seed: int,
+    idx_offset: int = 0,
+    source_idx: int = 0,
+    max_rows: int = 1 << 22,
+    block_size: int = None,
+    dtype: str = "float32",
+    progress: bool = True,
+) -> Dict[str, np.ndarray]:
+    """Reconstruct events with the whole reconstruction of a batch of events in one
+    compiled call (see reconstruct_padded_events). Events are grouped by their padded
+    number of b-jets (see bjets_bucket), and every batch of a group has the same size,
+    so each group is compiled once. The host only draws the smears from each event's
+    stream (see event_rng), and the smeared b-jets and missing ET are computed on the
+    device in the solver's dtype. The results are identical to reconstruct_bucketed's
+    in float64, and within float32 rounding otherwise.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict[str, JaggedArray]
+    :param leptons: Lepton pairs of the same events (see kinematics.dilepton_kinematics).
+    :type leptons: Dict[str, np.ndarray]
+    :param event_idxs: Events to reconstruct, in increasing order.
+    :type event_idxs: np.ndarray
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param idx_offset: Offset added to the event indexes saved in the output, defaults to 0.
+    :type idx_offset: int, optional
+    :param source_idx: Index of the file the events come from, defaults to 0.
+    :type source_idx: int, optional
+    :param max_rows: Approximate number of grid points held in memory at a time,
+                     defaults to 1 << 22.
+    :type max_rows: int, optional
+    :param block_size: Number of (top mass, eta) points per step of the grid scan (see
+                       scan_neutrino_solutions), defaults to None (whole grid at once).
+    :type block_size: int, optional
+    :param dtype: Floating point type of the solver, 'float32' or 'float64',
+                  defaults to 'float32'.
+    :type dtype: str, optional
+    :param progress: Show progress bar over the batches, defaults to True.
+    :type progress: bool, optional
+    :return: Reconstructed quantities of the events that passed the reconstruction,
+             in event order.
+    :rtype: Dict[str, np.ndarray]
+    """
+    clock = profiling.clock()
+    n_bjets = selected["bjets_pt"].counts[event_idxs]
+    # Events without a lepton pair or with less than two b-jets can't be reconstructed
+    passed = leptons["valid"][event_idxs] & (n_bjets >= 2)
+    event_idxs = event_idxs[passed]
+    n_bjets = n_bjets[passed]
+
+    n_grid = M_T_SEARCH.shape[0] * NU_ETA_GRID.shape[0]
+    if block_size is not None:
+        n_grid = min(block_size, n_grid)
+    n_bjets_padded = np.array([bjets_bucket(int(n)) for n in n_bjets], dtype=int)
+    batches = []
+    for n_bjets_max in np.unique(n_bjets_padded):
+        bucket_idxs = event_idxs[n_bjets_padded == n_bjets_max]
+        n_b_rows = N_SMEARS * n_bjets_max * (n_bjets_max - 1)
+        # The last batch of a bucket is padded too, so that it has a single shape
+        batch_size = max(1, max_rows // (n_grid * n_b_rows))
+        for start in range(0, len(bucket_idxs), batch_size):
+            batches.append((n_bjets_max, batch_size, bucket_idxs[start:start + batch_size]))
+
+    outputs = {name: [] for name in RECO_NAMES}
+    for n_bjets_max, batch_size, batch_idxs in tqdm(batches, leave=False, disable=not progress):
+        with profiling.batch(idx_offset + batch_idxs, source_idx, "compiled"):
+            # Padded events repeat the last event
+            padded_idxs = np.concatenate(
+                [batch_idxs, np.repeat(batch_idxs[-1:], batch_size - len(batch_idxs))]
+            )
+            batch = {
+                "p_l_t": leptons["p_l_t"][padded_idxs],
+                "p_l_tbar": leptons["p_l_tbar"][padded_idxs],
+                "valid": np.arange(batch_size) < len(batch_idxs),
+            }
+            for name in ["pt", "phi", "eta", "mass"]:
+                batch[f"bjets_{name}"] = padded_objects(
+                    selected[f"bjets_{name}"], padded_idxs, n_bjets_max
+                )
+            batch["n_bjets"] = selected["bjets_pt"].counts[padded_idxs].astype(np.int32)
+            batch["met"] = selected["met"][padded_idxs].flatten()
+            batch["met_phi"] = selected["met_phi"][padded_idxs].flatten()
+            # Same draws as rng.normal(pt, pt * BJET_PT_RESOLUTION) in event_inputs, with
+            # padded b-jets left unsmeared
+            batch["smears"] = np.zeros((batch_size, N_SMEARS, n_bjets_max))
+            for i, (idx, n_event_bjets) in enumerate(zip(padded_idxs, batch["n_bjets"])):
+                batch["smears"][i, :, :n_event_bjets] = event_rng(
+                    random_seed, idx_offset + idx, source_idx
+                ).standard_normal((N_SMEARS, n_event_bjets))
+            clock.lap("inputs")
+
+        with enable_x64(np.dtype(dtype) == np.float64):
+            solutions = reconstruct_padded_events(
+                **device_batch(batch, dtype), block_size=block_size
+            )
+            solutions = {name: np.asarray(array) for name, array in solutions.items()}
+        clock.lap("solve")
+
+        accepted = solutions.pop("accepted")
+        for name, array in solutions.items():
+            outputs[name].append(array[accepted].astype(np.float64))
+        outputs["idx"].append(idx_offset + padded_idxs[accepted].reshape(-1, 1))
+        clock.lap("solutions")
+
+    if not batches:
+        return {
+            name: np.empty((0, RECO_WIDTHS[name]), dtype=int if name == "idx" else float)
+            for name in RECO_NAMES
+        }
+    order = np.argsort(np.concatenate(outputs["idx"])[:, 0], kind="stable")
+    return {name: np.concatenate(arrays)[order] for name, arrays in outputs.items()}
+
+
+def reconstruct_batch(
+    selected: Dict[str, JaggedArray],
+    init_idx: int,
+    end_idx: int,
+    random_seed: int,
+    idx_offset: int = 0,
+    source_idx: int = 0,
+    progress: bool = True,
+    engine: str = "event",
+    engine_options: Dict = None,
+    preselect: bool = True,
+    leptons: Dict[str, np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    """Reconstruct a range of events from their selected objects. Each event draws
+    from its own random stream (see event_rng), so the output is the same for any
+    split of the events, and skipping events doesn't change the others.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict[str, JaggedArray]
+    :param init_idx: First event in the range.
+    :type init_idx: int
+    :param end_idx: Event after the last one in the range.
+    :type end_idx: int
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param idx_offset: Offset added to the event indexes saved in the output, defaults to 0.
+    :type idx_offset: int, optional
+    :param source_idx: Index of the file the events come from, defaults to 0.
+    :type source_idx: int, optional
+    :param progress: Show progress bar over the events, defaults to True.
+    :type progress: bool, optional
+    :param engine: 'event' solves one event per call (reconstruct_event), 'bucketed'
+                   solves batches of events (reconstruct_bucketed), 'scan' solves
+                   batches of events walking the grid in blocks and 'adaptive' solves
+                   batches of events with a coarse-to-fine eta search. 'analytic'
+                   solves the neutrino momenta in closed form (reconstruct_analytic).
+                   'compiled' runs the whole reconstruction of batches of events on
+                   the device (reconstruct_compiled), defaults to 'event'.
+    :type engine: str, optional
+    :param engine_options: Keyword arguments for the engine (e.g., block_size for
+                           'scan', adaptive settings for 'adaptive' or the solver's
+                           dtype for the grid engines), defaults to None.
+    :type engine_options: Dict, optional
+    :param preselect: Only reconstruct events that pass preselect_events, defaults to True.
+    :type preselect: bool, optional
+    :param leptons: Lepton pairs of the events in selected (see
+                    kinematics.dilepton_kinematics), defaults to None (paired for the
+                    range).
+    :type leptons: Dict[str, np.ndarray], optional
+    :return: Reconstructed quantities for the events that passed the reconstruction.
+    :rtype: Dict[str, np.ndarray]
+    """
+    engine_options = engine_options or {}
+    # Events are indexed from init_idx from here on
+    selected = {name: column[init_idx:end_idx] for name, column in selected.items()}
+    if leptons is None:
+        with profiling.stage("leptons"):
+            leptons = kinematics.dilepton_kinematics(selected)
+    else:
+        leptons = {name: array[init_idx:end_idx] for name, array in leptons.items()}
+    idx_offset += init_idx
+    event_idxs = np.arange(end_idx - init_idx)
+    if preselect:
+        with profiling.stage("preselection"):
+            passed = preselect_events(selected, leptons=leptons)
+        event_idxs = event_idxs[passed]
+
+    reco_arrays = None
+    if engine == "event":
+        reconstructed_events = []
+        for idx in tqdm(event_idxs, leave=False, disable=not progress):
+            event = event_objects(selected, leptons, idx)
+            if event is None:
+                continue
+            with profiling.event(idx_offset + idx, source_idx):
+                reconstructed_events.append(
+                    reconstruct_event(
+                        **event,
+                        idx=idx_offset + idx,
+                        rng=event_rng(random_seed, idx_offset + idx, source_idx),
+                        **engine_options,
+                    )
+                )
+    elif engine in ("bucketed", "scan", "adaptive"):
+        if engine == "scan":
+            engine_options = {"block_size": SCAN_BLOCK_SIZE, **engine_options}
+        elif engine == "adaptive":
+            engine_options = {
+                **engine_options,
+                "adaptive": {**ADAPTIVE_SEARCH, **engine_options.get("adaptive", {})},
+            }
+        reconstructed_events = reconstruct_bucketed(
+            selected,
+            leptons,
+            event_idxs,
+            random_seed,
+            idx_offset=idx_offset,
+            source_idx=source_idx,
+            progress=progress,
+            **engine_options,
+        )
+    elif engine == "analytic":
+        reconstructed_events = reconstruct_analytic(
+            selected,
+            leptons,
+            event_idxs,
+            random_seed,
+            idx_offset=idx_offset,
+            source_idx=source_idx,
+            progress=progress,
+            **engine_options,
+        )
+    elif engine == "compiled":
+        reco_arrays = reconstruct_compiled(
+            selected,
+            leptons,
+            event_idxs,
+            random_seed,
+            idx_offset=idx_offset,
+            source_idx=source_idx,
+            progress=progress,
+            **engine_options,
+        )
+    else:
+        raise ValueError(f"Unknown reconstruction engine {engine}")
+
+    if reco_arrays is None:
+        recos = {name: [] for name in RECO_NAMES}
         for event in reconstructed_events:
             if event is None:
                 continue
-            for name, reco_p in zip(reco_names, event):
+            for name, reco_p in zip(RECO_NAMES, event):
                 recos[name].append(reco_p.reshape(1, -1))
 
         reco_arrays = {
-            name: np.concatenate(reco_list, axis=0) for name, reco_list in recos.items()
+            name: (
+                np.concatenate(reco_list, axis=0)
+                if reco_list
+                else np.empty((0, RECO_WIDTHS[name]), dtype=int if name == "idx" else float)
+            )
+            for name, reco_list in recos.items()
         }
+    profiling.count_events(end_idx - init_idx, len(reco_arrays["idx"]))
+    return reco_arrays
+
+
+def reconstruct_ranges(
+    selected: Dict[str, JaggedArray],
+    ranges: List[Tuple[int, int]],
+    random_seed: int,
+    n_workers: int = 1,
+    engine: str = "event",
+    engine_options: Dict = None,
+    preselect: bool = True,
+) -> Iterator[Dict[str, np.ndarray]]:
+    """Reconstruct several ranges of events, optionally in a process pool. Outputs
+    are identical for any number of workers since every event has its own random
+    stream.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict[str, JaggedArray]
+    :param ranges: First event and event after the last one of each range.
+    :type ranges: List[Tuple[int, int]]
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param n_workers: Number of worker processes, defaults to 1 (no pool).
+    :type n_workers: int, optional
+    :param engine: Reconstruction engine (see reconstruct_batch), defaults to 'event'.
+    :type engine: str, optional
+    :param engine_options: Keyword arguments for the engine (see reconstruct_batch),
+                           defaults to None.
+    :type engine_options: Dict, optional
+    :param preselect: Only reconstruct events that pass preselect_events, defaults to True.
+    :type preselect: bool, optional
+    :yield: Reconstructed quantities of each range, in the order of the ranges.
+    :rtype: Iterator[Dict[str, np.ndarray]]
+    """
+    # Leptons of all the events are paired at once
+    with profiling.stage("leptons"):
+        leptons = kinematics.dilepton_kinematics(selected)
+    if n_workers <= 1:
+        for init_idx, end_idx in ranges:
+            yield reconstruct_batch(
+                selected,
+                init_idx,
+                end_idx,
+                random_seed,
+                engine=engine,
+                engine_options=engine_options,
+                preselect=preselect,
+                leptons=leptons,
+            )
+        return
+
+    # Workers profile themselves if this process is profiled, and their measurements
+    # are merged into its profiler
+    profiler = profiling.active()
+    task = reconstruct_batch
+    if profiler is not None:
+        task = partial(profiling.run_profiled, reconstruct_batch)
+
+    # JAX is multithreaded, so workers are spawned instead of forked. Each worker
+    # only receives the events of its range.
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=get_context("spawn")) as pool:
+        futures = [
+            pool.submit(
+                task,
+                {name: column[init_idx:end_idx] for name, column in selected.items()},
+                0,
+                end_idx - init_idx,
+                random_seed,
+                idx_offset=init_idx,
+                progress=False,
+                engine=engine,
+                engine_options=engine_options,
+                preselect=preselect,
+                leptons={name: array[init_idx:end_idx] for name, array in leptons.items()},
+            )
+            for init_idx, end_idx in ranges
+        ]
+        for future in futures:
+            if profiler is None:
+                yield future.result()
+                continue
+            reco_arrays, worker_profiler = future.result()
+            profiler.merge(worker_profiler)
+            yield reco_arrays
+
+
+if __name__ == "__main__":
+    process_name = "SM_spin-OFF_100k"
+    random_seed = 0
 
-        for name, p_array in reco_arrays.items():
-            with open(
-                os.path.join(output_dir, f"{name}_batch_{batch_idx}.npy"), "wb"
-            ) as f:
-                np.save(f, p_array)
-        del recos, reco_arrays, reconstructed_events
+    sm_path = os.path.join(
+        "../mg5_data",
+        f"{process_name}_{random_seed}",
+        "Events/run_01_decayed_1/tag_1_delphes_events.root"
+    )
+    # All batches are appended to one store (see processing.reco_store)
+    output_dir = f"../reconstructed_events/{process_name}_{random_seed}"
+    selection_dir = "../selected_events"
+    n_batches = 10
+    # Number of entries read at a time. If None, the whole file is loaded in memory
+    chunk_size = None
+    # 'event' solves one event per call, 'bucketed' solves batches of events and 'scan'
+    # solves batches of events walking the grid in blocks with bounded memory. 'adaptive'
+    # refines a coarse eta grid around the best points (see ADAPTIVE_SEARCH) and 'analytic'
+    # solves the neutrino momenta in closed form. 'compiled' runs the whole reconstruction
+    # of batches of events on the device
+    engine = "event"
+    # Keyword arguments for the engine (e.g., {"dtype": "float64"} or {"block_size": 64}
+    # for 'scan'), see reconstruct_batch
+    engine_options = {}
+    # Only reconstruct events that can have a solution (see preselect_events)
+    preselect = True
+    # Number of processes reconstructing batches at the same time
+    n_workers = 1
+    # Skip batches completed by a previous run with the same settings
+    resume = True
+    # Save time per stage, throughput and slowest events in output_dir/profile.json
+    profile = True
+    if profile:
+        profiling.enable()
+
+    metadata = {
+        "source": os.path.abspath(sm_path),
+        "random_seed": random_seed,
+        "n_batches": n_batches,
+        "chunk_size": chunk_size,
+        "engine": engine,
+        "engine_options": engine_options,
+        "preselect": preselect,
+        "grid": grid_settings(),
+    }
+    if resume:
+        header = reco_store.open_store(output_dir, metadata)
+    else:
+        header = reco_store.create_store(output_dir, metadata)
+
+    if chunk_size is None:
+        print("Applying selection criteria...", end="\r")
+        # Apply ATLAS selection criteria, or load them if the same file and cuts
+        # were already processed
+        with profiling.stage("selection"):
+            selected = selection_cache.load_or_select(sm_path, cache_dir=selection_dir)
+        print("Applying selection criteria...Done")
+
+        step_size = len(selected["muon_phi"]) // n_batches
+        ranges = [
+            (batch_idx * step_size, (batch_idx + 1) * step_size) for batch_idx in range(n_batches)
+        ]
+    else:
+        sm_events = uproot.open(sm_path)["Delphes"]
+        n_batches = -(-len(sm_events) // chunk_size)
+        ranges = [
+            (entrystart, min(entrystart + chunk_size, len(sm_events)))
+            for entrystart in range(0, len(sm_events), chunk_size)
+        ]
+    # Batches are only recorded in the header once all their rows were written
+    completed = {chunk["batch_idx"] for chunk in header["chunks"]}
+    pending = [batch_idx for batch_idx in range(n_batches) if batch_idx not in completed]
+    print(f"{n_batches - len(pending)} of {n_batches} batches already completed")
+
+    if chunk_size is None:
+        batches = reconstruct_ranges(
+            selected,
+            [ranges[batch_idx] for batch_idx in pending],
+            random_seed,
+            n_workers=n_workers,
+            engine=engine,
+            engine_options=engine_options,
+            preselect=preselect,
+        )
+    else:
+        # Stream the file so that only one chunk of events is held in memory
+        def chunk_batches():
+            for entrystart, chunk_events in iterate_chunks(sm_events, chunk_size=chunk_size):
+                if entrystart // chunk_size not in pending:
+                    continue
+                # Branches are read from the file (the "read" stage) when the selection needs them
+                with profiling.stage("selection"):
+                    chunk_selected = event_selection.select_objects(chunk_events)
+                yield reconstruct_batch(
+                    chunk_selected,
+                    0,
+                    len(chunk_events),
+                    random_seed,
+                    idx_offset=entrystart,
+                    engine=engine,
+                    engine_options=engine_options,
+                    preselect=preselect,
+                )
+
+        batches = chunk_batches()
+    for batch_idx, reco_arrays in zip(pending, tqdm(batches, total=len(pending))):
+        init_idx, end_idx = ranges[batch_idx]
+        with profiling.stage("write"):
+            reco_store.append_chunk(
+                output_dir,
+                reco_arrays,
+                info={"batch_idx": batch_idx, "init_idx": init_idx, "end_idx": end_idx},
+            )
+        del reco_arrays
+    profiling.save_report(
+        os.path.join(output_dir, "profile.json"), engine=engine, n_workers=n_workers
+    )
@@ -0,0 +1,393 @@
+import sys
+import json
+import time
+import uproot
+import numpy as np
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Tuple
+
+sys.path.append("..")
+from processing import event_selection, kinematics, lorentz, profiling, synthetic  # noqa: E402
+from processing.branch_cache import BranchCache  # noqa: E402
+import naive_reco  # noqa: E402
+from ttbar_dilepton import (  # noqa: E402
+    ENGINES,
+    MIN_WEIGHT,
+    RECO_NAMES,
+    event_objects,
+    event_rng,
+    preselect_events,
+    reconstruct_batch,
+)
+
+
+# Largest difference with the reference of each engine: weight of the best solution,
+# neutrino momenta relative to the reference neutrino's energy and ttbar mass relative to
+# the reference one, and fraction of events allowed to differ by more. The likelihood is
+# flat near its maximum, so engines that don't evaluate the same grid points can find
+# distant solutions with the same weight, and their momenta aren't compared (None).
+# The analytic engine weights its exact solutions with the grid points around them,
+# which the reference evaluates too, but its momenta don't lie on the grid. Engines that
+# evaluate the full grid are validated in float64 like the reference (see DTYPE_ENGINES)
+# and must find its solutions; in float32, rounding turns solutions without a real
+# neutrino momentum at large |eta| into real ones in a few percent of the events.
+TOLERANCES = {
+    "event": {
+        "weight": 1e-5,
+        "momentum": 1e-5,
+        "m_ttbar": None,
+        "max_mismatch_fraction": 0.0,
+    },
+    "bucketed": {
+        "weight": 1e-5,
+        "momentum": 1e-5,
+        "m_ttbar": None,
+        "max_mismatch_fraction": 0.0,
+    },
+    "scan": {
+        "weight": 1e-5,
+        "momentum": 1e-5,
+        "m_ttbar": None,
+        "max_mismatch_fraction": 0.0,
+    },
+    "adaptive": {
+        "weight": 0.05,
+        "momentum": None,
+        "m_ttbar": 0.3,
+        "max_mismatch_fraction": 0.2,
+    },
+    "analytic": {
+        "weight": 0.01,
+        "momentum": None,
+        "m_ttbar": 0.3,
+        "max_mismatch_fraction": 0.05,
+    },
+    "compiled": {
+        "weight": 1e-5,
+        "momentum": 1e-5,
+        "m_ttbar": None,
+        "max_mismatch_fraction": 0.0,
+    },
+}
+# Engines with a solver dtype option, and the dtype they are validated in by default
+DTYPE_ENGINES = ("event", "bucketed", "scan", "adaptive", "compiled")
+VALIDATION_DTYPE = "float64"
+
+
+def reference_event(event: Dict, idx: int, random_seed: int) -> Tuple[Tuple, float]:
+    """Reconstruct one event with naive_reco, drawing its smears from the same stream
+    as the engines (see event_rng).
+
+    :param event: Selected objects of the event by name.
+    :type event: Dict
+    :param idx: Event index.
+    :type idx: int
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :return: Best solution (see naive_reco.reconstruct_event) and time taken.
+    :rtype: Tuple[Tuple, float]
+    """
+    start = time.perf_counter()
+    solution = naive_reco.reconstruct_event(**event, idx=idx, rng=event_rng(random_seed, idx))
+    return solution, time.perf_counter() - start
+
+
+def reference_solutions(
+    selected: Dict,
+    leptons: Dict[str, np.ndarray],
+    event_idxs: np.ndarray,
+    random_seed: int,
+    n_workers: int = 1,
+) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """Reconstruct events with naive_reco, keeping the best solution whatever its weight.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict
+    :param leptons: Lepton pairs of the same events (see kinematics.dilepton_kinematics).
+    :type leptons: Dict[str, np.ndarray]
+    :param event_idxs: Events to reconstruct, with a lepton pair.
+    :type event_idxs: np.ndarray
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param n_workers: Number of processes, defaults to 1 (no pool).
+    :type n_workers: int, optional
+    :return: Reconstructed quantities of the events with a real solution (see
+             RECO_NAMES) and time taken by each event.
+    :rtype: Tuple[Dict[str, np.ndarray], np.ndarray]
+    """
+    events = [event_objects(selected, leptons, idx) for idx in event_idxs]
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=get_context("spawn")) as pool:
+            results = list(
+                pool.map(reference_event, events, event_idxs, [random_seed] * len(events))
+            )
+    else:
+        results = [
+            reference_event(event, idx, random_seed) for event, idx in zip(events, event_idxs)
+        ]
+
+    solutions = [solution for solution, _ in results if solution is not None]
+    recos = {
+        name: np.stack([np.ravel(solution[i]) for solution in solutions])
+        if solutions
+        else np.empty((0, 1 if name in ("idx", "weight") else 4))
+        for i, name in enumerate(RECO_NAMES)
+    }
+    return recos, np.array([seconds for _, seconds in results])
+
+
+def compare_engine(
+    reference: Dict[str, np.ndarray], engine: Dict[str, np.ndarray], tolerances: Dict
+) -> Dict:
+    """Compare the best solutions of an engine with the reference ones.
+
+    :param reference: Reconstructed quantities of naive_reco, for any weight.
+    :type reference: Dict[str, np.ndarray]
+    :param engine: Reconstructed quantities of the engine.
+    :type engine: Dict[str, np.ndarray]
+    :param tolerances: Tolerances of the engine (see TOLERANCES).
+    :type tolerances: Dict
+    :return: Differences with the reference and whether they are within tolerances.
+    :rtype: Dict
+    """
+    reference_weight = reference["weight"][:, 0]
+    accepted = reference["idx"][reference_weight >= MIN_WEIGHT, 0]
+    engine_idxs = engine["idx"][:, 0]
+    # Events near the weight cut can be kept by one and not by the other
+    borderline = reference["idx"][np.abs(reference_weight - MIN_WEIGHT) <= tolerances["weight"], 0]
+    missing = np.setdiff1d(np.setdiff1d(accepted, engine_idxs), borderline)
+    extra = np.setdiff1d(np.setdiff1d(engine_idxs, accepted), borderline)
+
+    common, reference_idx, engine_idx = np.intersect1d(
+        reference["idx"][:, 0], engine_idxs, return_indices=True
+    )
+    diffs = {
+        "weight": np.abs(engine["weight"][engine_idx, 0] - reference_weight[reference_idx]),
+        "momentum": np.zeros(len(common)),
+    }
+    for name in ["p_nu_t", "p_nu_tbar"]:
+        p_reference = reference[name][reference_idx]
+        distance = np.linalg.norm(engine[name][engine_idx] - p_reference, axis=1)
+        diffs["momentum"] = np.maximum(
+            diffs["momentum"], distance / np.maximum(p_reference[:, 3], 1)
+        )
+    m_ttbar = [
+        (
+            lorentz.FourVectorBatch.from_array(recos["p_top"][idx])
+            + lorentz.FourVectorBatch.from_array(recos["p_tbar"][idx])
+        ).mass
+        for recos, idx in [(reference, reference_idx), (engine, engine_idx)]
+    ]
+    diffs["m_ttbar"] = np.abs(m_ttbar[1] - m_ttbar[0]) / m_ttbar[0]
+    same_bjets = np.all(
+        np.isclose(engine["p_b_t"][engine_idx], reference["p_b_t"][reference_idx], rtol=1e-4)
+        & np.isclose(
+            engine["p_b_tbar"][engine_idx], reference["p_b_tbar"][reference_idx], rtol=1e-4
+        ),
+        axis=1,
+    )
+    mismatched = np.zeros(len(common), dtype=bool)
+    for name, diff in diffs.items():
+        if tolerances[name] is not None:
+            mismatched |= diff > tolerances[name]
+
+    unmatched = np.union1d(missing, extra)
+    n_compared = len(np.union1d(common, unmatched))
+    n_mismatched = len(np.union1d(common[mismatched], unmatched))
+    mismatch_fraction = n_mismatched / n_compared if n_compared else 0.0
+    report = {
+        "n_reference": int(len(accepted)),
+        "n_engine": int(len(engine_idxs)),
+        "n_common": int(len(common)),
+        "missing": missing.tolist(),
+        "extra": extra.tolist(),
+        "mismatched": common[mismatched].tolist(),
+    }
+    for name, diff in diffs.items():
+        report[f"{name}_diff_max"] = float(np.max(diff)) if len(common) else 0.0
+        report[f"{name}_diff_median"] = float(np.median(diff)) if len(common) else 0.0
+    report.update(
+        {
+            "same_bjets_fraction": float(np.mean(same_bjets)) if len(common) else 1.0,
+            "mismatch_fraction": mismatch_fraction,
+            "tolerances": tolerances,
+            "passed": mismatch_fraction <= tolerances["max_mismatch_fraction"],
+        }
+    )
+    return report
+
+
+def per_event_speedup(
+    reference_times: Dict[int, float], engine_times: Dict[int, float]
+) -> Dict[str, float]:
+    """Summarize the ratios of reference to engine time of the events timed by both.
+
+    :param reference_times: Time taken by the reference by event index.
+    :type reference_times: Dict[int, float]
+    :param engine_times: Time taken by the engine by event index.
+    :type engine_times: Dict[int, float]
+    :return: Number of events, median and 10th and 90th percentiles of the ratios
+             (None without common events).
+    :rtype: Dict[str, float]
+    """
+    common = sorted(set(reference_times) & set(engine_times))
+    ratios = np.array([reference_times[idx] / max(engine_times[idx], 1e-9) for idx in common])
+    if not len(ratios):
+        return {"n_events": 0, "median": None, "p10": None, "p90": None}
+    return {
+        "n_events": len(ratios),
+        "median": float(np.median(ratios)),
+        "p10": float(np.percentile(ratios, 10)),
+        "p90": float(np.percentile(ratios, 90)),
+    }
+
+
+def validate_engines(
+    selected: Dict,
+    n_events: int,
+    random_seed: int,
+    engines: List[str] = ENGINES,
+    engine_options: Dict[str, Dict] = None,
+    n_workers: int = 1,
+) -> Dict:
+    """Reconstruct events with naive_reco and with each engine using the same smears,
+    and compare their best solutions. The reference is run on every event with a
+    lepton pair and two b-jets, so events accepted by the reference that the
+    preselection (see preselect_events) rejects are reported. Engines only see the
+    preselected events and are compared with the reference on them.
+
+    :param selected: Selected objects' kinematics by name (see event_selection.select_objects).
+    :type selected: Dict
+    :param n_events: Number of events, starting from the first one.
+    :type n_events: int
+    :param random_seed: Seed of the run.
+    :type random_seed: int
+    :param engines: Engines to validate, defaults to ENGINES.
+    :type engines: List[str], optional
+    :param engine_options: Options of each engine (see reconstruct_batch), defaults to None
+                           (VALIDATION_DTYPE for the engines in DTYPE_ENGINES).
+    :type engine_options: Dict[str, Dict], optional
+    :param n_workers: Number of processes of the reference, defaults to 1.
+    :type n_workers: int, optional
+    :return: Preselection check, and timings and comparison with the reference of
+             each engine. Per-event speedups of the batch engines use their per-batch
+             latency estimates (see profiling.Profiler).
+    :rtype: Dict
+    """
+    engine_options = engine_options or {}
+    selected = {name: column[:n_events] for name, column in selected.items()}
+    leptons = kinematics.dilepton_kinematics(selected)
+    candidate_idxs = np.nonzero(leptons["valid"] & (selected["bjets_pt"].counts >= 2))[0]
+    preselected = preselect_events(selected, leptons=leptons)
+    event_idxs = np.nonzero(preselected)[0]
+    all_reference, all_times = reference_solutions(
+        selected, leptons, candidate_idxs, random_seed, n_workers=n_workers
+    )
+    reference_idxs = all_reference["idx"][:, 0].astype(np.int64)
+    accepted = reference_idxs[all_reference["weight"][:, 0] >= MIN_WEIGHT]
+    rows = preselected[reference_idxs]
+    reference = {name: values[rows] for name, values in all_reference.items()}
+    reference_times = dict(zip(candidate_idxs.tolist(), all_times))
+    preselected_times = [reference_times[idx] for idx in event_idxs]
+    report = {
+        "n_events": n_events,
+        "n_candidates": int(len(candidate_idxs)),
+        "n_preselected": int(len(event_idxs)),
+        "preselection_rejected": accepted[~preselected[accepted]].tolist(),
+        "reference_time_per_event": float(np.mean(preselected_times)) if len(event_idxs) else 0.0,
+        "engines": {},
+    }
+
+    for engine in engines:
+        options = engine_options.get(
+            engine, {"dtype": VALIDATION_DTYPE} if engine in DTYPE_ENGINES else None
+        )
+        # The first call includes JIT compilations
+        start = time.perf_counter()
+        reconstruct_batch(
+            selected, 0, n_events, random_seed, progress=False, engine=engine,
+            engine_options=options, leptons=leptons,
+        )
+        first_call_time = time.perf_counter() - start
+        start = time.perf_counter()
+        outputs, profiler = profiling.run_profiled(
+            reconstruct_batch, selected, 0, n_events, random_seed, progress=False,
+            engine=engine, engine_options=options, leptons=leptons,
+        )
+        engine_time = time.perf_counter() - start
+        engine_times = {
+            idx: seconds for (_, idx), seconds in zip(profiler.event_keys, profiler.event_times)
+        }
+
+        time_per_event = engine_time / max(len(event_idxs), 1)
+        report["engines"][engine] = {
+            "first_call_time": first_call_time,
+            "time_per_event": time_per_event,
+            "mean_time_speedup": report["reference_time_per_event"] / time_per_event,
+            "speedup": per_event_speedup(reference_times, engine_times),
+            "speedup_estimated": engine in profiler.estimated_engines,
+            **compare_engine(reference, outputs, TOLERANCES[engine]),
+        }
+    return report
+
+
+def assert_agreement(report: Dict):
+    """Raise if any engine disagrees with the reference beyond its tolerances, or if
+    the preselection rejected events accepted by the reference.
+
+    :param report: Report of validate_engines.
+    :type report: Dict
+    :raises AssertionError: If an engine or the preselection failed the validation.
+    """
+    rejected = report.get("preselection_rejected", [])
+    assert not rejected, f"Preselection rejected events accepted by the reference: {rejected}"
+    failed = {
+        engine: {
+            name: result[name]
+            for name in ["missing", "extra", "mismatched", "mismatch_fraction"]
+        }
+        for engine, result in report["engines"].items()
+        if not result["passed"]
+    }
+    assert not failed, f"Engines disagree with the reference: {failed}"
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "path", nargs="?", default=None, help="Delphes ROOT file (synthetic events if omitted)"
+    )
+    parser.add_argument("--n_events", type=int, default=20)
+    parser.add_argument("--random_seed", type=int, default=0)
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=ENGINES)
+    parser.add_argument(
+        "--dtype", default=VALIDATION_DTYPE, help="Solver dtype of the grid engines"
+    )
+    parser.add_argument("--n_workers", type=int, default=1, help="Processes of the reference")
+    parser.add_argument("--output", default=None, help="Save report as JSON")
+    args = parser.parse_args()
+
+    if args.path is None:
+        events = synthetic.generate_ttbar_dilepton(args.n_events, args.random_seed)
+    else:
+        events = BranchCache(uproot.open(args.path)["Delphes"], entrystop=args.n_events)
+    selected = event_selection.select_objects(events)
+    report = validate_engines(
+        selected,
+        n_events=len(events),
+        random_seed=args.random_seed,
+        engines=args.engines,
+        engine_options={
+            engine: {"dtype": args.dtype}
+            for engine in DTYPE_ENGINES
+        },
+        n_workers=args.n_workers,
+    )
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    assert_agreement(report)
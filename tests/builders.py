@@ -0,0 +1,38 @@
+import numpy as np
+
+from awkward.array.jagged import JaggedArray
+
+from processing import synthetic
+
+
+BRANCHES = {
+    "jets": ("Jet", ["PT", "Eta", "Phi", "Mass", "BTag"]),
+    "electrons": ("Electron", ["PT", "Eta", "Phi", "Charge"]),
+    "muons": ("Muon", ["PT", "Eta", "Phi", "Charge"]),
+}
+INTEGER_BRANCHES = ("BTag", "Charge")
+
+
+def jagged(values_per_event, dtype=np.float32) -> JaggedArray:
+    """Build a JaggedArray from a list of values of each event."""
+    counts = [len(values) for values in values_per_event]
+    content = np.array([value for values in values_per_event for value in values], dtype=dtype)
+    return JaggedArray.fromcounts(counts, content)
+
+
+def delphes_tree(events) -> synthetic.SyntheticTree:
+    """Build Delphes-like events from a list of dicts with the 'jets' (pt, eta, phi,
+    mass, btag), 'electrons' and 'muons' (pt, eta, phi, charge) of each event, and
+    optionally its 'met' (MET, phi).
+    """
+    columns = {}
+    for collection, (prefix, names) in BRANCHES.items():
+        for i, name in enumerate(names):
+            columns[f"{prefix}.{name}"] = jagged(
+                [[obj[i] for obj in event.get(collection, [])] for event in events],
+                dtype=np.int32 if name in INTEGER_BRANCHES else np.float32,
+            )
+    met = [event.get("met", (0.0, 0.0)) for event in events]
+    columns["MissingET.MET"] = jagged([[value] for value, _ in met])
+    columns["MissingET.Phi"] = jagged([[phi] for _, phi in met])
+    return synthetic.SyntheticTree(columns, len(events))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules of reconstruct/ import each other by name, as when run from that directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "reconstruct")]
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from processing import synthetic
+import analytic_solver
+import ttbar_dilepton
+
+
+def ttbar_decays(n_events: int, random_seed: int = 0):
+    """Decay on-shell tops into W b and Ws into massless leptons and neutrinos."""
+    rng = np.random.default_rng(random_seed)
+    decays = {}
+    for name in ["t", "tbar"]:
+        top = synthetic.generate_tops(rng, n_events)
+        w, b = synthetic.two_body_decay(rng, top, synthetic.M_W, synthetic.M_B)
+        l, nu = synthetic.two_body_decay(rng, w, 0, 0)
+        decays.update({f"p_l_{name}": l, f"p_b_{name}": b, f"p_nu_{name}": nu})
+    return decays
+
+
+def solve(decays, m_t=synthetic.M_TOP):
+    met = decays["p_nu_t"] + decays["p_nu_tbar"]
+    return analytic_solver.solve_dilepton(
+        p_l_t=decays["p_l_t"],
+        p_l_tbar=decays["p_l_tbar"],
+        p_b_t=decays["p_b_t"],
+        p_b_tbar=decays["p_b_tbar"],
+        met_x=met[:, 0],
+        met_y=met[:, 1],
+        m_t=np.full(len(met), m_t),
+        m_w=synthetic.M_W,
+    )
+
+
+def test_solve_dilepton_recovers_generated_neutrinos():
+    decays = ttbar_decays(50)
+    p_nu_t, p_nu_tbar, valid = solve(decays)
+
+    distance = np.linalg.norm(p_nu_t - decays["p_nu_t"][:, None], axis=2) + np.linalg.norm(
+        p_nu_tbar - decays["p_nu_tbar"][:, None], axis=2
+    )
+    distance = np.where(valid, distance, np.inf)
+    relative = distance.min(axis=1) / decays["p_nu_t"][:, 3]
+    assert np.all(relative < 1e-6)
+
+
+@pytest.mark.parametrize("m_t", [171.0, 172.5, 174.0])
+def test_solve_dilepton_solutions_satisfy_constraints(m_t):
+    decays = ttbar_decays(50, random_seed=1)
+    p_nu_t, p_nu_tbar, valid = solve(decays, m_t=m_t)
+    assert valid.any()
+
+    rows, solutions = np.nonzero(valid)
+    met = decays["p_nu_t"] + decays["p_nu_tbar"]
+    for name, p_nu in [("t", p_nu_t), ("tbar", p_nu_tbar)]:
+        p_nu = p_nu[rows, solutions]
+        p_w = decays[f"p_l_{name}"][rows] + p_nu
+        p_top = p_w + decays[f"p_b_{name}"][rows]
+        np.testing.assert_allclose(
+            np.sqrt(analytic_solver.minkowski_square(p_w)), synthetic.M_W, rtol=1e-6
+        )
+        np.testing.assert_allclose(
+            np.sqrt(analytic_solver.minkowski_square(p_top)), m_t, rtol=1e-6
+        )
+        # Massless neutrinos
+        assert np.all(np.abs(analytic_solver.minkowski_square(p_nu)) < 1e-6 * p_nu[:, 3] ** 2)
+    np.testing.assert_allclose(
+        (p_nu_t + p_nu_tbar)[rows, solutions, :2], met[rows, :2], atol=1e-6
+    )
+
+
+def test_root_grid_weights_use_grid_points_around_the_root():
+    decays = ttbar_decays(20, random_seed=2)
+    n = len(decays["p_l_t"])
+    nu_eta = np.stack(
+        [
+            synthetic.lorentz.FourVectorBatch.from_array(decays[name]).eta
+            for name in ["p_nu_t", "p_nu_tbar"]
+        ],
+        axis=1,
+    )
+    inside = np.all(np.abs(nu_eta) < 4.5, axis=1)
+    # Missing ET of the solution at the grid point nearest to each neutrino
+    step = ttbar_dilepton.NU_ETA_RANGE[1] - ttbar_dilepton.NU_ETA_RANGE[0]
+    grid_eta = ttbar_dilepton.NU_ETA_RANGE[0] + step * np.rint(
+        (nu_eta - ttbar_dilepton.NU_ETA_RANGE[0]) / step
+    )
+    m_b = np.full((n, 1), synthetic.M_B)
+    m_t = np.full((n, 1), synthetic.M_TOP)
+    with ttbar_dilepton.enable_x64():
+        nu_t_px, nu_t_py, nu_tbar_px, nu_tbar_py, real = (
+            np.asarray(array)
+            for array in ttbar_dilepton.get_neutrino_momentum_real(
+                nu_eta_t=grid_eta[:, 0:1],
+                p_l_t=decays["p_l_t"],
+                p_b_t=decays["p_b_t"],
+                m_b_t=m_b,
+                nu_eta_tbar=grid_eta[:, 1:],
+                p_l_tbar=decays["p_l_tbar"],
+                p_b_tbar=decays["p_b_tbar"],
+                m_b_tbar=m_b,
+                m_t_val=m_t,
+            )
+        )
+    # First of the 4 combinations of both neutrinos' solutions
+    grid_met = np.concatenate([nu_t_px + nu_tbar_px, nu_t_py + nu_tbar_py], axis=1)[:n]
+    has_grid_solution = inside & real[:n, 0]
+    assert has_grid_solution.any()
+
+    kwargs = {
+        "p_l_t": decays["p_l_t"],
+        "p_l_tbar": decays["p_l_tbar"],
+        "p_b_t": decays["p_b_t"],
+        "p_b_tbar": decays["p_b_tbar"],
+        "m_b_t": m_b,
+        "m_b_tbar": m_b,
+        "m_t": m_t[:, 0],
+        "nu_eta": nu_eta,
+    }
+    weights = ttbar_dilepton.root_grid_weights(met=grid_met, **kwargs)
+    np.testing.assert_allclose(weights[has_grid_solution], 1)
+    # Far from any grid solution's missing ET, the weight vanishes
+    far_weights = ttbar_dilepton.root_grid_weights(met=grid_met + 1000, **kwargs)
+    assert np.all(far_weights < 1e-6)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from builders import delphes_tree
+from processing import event_selection, synthetic
+from ttbar_dilepton import bjets_bucket, reconstruct_batch
+
+
+def event_dicts(tree):
+    """Objects of each event of a tree as the dicts of builders.delphes_tree."""
+    def objects(prefix, names):
+        columns = [tree[f"{prefix}.{name}"].array() for name in names]
+        return [list(zip(*values)) for values in zip(*columns)]
+
+    jets = objects("Jet", ["PT", "Eta", "Phi", "Mass", "BTag"])
+    electrons = objects("Electron", ["PT", "Eta", "Phi", "Charge"])
+    muons = objects("Muon", ["PT", "Eta", "Phi", "Charge"])
+    met = objects("MissingET", ["MET", "Phi"])
+    return [
+        {"jets": jets[i], "electrons": electrons[i], "muons": muons[i], "met": met[i][0]}
+        for i in range(len(tree))
+    ]
+
+
+@pytest.mark.parametrize(
+    "n_bjets, bucket", [(2, 2), (3, 3), (5, 5), (6, 6), (7, 8), (8, 8), (9, 16), (16, 16)]
+)
+def test_bjets_bucket(n_bjets, bucket):
+    assert bjets_bucket(n_bjets) == bucket
+    assert bjets_bucket(np.int64(n_bjets)) == bucket
+
+
+def test_compiled_matches_bucketed():
+    events = event_dicts(synthetic.generate_ttbar_dilepton(30, random_seed=7))
+    # Extra central b-jets, so some events are padded to a larger bucket
+    for i, event in enumerate(events[::3]):
+        event["jets"] = event["jets"] + [
+            (40 + 5 * j, 0.3 * (j - 3), -3 + 0.9 * j, 5, 1) for j in range(i % 7 + 1)
+        ]
+    selected = event_selection.select_objects(delphes_tree(events))
+    assert max(bjets_bucket(n) for n in selected["bjets_pt"].counts if n >= 2) > 6
+
+    outputs = {
+        engine: reconstruct_batch(
+            selected, 0, len(events), random_seed=3, progress=False, engine=engine,
+            engine_options={"dtype": "float64"},
+        )
+        for engine in ["bucketed", "compiled"]
+    }
+    assert len(outputs["bucketed"]["idx"]) > 0
+    np.testing.assert_array_equal(outputs["compiled"]["idx"], outputs["bucketed"]["idx"])
+    for name, values in outputs["bucketed"].items():
+        np.testing.assert_allclose(outputs["compiled"][name], values, rtol=1e-5, atol=1e-3)
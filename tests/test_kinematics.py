@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from builders import jagged
+from processing import event_selection, kinematics
+
+EE = event_selection.CHANNEL_EE
+MUMU = event_selection.CHANNEL_MUMU
+EMU = event_selection.CHANNEL_EMU
+NONE = event_selection.CHANNEL_NONE
+
+# Selected electrons and muons of each event as (pt, charge), the expected channel and
+# the pt of the leptons from the top and anti-top quarks (None if not valid)
+EVENTS = [
+    ([(50, 1), (30, -1)], [], EE, (50, 30)),
+    ([(50, -1), (30, 1)], [], EE, (30, 50)),
+    ([], [(45, -1), (25, 1)], MUMU, (25, 45)),
+    ([(40, -1)], [(35, 1)], EMU, (35, 40)),
+    ([(40, 1)], [(35, -1)], EMU, (40, 35)),
+    # Two electrons take precedence over any muons, two muons over one electron
+    ([(60, -1), (20, 1)], [(70, 1)], EE, (20, 60)),
+    ([(60, 1), (20, -1)], [(70, 1), (65, -1)], EE, (60, 20)),
+    ([(80, 1)], [(70, 1), (65, -1)], MUMU, (70, 65)),
+    # Same-sign pairs
+    ([(50, 1), (30, 1)], [], EE, None),
+    ([(40, -1)], [(35, -1)], EMU, None),
+    # Not dilepton
+    ([(50, 1)], [], NONE, None),
+    ([(50, 1), (40, -1), (30, 1)], [], NONE, None),
+    ([], [], NONE, None),
+]
+
+
+def selected_leptons(events):
+    selected = {}
+    for i, flavour in enumerate(["electron", "muon"]):
+        leptons = [event[i] for event in events]
+        selected[f"{flavour}_pt"] = jagged([[pt for pt, _ in objects] for objects in leptons])
+        selected[f"{flavour}_charge"] = jagged(
+            [[charge for _, charge in objects] for objects in leptons], dtype=np.int32
+        )
+        selected[f"{flavour}_eta"] = jagged([[0.5] * len(objects) for objects in leptons])
+        selected[f"{flavour}_phi"] = jagged([[1.0] * len(objects) for objects in leptons])
+    return selected
+
+
+@pytest.fixture(scope="module")
+def pairs():
+    return kinematics.dilepton_kinematics(selected_leptons(EVENTS))
+
+
+def test_channels(pairs):
+    np.testing.assert_array_equal(pairs["channel"], [event[2] for event in EVENTS])
+    np.testing.assert_array_equal(pairs["valid"], [event[3] is not None for event in EVENTS])
+    assert set(event_selection.CHANNEL_NAMES) == {EE, MUMU, EMU}
+
+
+def test_positive_lepton_comes_from_the_top(pairs):
+    for i, (electrons, muons, channel, expected_pt) in enumerate(EVENTS):
+        if expected_pt is None:
+            continue
+        for name, pt in zip(["p_l_t", "p_l_tbar"], expected_pt):
+            assert np.hypot(*pairs[name][i, :2]) == pytest.approx(pt, rel=1e-6), (i, name)
+        if channel == EMU:
+            electron_is_t = electrons[0][1] == 1
+            m_l = [kinematics.M_ELECTRON, kinematics.M_MUON]
+            expected_masses = m_l if electron_is_t else m_l[::-1]
+        else:
+            expected_masses = [kinematics.M_ELECTRON if channel == EE else kinematics.M_MUON] * 2
+        assert [pairs["m_l_t"][i], pairs["m_l_tbar"][i]] == pytest.approx(expected_masses)
+
+
+def test_invalid_events_are_zero(pairs):
+    invalid = ~pairs["valid"]
+    for name in ["p_l_t", "p_l_tbar", "m_l_t", "m_l_tbar"]:
+        assert np.all(pairs[name][invalid] == 0), name
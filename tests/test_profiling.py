@@ -0,0 +1,133 @@
+import json
+import time
+
+import pytest
+
+from processing import event_selection, profiling, synthetic
+from processing.branch_cache import BranchCache
+import ttbar_dilepton
+
+
+@pytest.fixture
+def profiler():
+    profiler = profiling.enable()
+    yield profiler
+    profiling.disable()
+
+
+def test_instrumentation_does_nothing_when_profiling_is_off():
+    assert profiling.active() is None
+    with profiling.stage("selection"):
+        pass
+    with profiling.event(0):
+        pass
+    profiling.clock().lap("solve")
+    profiling.count_events(10, 5)
+    assert profiling.active() is None
+
+
+def test_stages_events_and_counts_are_recorded(profiler):
+    for _ in range(3):
+        with profiling.stage("selection"):
+            pass
+    clock = profiling.clock()
+    clock.lap("inputs")
+    clock.lap("solve")
+    for idx in range(4):
+        with profiling.event(idx, source_idx=1):
+            pass
+    profiling.count_events(10, 4)
+
+    report = profiler.report(n_slowest=2)
+    assert report["stages"]["selection"]["calls"] == 3
+    assert set(report["stages"]) == {"selection", "inputs", "solve"}
+    assert report["n_events"] == 10
+    assert report["n_reconstructed"] == 4
+    assert report["event_latency"]["n_events"] == 4
+    assert sum(report["event_latency"]["histogram"]["counts"]) == 4
+    assert len(report["slowest_events"]) == 2
+    assert all(event["source"] == 1 for event in report["slowest_events"])
+    times = [event["time"] for event in report["slowest_events"]]
+    assert times == sorted(times, reverse=True)
+
+
+def test_nested_stages_are_not_counted_twice(profiler):
+    with profiling.stage("selection"):
+        with profiling.stage("read"):
+            time.sleep(0.05)
+    stages = profiler.report()["stages"]
+    assert stages["read"]["time"] >= 0.05
+    assert stages["selection"]["time"] < 0.05
+
+
+def test_batch_events_share_the_batch_time(profiler):
+    with profiling.event(0):
+        pass
+    with profiling.batch([1, 2, 3, 4], source_idx=2, engine="bucketed"):
+        time.sleep(0.04)
+
+    report = profiler.report()
+    latency = report["event_latency"]
+    assert latency["n_events"] == 5
+    assert latency["n_estimated"] == 4
+    assert latency["per_batch_engines"] == ["bucketed"]
+    slowest = report["slowest_events"][0]
+    assert slowest["estimated"] and slowest["source"] == 2
+    assert 0.01 <= slowest["time"] < 0.04
+
+
+def test_worker_profilers_are_merged(profiler):
+    def work(n_events):
+        with profiling.stage("solve"):
+            profiling.count_events(n_events, n_events // 2)
+        return n_events
+
+    result, worker = profiling.run_profiled(work, 8)
+    assert result == 8
+    # The previous profiler is active again, without the worker's measurements
+    assert profiling.active() is profiler
+    assert profiler.n_events == 0
+
+    profiler.merge(worker)
+    profiler.merge(worker)
+    assert profiler.stages["solve"]["calls"] == 2
+    assert (profiler.n_events, profiler.n_reconstructed) == (16, 8)
+
+
+def test_report_is_saved_with_run_settings(profiler, tmp_path):
+    profiling.count_events(3, 1)
+    path = tmp_path / "profile.json"
+    profiling.save_report(str(path), engine="analytic", n_workers=1)
+    report = json.loads(path.read_text())
+    assert report["engine"] == "analytic"
+    assert report["n_events"] == 3
+
+
+@pytest.mark.parametrize(
+    "engine, stages",
+    [
+        ("event", ["inputs", "solve", "weighting"]),
+        ("bucketed", ["inputs", "padding", "solve", "solutions"]),
+        ("analytic", ["inputs", "solve", "weighting"]),
+        ("compiled", ["inputs", "solve", "solutions"]),
+    ],
+)
+def test_reconstruction_reports_its_stages(profiler, engine, stages):
+    events = BranchCache(synthetic.generate_ttbar_dilepton(30, 1))
+    with profiling.stage("selection"):
+        selected = event_selection.select_objects(events)
+    recos = ttbar_dilepton.reconstruct_batch(selected, 0, 30, 0, progress=False, engine=engine)
+
+    report = profiler.report()
+    assert report["n_events"] == 30
+    assert report["n_reconstructed"] == len(recos["idx"])
+    for name in ["read", "selection", "leptons", "preselection"] + stages:
+        assert name in report["stages"], name
+    # Every event given to the solver has a latency
+    latency = report["event_latency"]
+    assert latency["n_events"] >= len(recos["idx"]) > 0
+    if engine == "event":
+        assert latency["n_estimated"] == 0
+    else:
+        assert latency["n_estimated"] == latency["n_events"]
+        assert latency["per_batch_engines"] == [engine]
@@ -0,0 +1,76 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from processing import reco_store
+
+
+METADATA = {"random_seed": 0, "engine": "event", "grid": {"m_t_search": [171.0, 174.0, 7]}}
+
+
+def chunk(start: int, n_rows: int):
+    idx = np.arange(start, start + n_rows).reshape(-1, 1)
+    return {"idx": idx, "p_top": np.tile(idx, (1, 4)) * np.array([1.0, 2.0, 3.0, 4.0])}
+
+
+def test_appended_chunks_are_read_back_as_memory_maps(tmp_path):
+    path = str(tmp_path / "store")
+    reco_store.create_store(path, METADATA)
+    reco_store.append_chunk(path, chunk(0, 3), info={"batch_idx": 0})
+    header = reco_store.append_chunk(path, chunk(3, 2), info={"batch_idx": 1})
+
+    assert header["n_rows"] == 5
+    assert [c["batch_idx"] for c in header["chunks"]] == [0, 1]
+    assert [(c["start"], c["stop"]) for c in header["chunks"]] == [(0, 3), (3, 5)]
+    columns = reco_store.read_columns(path)
+    assert isinstance(columns["p_top"], np.memmap)
+    expected = {name: np.concatenate([chunk(0, 3)[name], chunk(3, 2)[name]]) for name in columns}
+    for name, array in columns.items():
+        np.testing.assert_array_equal(array, expected[name])
+        assert array.dtype == expected[name].dtype
+    assert not columns["idx"].flags.writeable
+
+
+def test_open_store_resumes_same_settings_and_rejects_others(tmp_path):
+    path = str(tmp_path / "store")
+    reco_store.open_store(path, METADATA)
+    reco_store.append_chunk(path, chunk(0, 4))
+
+    header = reco_store.open_store(path, json.loads(json.dumps(METADATA)))
+    assert header["n_rows"] == 4
+    with pytest.raises(ValueError):
+        reco_store.open_store(path, {**METADATA, "random_seed": 1})
+
+
+def test_interrupted_append_is_ignored_and_overwritten(tmp_path):
+    path = str(tmp_path / "store")
+    reco_store.write_store(path, chunk(0, 2), METADATA)
+    # Rows written to a column without reaching the header
+    with open(reco_store.column_path(path, "idx"), "ab") as f:
+        f.write(np.arange(10, dtype=np.int64).tobytes())
+    assert len(reco_store.read_column(path, "idx")) == 2
+
+    reco_store.append_chunk(path, chunk(2, 1))
+    np.testing.assert_array_equal(reco_store.read_column(path, "idx")[:, 0], [0, 1, 2])
+    assert os.path.getsize(reco_store.column_path(path, "idx")) == 3 * 8
+
+
+def test_chunks_must_match_the_store_columns(tmp_path):
+    path = str(tmp_path / "store")
+    reco_store.write_store(path, chunk(0, 2), METADATA)
+    with pytest.raises(ValueError):
+        reco_store.append_chunk(path, {"idx": np.zeros((1, 1), dtype=int)})
+    with pytest.raises(ValueError):
+        reco_store.append_chunk(path, {**chunk(0, 1), "p_top": np.zeros((1, 3))})
+    with pytest.raises(ValueError):
+        reco_store.append_chunk(
+            path, {"idx": np.zeros((2, 1), dtype=int), "p_top": np.zeros((1, 4))}
+        )
+
+
+def test_empty_store_has_no_rows(tmp_path):
+    path = str(tmp_path / "store")
+    reco_store.write_store(path, {name: array[:0] for name, array in chunk(0, 1).items()}, {})
+    assert reco_store.read_column(path, "p_top").shape == (0, 4)
@@ -0,0 +1,119 @@
+import numpy as np
+
+from builders import delphes_tree
+from processing import counts, cutflow, event_selection, kinematics, lorentz, synthetic, truth
+
+
+def test_generation_is_reproducible():
+    first = synthetic.generate_ttbar_dilepton(50, random_seed=3)
+    second = synthetic.generate_ttbar_dilepton(50, random_seed=3)
+    other = synthetic.generate_ttbar_dilepton(50, random_seed=4)
+    assert set(first) == set(second)
+    for key in first:
+        np.testing.assert_array_equal(first[key].array().content, second[key].array().content)
+    assert not np.array_equal(first["Jet.PT"].array().content, other["Jet.PT"].array().content)
+
+
+def test_generated_branches_are_delphes_like():
+    tree = synthetic.generate_ttbar_dilepton(200, random_seed=1)
+    assert len(tree) == 200
+    for prefix in ["Jet", "Electron", "Muon", "Particle"]:
+        counts = {
+            key: tuple(tree[key].array().counts) for key in tree if key.startswith(f"{prefix}.")
+        }
+        assert len(set(counts.values())) == 1, prefix
+    assert np.all(tree["MissingET.MET"].array().counts == 1)
+    # Objects are ordered by decreasing pt in each event
+    jet_pt = tree["Jet.PT"].array()
+    assert all(np.all(np.diff(pt) <= 0) for pt in jet_pt)
+
+
+def test_truth_record_holds_on_shell_decays():
+    tree = synthetic.generate_ttbar_dilepton(100, random_seed=2)
+    truth_index = truth.build_truth_index(tree)
+    assert all(np.all(index >= 0) for index in truth_index.values())
+
+    def momentum(name):
+        return lorentz.FourVectorBatch.from_array(truth.truth_four_momenta(tree, truth_index, name))
+
+    for top, w, b, lepton, nu in [
+        ("top", "w_plus", "b", "l_plus", "nu"),
+        ("tbar", "w_minus", "bbar", "l_minus", "nubar"),
+    ]:
+        np.testing.assert_allclose(momentum(top).mass, synthetic.M_TOP, rtol=1e-3)
+        np.testing.assert_allclose((momentum(lepton) + momentum(nu)).mass, synthetic.M_W, rtol=1e-3)
+        np.testing.assert_allclose(
+            (momentum(w) + momentum(b)).to_array(), momentum(top).to_array(), rtol=1e-3, atol=0.05
+        )
+
+
+def passing_event(**changes):
+    event = {
+        "jets": [(60, 0.5, 0.0, 10, 1), (50, -0.5, 2.0, 10, 1), (30, 1.0, -2.0, 5, 0)],
+        "electrons": [(40, 0.2, 1.0, 1), (35, -1.0, -1.0, -1)],
+        "muons": [],
+    }
+    event.update(changes)
+    return event
+
+
+def test_cutflow_on_hand_built_events():
+    events = delphes_tree(
+        [
+            passing_event(),
+            # Same-sign electrons
+            passing_event(electrons=[(40, 0.2, 1.0, 1), (35, -1.0, -1.0, 1)]),
+            # Second b-tagged jet below the pt cut
+            passing_event(jets=[(60, 0.5, 0.0, 10, 1), (20, -0.5, 2.0, 10, 1)]),
+            # Electron in the calorimeter crack and a muon: e mu channel
+            passing_event(
+                electrons=[(40, 1.4, 1.0, 1), (35, -1.0, -1.0, -1)],
+                muons=[(30, 0.0, 3.0, 1)],
+            ),
+            # Jets tagged by any working point are b-jets
+            passing_event(jets=[(60, 0.5, 0.0, 10, 2), (50, -0.5, 2.0, 10, 3)]),
+        ]
+    )
+    results = {result["name"]: result for result in cutflow.atlas_cutflow().run(events)}
+
+    # The 20 GeV jet fails the pt cut
+    assert results["jet_pt"]["n_objects"]["jet"] == 12
+    assert results["electron_crack_veto"]["n_objects"]["electron"] == 9
+    assert results["two_leptons"]["n_events"] == 5
+    assert results["two_leptons"]["channels"] == {"ee": 4, "mumu": 0, "emu": 1}
+    assert results["opposite_charge"]["n_events"] == 4
+    assert results["two_bjets"]["n_events"] == 3
+    assert results["two_bjets"]["channels"] == {"ee": 2, "mumu": 0, "emu": 1}
+
+
+def test_cutflow_agrees_with_the_selection_on_synthetic_events():
+    events = synthetic.generate_ttbar_dilepton(500, random_seed=5)
+    results = cutflow.atlas_cutflow().run(events)
+
+    n_events = [result["n_events"] for result in results]
+    assert n_events == sorted(n_events, reverse=True)
+    for collection in ["jet", "electron", "muon"]:
+        n_objects = [result["n_objects"][collection] for result in results]
+        assert n_objects == sorted(n_objects, reverse=True)
+    for result in results:
+        if result["name"] in ("two_leptons", "opposite_charge", "two_bjets"):
+            assert sum(result["channels"].values()) == result["n_events"]
+
+    selected = event_selection.select_objects(events)
+    leptons = kinematics.dilepton_kinematics(selected)
+    n_leptons = selected["electron_pt"].counts + selected["muon_pt"].counts
+    charge = selected["electron_charge"].sum() + selected["muon_charge"].sum()
+    passed = (n_leptons == 2) & (charge == 0) & (selected["bjets_pt"].counts >= 2)
+    assert results[-1]["n_events"] == passed.sum()
+    assert np.all(leptons["valid"][passed])
+
+
+def test_btag_working_point_is_opt_in():
+    events = delphes_tree(
+        [{"jets": [(60, 0.5, 0.0, 10, 1), (50, -0.5, 2.0, 10, 2), (40, 1.0, -2.0, 5, 3)]}]
+    )
+    btag = events["Jet.BTag"].array()
+    assert event_selection.select_bjet(btag).tolist() == [[True, True, True]]
+    assert event_selection.select_bjet(btag, btag_bit=1).tolist() == [[False, True, True]]
+    assert counts.n_particles_from_tag(events, "Jet.BTag").tolist() == [3]
+    assert counts.n_particles_from_tag(events, "Jet.BTag", btag_bit=0).tolist() == [2]
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from builders import delphes_tree
+from processing import event_selection, synthetic
+from ttbar_dilepton import MIN_WEIGHT, RECO_NAMES
+from validate_engines import (
+    TOLERANCES,
+    assert_agreement,
+    compare_engine,
+    per_event_speedup,
+    validate_engines,
+)
+
+
+def fake_recos(weights, random_seed=0):
+    """Reconstructed quantities of events 0, 1, ... with the given weights."""
+    rng = np.random.default_rng(random_seed)
+    n = len(weights)
+    recos = {
+        name: np.abs(rng.normal(100, 30, size=(n, 4))) + [0, 0, 0, 300]
+        for name in RECO_NAMES
+        if name not in ("idx", "weight")
+    }
+    recos["idx"] = np.arange(n).reshape(-1, 1)
+    recos["weight"] = np.array(weights, dtype=float).reshape(-1, 1)
+    return recos
+
+
+def accepted(recos):
+    keep = recos["weight"][:, 0] >= MIN_WEIGHT
+    return {name: values[keep] for name, values in recos.items()}
+
+
+def test_identical_solutions_pass():
+    reference = fake_recos([0.9, 0.8, 0.1, 0.7])
+    report = compare_engine(reference, accepted(reference), TOLERANCES["event"])
+    assert report["passed"]
+    assert report["n_reference"] == report["n_engine"] == report["n_common"] == 3
+    assert report["missing"] == report["extra"] == report["mismatched"] == []
+    assert report["weight_diff_max"] == report["momentum_diff_max"] == 0
+
+
+def test_differences_beyond_tolerances_fail():
+    reference = fake_recos([0.9, 0.8, 0.1, 0.7, 0.6])
+    engine = accepted(reference)
+    engine["p_nu_t"][0, 0] += 1.0
+    engine["weight"][1] -= 1e-3
+    # Event 4 is missing
+    engine = {name: values[:-1] for name, values in engine.items()}
+    report = compare_engine(reference, engine, TOLERANCES["event"])
+    assert not report["passed"]
+    assert report["mismatched"] == [0, 1]
+    assert report["missing"] == [4]
+    assert report["mismatch_fraction"] == pytest.approx(3 / 4)
+    with pytest.raises(AssertionError, match="event"):
+        assert_agreement({"engines": {"event": report}})
+
+    # Momenta aren't compared for the adaptive engine
+    report = compare_engine(reference, engine, TOLERANCES["adaptive"])
+    assert report["mismatched"] == []
+
+
+def test_borderline_weights_are_not_missing():
+    reference = fake_recos([0.9, MIN_WEIGHT + 1e-6])
+    engine = {name: values[:1] for name, values in reference.items()}
+    report = compare_engine(reference, engine, TOLERANCES["event"])
+    assert report["missing"] == []
+    assert report["passed"]
+
+
+def test_per_event_speedup():
+    speedup = per_event_speedup({0: 1.0, 1: 2.0, 2: 3.0}, {1: 0.5, 2: 1.0, 3: 1.0})
+    assert speedup["n_events"] == 2
+    assert speedup["median"] == pytest.approx(3.5)
+    assert per_event_speedup({0: 1.0}, {})["median"] is None
+
+
+def test_preselection_rejecting_accepted_events_fails():
+    with pytest.raises(AssertionError, match="Preselection"):
+        assert_agreement({"preselection_rejected": [3], "engines": {}})
+
+
+def test_reference_runs_on_events_rejected_by_the_preselection():
+    # Leptons and b-jets back to back, too heavy to come from the same top
+    events = delphes_tree(
+        [
+            {
+                "jets": [(300, -2.0, 3.0, 10, 1), (300, -2.0, -2.8, 10, 1)],
+                "electrons": [(200, 2.0, 0.0, 1), (200, 2.0, 0.5, -1)],
+            }
+        ]
+    )
+    report = validate_engines(
+        event_selection.select_objects(events), 1, random_seed=0, engines=["event"]
+    )
+    assert (report["n_candidates"], report["n_preselected"]) == (1, 0)
+    assert report["preselection_rejected"] == []
+    assert report["engines"]["event"]["passed"]
+
+
+def test_full_grid_engines_agree_with_the_reference():
+    events = synthetic.generate_ttbar_dilepton(40, random_seed=0)
+    selected = event_selection.select_objects(events)
+    report = validate_engines(selected, 40, random_seed=0, engines=["event", "bucketed"])
+    assert report["n_candidates"] >= report["n_preselected"] > 0
+    assert report["preselection_rejected"] == []
+    assert_agreement(report)
+    for engine, result in report["engines"].items():
+        assert result["n_common"] == result["n_reference"] > 0
+        assert result["mismatched"] == []
+        assert result["speedup"]["n_events"] > 0
+        assert result["speedup_estimated"] == (engine != "event")